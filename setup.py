@@ -43,6 +43,13 @@ setup(
         "google-auth-httplib2",
         "google-auth-oauthlib",
     ],
+    extras_require={
+        "async": ["aiohttp"],
+        "brotli": ["brotli"],
+        "watch": ["inotify_simple"],
+        "numpy": ["numpy"],
+        "parquet": ["pyarrow"],
+    },
     entry_points={
         "console_scripts": [
             "itg-list-gcals=itg.tools.list_google_calendars:sys_main",
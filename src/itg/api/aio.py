@@ -0,0 +1,279 @@
+import asyncio
+import logging
+
+from typing import Dict, List, Any
+from urllib.parse import quote
+
+import icalendar
+
+from itg.api.events import event_field, EVENT_ID
+from itg.api.logs import log_event
+from itg.api.google import time_window, event_matches, compact_event, EVENT_PROJECTION, MAX_RESULTS, default_pool, CredentialPool
+from itg.api.outlook import load_calendar_from_path, save_calendar_data, accept_encoding, DEFAULT_TIMEOUT
+from itg.api.sync import event_body, BodyCache, SyncExecutor, ACTION_ADD, ACTION_UPDATE, ACTION_DELETE
+from itg.api.transport import get_transport, MODE_LIVE
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+CALENDAR_API_URL = "https://www.googleapis.com/calendar/v3"
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.aio")
+    return _logger
+
+
+def new_session(timeout: float = DEFAULT_TIMEOUT):
+    """
+    Creates a new HTTP client session for use with the async functions.
+    Requires the optional aiohttp library (pip install ical_to_gcal[async]).
+
+    :param timeout: the timeout in seconds for each request, no timeout if None
+    :type timeout: float
+    :return: the session
+    :rtype: aiohttp.ClientSession
+    """
+    if aiohttp is None:
+        raise Exception("The async backend requires the aiohttp library, e.g.: pip install aiohttp")
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def _headers(credentials: str, pool: CredentialPool = None) -> Dict[str, str]:
+    """
+    Returns the HTTP headers for authenticating with Google. The token gets obtained from the
+    credential pool, which refreshes it if necessary (see CredentialPool.token).
+
+    :param credentials: the credentials JSON file to use
+    :type credentials: str
+    :param pool: the credential pool to obtain the token from, uses default_pool() if None
+    :type pool: CredentialPool
+    :return: the headers
+    :rtype: dict
+    """
+    if pool is None:
+        pool = default_pool()
+    # refreshing blocks, don't stall the event loop
+    token = await asyncio.get_running_loop().run_in_executor(None, pool.token, credentials)
+    return {"Authorization": "Bearer %s" % token}
+
+
+async def _request(session, credentials: str, method: str, url: str, params: Dict = None, body: Dict = None,
+                   pool: CredentialPool = None):
+    """
+    Executes the Calendar API request.
+
+    :param session: the HTTP client session to use
+    :param credentials: the credentials JSON file to use
+    :type credentials: str
+    :param method: the HTTP method
+    :type method: str
+    :param url: the URL to send the request to
+    :type url: str
+    :param params: the query parameters, can be None
+    :type params: dict
+    :param body: the JSON body, can be None
+    :type body: dict
+    :param pool: the credential pool to obtain the token from, see _headers
+    :type pool: CredentialPool
+    :return: the decoded JSON response, None if empty
+    """
+    headers = await _headers(credentials, pool=pool)
+    async with session.request(method, url, params=params, json=body, headers=headers) as r:
+        if r.status >= 400:
+            # first line without event specifics, see itg.api.sync.error_signature
+            raise Exception("Request failed with status code %d\n%s %s\n%s" % (r.status, method, url, await r.text()))
+        if r.status == 204:
+            return None
+        return await r.json()
+
+
+async def load_calendar_async(session, path_or_url: str, output_file: str = None, output_keep: int = 0) -> icalendar.Calendar:
+    """
+    Loads the shared Outlook calendar by its public .ics path or URL.
+    The download uses the timeout of the session (see new_session).
+
+    :param session: the HTTP client session to use
+    :param path_or_url: the path or URL of the calendar to load
+    :type path_or_url: str
+    :param output_file: the file to save the calendar to, ignored if None
+    :type output_file: str
+    :param output_keep: the number of previous versions of the output file to keep
+    :type output_keep: int
+    :return: the calendar
+    :rtype: icalendar.Calendar
+    """
+    loop = asyncio.get_running_loop()
+    if not (path_or_url.startswith("http:") or path_or_url.startswith("https:")):
+        return await loop.run_in_executor(None, load_calendar_from_path, path_or_url, output_file, output_keep)
+
+    logger().info("Downloading calendar: %s" % path_or_url)
+    async with session.get(path_or_url, headers={"Accept-Encoding": accept_encoding()}) as r:
+        if r.status != 200:
+            raise Exception("Failed to retrieve Outlook calendar '%s', status code: %d" % (path_or_url, r.status))
+        data = await r.read()
+    if output_file is not None:
+        save_calendar_data(data, output_file, keep=output_keep)
+    return await loop.run_in_executor(None, icalendar.Calendar.from_ical, data)
+
+
+async def filter_events_async(session, credentials: str, calendar: str, regexp_id: str = None, regexp_summary: str = None,
+                              pool: CredentialPool = None) -> List:
+    """
+    Filters the events from Google calendar.
+
+    :param session: the HTTP client session to use
+    :param credentials: the credentials JSON file to use
+    :type credentials: str
+    :param calendar: the name of the calendar to retrieve
+    :type calendar: str
+    :param regexp_id: the regular expression that the event IDs must match, ignored if None
+    :type regexp_id: str
+    :param regexp_summary: the regular expression that the event summaries must match, ignored if None
+    :type regexp_summary: str
+    :param pool: the credential pool to obtain the token from, uses default_pool() if None
+    :type pool: CredentialPool
+    :return: the list of events
+    :rtype: list
+    """
+    result = []
+    time_min, time_max = time_window()
+    url = "%s/calendars/%s/events" % (CALENDAR_API_URL, quote(calendar, safe=""))
+    params = {
+        "showDeleted": "true",
+        "timeMin": time_min,
+        "timeMax": time_max,
+        "maxResults": str(MAX_RESULTS),
+        "fields": "items(%s),nextPageToken" % ",".join(EVENT_PROJECTION),
+    }
+
+    while True:
+        events = await _request(session, credentials, "GET", url, params=params, pool=pool)
+        for event in events.get("items", []):
+            if event_matches(event, regexp_id=regexp_id, regexp_summary=regexp_summary):
+                result.append(compact_event(event))
+        if "nextPageToken" not in events:
+            break
+        params["pageToken"] = events["nextPageToken"]
+
+    return result
+
+
+async def sync_async(session, credentials: str, gcalendar: str, actions: Dict[str, List], dry_run: bool = False,
+                     concurrency: int = 10, journal: str = None, max_identical_errors: int = None,
+                     bodies: BodyCache = None, pool: CredentialPool = None) -> Dict[str, List[Any]]:
+    """
+    Performs the sync, with up to the specified number of mutations in flight. Scheduling,
+    journal and aborting after repeated identical errors are handled by
+    itg.api.sync.SyncExecutor like with itg.api.sync.sync, with errors counted in the
+    order the requests complete.
+
+    :param session: the HTTP client session to use
+    :param credentials: the credentials JSON file to use
+    :type credentials: str
+    :param gcalendar: the Google Calendar to use
+    :type gcalendar: str
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
+    :type dry_run: bool
+    :param concurrency: the maximum number of concurrent requests
+    :type concurrency: int
+    :param journal: the journal file to record planned/completed mutations in, ignored if None or dry-run; removed once all mutations succeeded
+    :type journal: str
+    :param max_identical_errors: the number of consecutive identical errors after which to abort, never aborts if None
+    :type max_identical_errors: int
+    :param bodies: the request body cache of the sync cycle, ignored if None
+    :type bodies: BodyCache
+    :param pool: the credential pool to obtain the token from, uses default_pool() if None
+    :type pool: CredentialPool
+    :return: the dictionary with events per action that failed: action -> list of tuples; with last element in tuple the exception string
+    :rtype: dict
+    """
+    executor = SyncExecutor(gcalendar, actions, dry_run=dry_run, journal=journal, max_identical_errors=max_identical_errors)
+    url = "%s/calendars/%s/events" % (CALENDAR_API_URL, quote(gcalendar, safe=""))
+
+    async def execute(action, item):
+        try:
+            if action == ACTION_ADD:
+                log_event(logger(), logging.INFO, "adding", uid=event_field(item, EVENT_ID))
+                if not dry_run:
+                    await _request(session, credentials, "POST", url, body=event_body(item, bodies), pool=pool)
+            elif action == ACTION_UPDATE:
+                log_event(logger(), logging.INFO, "updating", uid=event_field(item[0], EVENT_ID), id=event_field(item[1], EVENT_ID))
+                if not dry_run:
+                    await _request(session, credentials, "PUT", "%s/%s" % (url, event_field(item[1], EVENT_ID)), body=event_body(item[0], bodies), pool=pool)
+            elif action == ACTION_DELETE:
+                log_event(logger(), logging.INFO, "deleting", id=event_field(item, EVENT_ID))
+                if not dry_run:
+                    await _request(session, credentials, "DELETE", "%s/%s" % (url, event_field(item, EVENT_ID)), pool=pool)
+            executor.succeeded(action, item)
+        except Exception as e:
+            executor.failed(action, item, e)
+
+    # fixed number of workers pulling from the shared iterator
+    items = executor.pending()
+
+    async def worker():
+        for action, item in items:
+            await execute(action, item)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    return executor.result()
+
+
+def sync_concurrent(credentials: str, gcalendar: str, actions: Dict[str, List], dry_run: bool = False,
+                    concurrency: int = 10, journal: str = None, max_identical_errors: int = None,
+                    bodies: BodyCache = None, timeout: float = DEFAULT_TIMEOUT) -> Dict[str, List[Any]]:
+    """
+    Synchronous wrapper around sync_async, for performing the sync with concurrent requests.
+    Recording/replaying HTTP exchanges (see itg.api.transport) is not supported.
+
+    :param credentials: the credentials JSON file to use
+    :type credentials: str
+    :param gcalendar: the Google Calendar to use
+    :type gcalendar: str
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
+    :type dry_run: bool
+    :param concurrency: the maximum number of concurrent requests
+    :type concurrency: int
+    :param journal: the journal file to record planned/completed mutations in, ignored if None or dry-run
+    :type journal: str
+    :param max_identical_errors: the number of consecutive identical errors after which to abort, never aborts if None
+    :type max_identical_errors: int
+    :param bodies: the request body cache of the sync cycle, ignored if None
+    :type bodies: BodyCache
+    :param timeout: the timeout in seconds for each request
+    :type timeout: float
+    :return: the dictionary with events per action that failed: action -> list of tuples; with last element in tuple the exception string
+    :rtype: dict
+    """
+    if get_transport().mode != MODE_LIVE:
+        raise Exception("The async backend does not support recording/replaying HTTP exchanges!")
+    pool = default_pool()
+    # loads the credentials (and runs the authorization flow if necessary) before going async
+    pool.get(credentials)
+
+    async def run():
+        async with new_session(timeout=timeout) as session:
+            return await sync_async(session, credentials, gcalendar, actions, dry_run=dry_run, concurrency=concurrency,
+                                    journal=journal, max_identical_errors=max_identical_errors, bodies=bodies, pool=pool)
+
+    return asyncio.run(run())
@@ -0,0 +1,421 @@
+import json
+import logging
+import os
+import re
+
+from typing import Dict, List, Tuple, Any, Optional
+
+import icalendar
+
+from itg.api.core import get_default_config_dir
+from itg.api.dedup import dedup_ical, dedup_google, ical_key, google_key, series_masters, is_covered
+from itg.api.events import event_field, has_event_changed, to_timestamp, ical_fingerprint
+from itg.api.events import EVENT_ID, EVENT_ICALUID, EVENT_SUMMARY, EVENT_DESCRIPTION, EVENT_LOCATION, EVENT_STATUS, EVENT_RECURRENCE, EVENT_START, EVENT_END, EVENT_UPDATED
+from itg.api.google import time_window_timestamps
+from itg.api.interval import EventIndex
+from itg.api.sync import ACTIONS, ACTION_ADD, ACTION_UPDATE, ACTION_DELETE
+
+
+POLICY_ICAL = "ical"
+POLICY_GOOGLE = "google"
+POLICY_NEWEST = "newest"
+POLICIES = [
+    POLICY_ICAL,
+    POLICY_GOOGLE,
+    POLICY_NEWEST,
+]
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.bidi")
+    return _logger
+
+
+def _safe_name(gcalendar: str) -> str:
+    """
+    Turns the calendar ID into a string usable in file names.
+
+    :param gcalendar: the Google Calendar ID
+    :type gcalendar: str
+    :return: the file name part
+    :rtype: str
+    """
+    return re.sub(r"[^A-Za-z0-9._-]", "_", gcalendar)
+
+
+def default_state_path(gcalendar: str) -> str:
+    """
+    Returns the default path of the file with the last-synced state, located in the config dir.
+
+    :param gcalendar: the Google Calendar ID
+    :type gcalendar: str
+    :return: the path
+    :rtype: str
+    """
+    return os.path.join(get_default_config_dir(), "state-%s.json" % _safe_name(gcalendar))
+
+
+def default_google_output(gcalendar: str) -> str:
+    """
+    Returns the default .ics file for storing the Google-side changes, located in the config dir.
+
+    :param gcalendar: the Google Calendar ID
+    :type gcalendar: str
+    :return: the path
+    :rtype: str
+    """
+    return os.path.join(get_default_config_dir(), "google-%s.ics" % _safe_name(gcalendar))
+
+
+def load_state(path: str) -> Dict[str, Dict]:
+    """
+    Loads the last-synced state.
+
+    :param path: the state file
+    :type path: str
+    :return: the state: key -> dict with ical/google fingerprints (and revision of the iCal event); empty if no state file
+    :rtype: dict
+    """
+    if not os.path.exists(path):
+        return dict()
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def save_state(path: str, state: Dict[str, Dict]):
+    """
+    Saves the last-synced state.
+
+    :param path: the state file
+    :type path: str
+    :param state: the state to save
+    :type state: dict
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(state, fp)
+    os.replace(tmp, path)
+
+
+def state_key(key: Tuple[str, Any]) -> str:
+    """
+    Turns the event key (see itg.api.dedup) into the string used in the state.
+
+    :param key: the event key
+    :type key: tuple
+    :return: the state key
+    :rtype: str
+    """
+    return "%s|%s" % (key[0], "" if key[1] is None else key[1])
+
+
+def ical_version(oevent) -> Optional[str]:
+    """
+    Returns the revision of the Outlook event as given by LAST-MODIFIED/SEQUENCE. While it
+    stays the same, the fingerprint stored in the state gets reused instead of recomputed.
+
+    :param oevent: the Outlook event
+    :type oevent: icalendar.Event
+    :return: the revision, None if the event has neither LAST-MODIFIED nor SEQUENCE
+    :rtype: str
+    """
+    modified = oevent.get("LAST-MODIFIED")
+    sequence = oevent.get("SEQUENCE")
+    if (modified is None) and (sequence is None):
+        return None
+    return "%s|%s" % ("" if modified is None else modified.to_ical().decode(), "" if sequence is None else int(sequence))
+
+
+def google_state_key(gevent) -> str:
+    """
+    Returns the state key of the Google event (see state_key). Events without iCalUID
+    (not created via iCal) use their ID instead.
+
+    :param gevent: the Google event
+    :return: the state key
+    :rtype: str
+    """
+    return state_key(google_key(gevent) or ("", event_field(gevent, EVENT_ID)))
+
+
+def google_fingerprint(gevent) -> str:
+    """
+    Returns the fingerprint of the Google event, i.e., its etag (or the updated timestamp).
+
+    :param gevent: the Google event
+    :return: the fingerprint
+    :rtype: str
+    """
+    return gevent.get("etag", gevent.get("updated"))
+
+
+def _google_wins(oevent, gevent, policy: str) -> bool:
+    """
+    Resolves a conflict between an Outlook and a Google event that both changed.
+
+    :param oevent: the Outlook event
+    :type oevent: icalendar.Event
+    :param gevent: the Google event
+    :param policy: the conflict policy
+    :type policy: str
+    :return: True if the Google event takes precedence
+    :rtype: bool
+    """
+    if policy == POLICY_GOOGLE:
+        return True
+    elif policy == POLICY_ICAL:
+        return False
+    else:
+        ots = to_timestamp(event_field(oevent, EVENT_UPDATED)) or 0
+        gts = to_timestamp(event_field(gevent, EVENT_UPDATED)) or 0
+        return gts > ots
+
+
+def plan_bidirectional(ical_events: List, google_events: List, state: Dict[str, Dict],
+                       policy: str = POLICY_ICAL) -> Tuple[Dict[str, List[Any]], List, Dict[str, Dict]]:
+    """
+    Compares the Outlook and Google events against the last-synced state. Only events whose
+    fingerprints changed since the last sync get compared in detail. Changes on the Outlook
+    side turn into add/update/delete actions, changes on the Google side are collected for
+    exporting. Conflicts (both sides changed) are resolved with the policy.
+
+    :param ical_events: the Outlook events
+    :type ical_events: list
+    :param google_events: the Google events
+    :type google_events: list
+    :param state: the last-synced state
+    :type state: dict
+    :param policy: the conflict policy, see POLICIES
+    :type policy: str
+    :return: the tuple of action dictionary, Google-side changes and new state (assuming all actions succeed)
+    :rtype: tuple
+    """
+    if policy not in POLICIES:
+        raise Exception("Unknown conflict policy: %s" % policy)
+
+    result = dict()
+    changes = []
+    new_state = dict()
+
+    def append(action, item):
+        if action not in result:
+            result[action] = []
+        result[action].append(item)
+
+    oindex = dict()
+    okeys = dict()
+    for oevent in dedup_ical(ical_events):
+        key = ical_key(oevent)
+        oindex[state_key(key)] = oevent
+        okeys[state_key(key)] = key
+    google_events, redundant = dedup_google(google_events)
+    gindex = dict()
+    gkeys = dict()
+    for gevent in google_events:
+        # events not created via iCal are keyed by their ID, exported once and then tracked like the others
+        gindex[google_state_key(gevent)] = gevent
+        key = google_key(gevent)
+        if key is not None:
+            gkeys[state_key(key)] = key
+    masters = series_masters(okeys.values(), gkeys.values())
+    for gevent in redundant:
+        append(ACTION_DELETE, gevent)
+    # Outlook events that would be part of the Google event listing
+    visible = set([id(x) for x in EventIndex(list(oindex.values())).in_window(*time_window_timestamps())])
+
+    for key in list(oindex.keys()) + [x for x in gindex.keys() if x not in oindex]:
+        oevent = oindex.get(key)
+        gevent = gindex.get(key)
+        last = state.get(key)
+        version = None if oevent is None else ical_version(oevent)
+        if oevent is None:
+            ofp = None
+        elif (version is not None) and (last is not None) and (last.get("version") == version):
+            ofp = last["ical"]
+        else:
+            ofp = ical_fingerprint(oevent)
+        gfp = None if gevent is None else google_fingerprint(gevent)
+        ical_changed = (oevent is not None) and ((last is None) or (last["ical"] != ofp))
+        google_changed = (gevent is not None) and (last is not None) and (last["google"] is not None) and (last["google"] != gfp)
+
+        if (oevent is not None) and (gevent is not None):
+            if google_changed and ((not ical_changed) or _google_wins(oevent, gevent, policy)):
+                changes.append(gevent)
+                new_state[key] = {"ical": ofp, "google": gfp}
+            elif ical_changed and has_event_changed(oevent, gevent):
+                append(ACTION_UPDATE, (oevent, gevent))
+                new_state[key] = {"ical": ofp, "google": None}
+            else:
+                new_state[key] = {"ical": ofp, "google": gfp}
+        elif is_covered(okeys.get(key, gkeys.get(key)), masters):
+            # override/exception instance of a recurring event, covered by its master
+            if last is not None:
+                new_state[key] = last
+        elif oevent is not None:
+            if last is None:
+                append(ACTION_ADD, oevent)
+                new_state[key] = {"ical": ofp, "google": None}
+            elif id(oevent) not in visible:
+                new_state[key] = last
+            elif last.get("deleted", False) and not ical_changed:
+                # deletion in Google already exported
+                new_state[key] = last
+            elif ical_changed or (policy == POLICY_ICAL):
+                # deleted in Google, but Outlook takes precedence
+                append(ACTION_ADD, oevent)
+                new_state[key] = {"ical": ofp, "google": None}
+            else:
+                # deleted in Google
+                cancelled = icalendar.Event()
+                cancelled.add("UID", key.split("|")[0])
+                cancelled.add("STATUS", "CANCELLED")
+                changes.append(cancelled)
+                new_state[key] = {"ical": ofp, "google": None, "deleted": True}
+        else:
+            if last is None:
+                # created in Google
+                changes.append(gevent)
+                new_state[key] = {"ical": None, "google": gfp}
+            elif last["ical"] is None:
+                # Google-side event exported previously
+                if google_changed:
+                    changes.append(gevent)
+                new_state[key] = {"ical": None, "google": gfp}
+            elif google_changed and _google_wins(icalendar.Event(), gevent, policy):
+                # deleted in Outlook, but changed in Google
+                changes.append(gevent)
+                new_state[key] = {"ical": None, "google": gfp}
+            else:
+                append(ACTION_DELETE, gevent)
+
+        entry = new_state.get(key)
+        if (version is not None) and (entry is not None) and (entry is not last) and (entry["ical"] == ofp):
+            entry["version"] = version
+
+    logger().info("Bidirectional plan: %s, Google-side changes: %d"
+                  % (", ".join(["%s=%d" % (x, len(result[x])) for x in ACTIONS if x in result]), len(changes)))
+    return result, changes, new_state
+
+
+def _forget(state: Dict[str, Dict], action: str, event):
+    """
+    Removes the event associated with the action from the state.
+
+    :param state: the state to update
+    :type state: dict
+    :param action: the action
+    :type action: str
+    :param event: the Outlook event (add/update) or Google event (delete)
+    """
+    if action in (ACTION_ADD, ACTION_UPDATE):
+        key = state_key(ical_key(event))
+    else:
+        key = google_state_key(event)
+    state.pop(key, None)
+
+
+def forget_actions(state: Dict[str, Dict], actions: Dict[str, List]) -> Dict[str, Dict]:
+    """
+    Removes the events from the state whose actions did not get executed (e.g., deferred),
+    so they get planned again next time.
+
+    :param state: the new state as returned by plan_bidirectional
+    :type state: dict
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :return: the updated state
+    :rtype: dict
+    """
+    for action in actions:
+        for item in actions[action]:
+            _forget(state, action, item[0] if action == ACTION_UPDATE else item)
+    return state
+
+
+def forget_errors(state: Dict[str, Dict], errors: Dict[str, List]) -> Dict[str, Dict]:
+    """
+    Removes the events from the state whose actions failed, so they get retried next time.
+
+    :param state: the new state as returned by plan_bidirectional
+    :type state: dict
+    :param errors: the errors as returned by sync
+    :type errors: dict
+    :return: the updated state
+    :rtype: dict
+    """
+    for action in errors:
+        for item in errors[action]:
+            _forget(state, action, item[0])
+    return state
+
+
+def google_to_ical(gevent) -> icalendar.Event:
+    """
+    Converts the Google event into an iCal one.
+
+    :param gevent: the Google event to convert
+    :return: the iCal event
+    :rtype: icalendar.Event
+    """
+    if isinstance(gevent, icalendar.Event):
+        return gevent
+    result = icalendar.Event()
+    uid = event_field(gevent, EVENT_ICALUID)
+    result.add("UID", uid if uid is not None else event_field(gevent, EVENT_ID))
+    result.add("SUMMARY", event_field(gevent, EVENT_SUMMARY))
+    for field, prop in [(EVENT_DESCRIPTION, "DESCRIPTION"), (EVENT_LOCATION, "LOCATION")]:
+        value = event_field(gevent, field)
+        if value:
+            result.add(prop, value)
+    result.add("STATUS", event_field(gevent, EVENT_STATUS).upper())
+    for field, prop in [(EVENT_START, "DTSTART"), (EVENT_END, "DTEND"), (EVENT_UPDATED, "DTSTAMP")]:
+        value = event_field(gevent, field)
+        if value is not None:
+            result.add(prop, value)
+    recurrence = event_field(gevent, EVENT_RECURRENCE)
+    if recurrence is not None:
+        for line in recurrence:
+            if line.startswith("RRULE:"):
+                result.add("RRULE", icalendar.vRecur.from_ical(line[len("RRULE:"):]))
+    return result
+
+
+def write_google_changes(changes: List, path: str):
+    """
+    Merges the Google-side changes into the .ics file, replacing events with the same UID.
+
+    :param changes: the Google events (or cancelled iCal events) to write
+    :type changes: list
+    :param path: the .ics file to update
+    :type path: str
+    """
+    if len(changes) == 0:
+        return
+    events = dict()
+    if os.path.exists(path):
+        with open(path, "rb") as fp:
+            for event in icalendar.Calendar.from_ical(fp.read()).walk("VEVENT"):
+                events[str(event["UID"])] = event
+    for change in changes:
+        event = google_to_ical(change)
+        events[str(event["UID"])] = event
+
+    cal = icalendar.Calendar()
+    cal.add("PRODID", "-//ical-to-gcal//bidirectional sync//EN")
+    cal.add("VERSION", "2.0")
+    for event in events.values():
+        cal.add_component(event)
+    logger().info("Writing %d Google-side change(s) to: %s" % (len(changes), path))
+    with open(path, "wb") as fp:
+        fp.write(cal.to_ical())
@@ -0,0 +1,170 @@
+import logging
+import threading
+
+from time import time
+from typing import Dict
+
+
+# the number of consecutive failures after which a circuit opens
+FAILURE_THRESHOLD = 3
+
+# the initial number of seconds an open circuit rejects calls for
+COOLDOWN = 60
+
+# the maximum cool-down in seconds
+MAX_COOLDOWN = 3600
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.breaker")
+    return _logger
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call gets rejected by an open circuit.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a source (feed URL, Google calendar). After the threshold of
+    consecutive failures the circuit opens and calls get rejected for the cool-down period.
+    Then a single trial call is let through (half-open): success closes the circuit, failure
+    opens it again with the cool-down doubled (up to the maximum).
+    """
+
+    def __init__(self, name: str, threshold: int = FAILURE_THRESHOLD, cooldown: float = COOLDOWN,
+                 max_cooldown: float = MAX_COOLDOWN):
+        """
+        Initializes the breaker.
+
+        :param name: the name of the source
+        :type name: str
+        :param threshold: the number of consecutive failures that open the circuit
+        :type threshold: int
+        :param cooldown: the initial cool-down in seconds
+        :type cooldown: float
+        :param max_cooldown: the maximum cool-down in seconds
+        :type max_cooldown: float
+        """
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.current_cooldown = cooldown
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Checks whether a call can be made.
+
+        :return: True if allowed
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN and (time() - self.opened >= self.current_cooldown):
+                logger().info("Circuit half-open, trying again: %s" % self.name)
+                self.state = STATE_HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        """
+        Records a successful call.
+        """
+        with self._lock:
+            if self.state != STATE_CLOSED:
+                logger().info("Circuit closed: %s" % self.name)
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self.current_cooldown = self.cooldown
+
+    def failure(self):
+        """
+        Records a failed call.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == STATE_HALF_OPEN:
+                self.current_cooldown = min(self.current_cooldown * 2, self.max_cooldown)
+            elif (self.state == STATE_CLOSED) and (self.failures < self.threshold):
+                return
+            self.state = STATE_OPEN
+            self.opened = time()
+            logger().warning("Circuit open for %g seconds after %d failure(s): %s" % (self.current_cooldown, self.failures, self.name))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls the function if the circuit allows it, recording the outcome.
+
+        :param func: the function to call
+        :param args: the positional arguments
+        :param kwargs: the keyword arguments
+        :return: the result of the function
+        """
+        if not self.allow():
+            raise CircuitOpenError("Circuit open, skipping: %s" % self.name)
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.failure()
+            raise
+        self.success()
+        return result
+
+
+_breakers = dict()
+
+_lock = threading.Lock()
+
+
+def get_breaker(name: str, threshold: int = FAILURE_THRESHOLD, cooldown: float = COOLDOWN) -> CircuitBreaker:
+    """
+    Returns the process-wide breaker for the source, creating it if necessary.
+
+    :param name: the name of the source
+    :type name: str
+    :param threshold: the number of consecutive failures that open the circuit (new breakers only)
+    :type threshold: int
+    :param cooldown: the initial cool-down in seconds (new breakers only)
+    :type cooldown: float
+    :return: the breaker
+    :rtype: CircuitBreaker
+    """
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, threshold=threshold, cooldown=cooldown)
+        return _breakers[name]
+
+
+def breakers() -> Dict[str, CircuitBreaker]:
+    """
+    Returns all process-wide breakers.
+
+    :return: the name -> breaker mapping
+    :rtype: dict
+    """
+    with _lock:
+        return dict(_breakers)
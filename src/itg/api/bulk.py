@@ -0,0 +1,145 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Dict, List, Any, Iterable
+
+import httplib2
+
+from google_auth_httplib2 import AuthorizedHttp
+from itg.api.dedup import dedup_ical, ical_key, series_masters, is_covered
+from itg.api.sync import event_body, BodyCache, SyncExecutor, ACTION_ADD
+from itg.api.transport import get_transport, MODE_REPLAY
+
+
+# the maximum number of requests per batch recommended for the Calendar API
+MAX_BATCH_SIZE = 50
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.bulk")
+    return _logger
+
+
+def _batches(items: Iterable, batch_size: int) -> Iterable[List]:
+    """
+    Groups the events into batches.
+
+    :param items: the events to group
+    :type items: iterable
+    :param batch_size: the maximum number of events per batch
+    :type batch_size: int
+    :return: the batches
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def bulk_import(service, gcalendar: str, events: Iterable, batch_size: int = MAX_BATCH_SIZE, workers: int = 1,
+                dry_run: bool = False, credentials=None, journal: str = None, bodies: BodyCache = None,
+                timeout: float = None, max_identical_errors: int = None) -> Dict[str, List[Any]]:
+    """
+    Inserts the Outlook events into an empty Google calendar, without comparing them first.
+    Duplicates get removed (see itg.api.dedup.dedup_ical) and overrides of recurring events
+    whose master gets inserted as well are skipped (see itg.api.dedup.series_masters).
+    The events are sent in batch requests, with up to the specified number of batches in flight.
+    Concurrent batches use separate connections, which require the credentials.
+    Journal and aborting after repeated identical errors work like with itg.api.sync.sync
+    (see itg.api.sync.SyncExecutor), with errors counted in the order the responses arrive.
+
+    :param service: the Google Calendar service instance to use
+    :param gcalendar: the Google Calendar to use
+    :type gcalendar: str
+    :param events: the Outlook events to insert, e.g., from itg.api.outlook.iter_events
+    :type events: iterable
+    :param batch_size: the number of events per batch request
+    :type batch_size: int
+    :param workers: the number of batch requests to execute concurrently
+    :type workers: int
+    :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
+    :type dry_run: bool
+    :param credentials: the credentials for the separate connections of concurrent batches (see itg.api.google.service_credentials), sends the batches one by one if None (unless replaying)
+    :param journal: the journal file to record planned/completed inserts in (see itg.api.journal), ignored if None or dry-run; removed once all inserts succeeded
+    :type journal: str
+    :param bodies: the request body cache of the sync cycle, ignored if None
+    :type bodies: BodyCache
+    :param timeout: the timeout in seconds for the separate connections of concurrent batches, uses the httplib2 default if None
+    :type timeout: float
+    :param max_identical_errors: the number of consecutive identical errors after which to abort, never aborts if None
+    :type max_identical_errors: int
+    :return: the dictionary with events that failed: add -> list of tuples; with last element in tuple the exception string
+    :rtype: dict
+    """
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    count = 0
+    start = time()
+    lock = threading.Lock()
+
+    if (workers > 1) and (credentials is None) and (get_transport().mode != MODE_REPLAY):
+        logger().warning("No credentials for separate connections, sending batches one by one")
+        workers = 1
+
+    events = dedup_ical(list(events))
+    keys = [ical_key(x) for x in events]
+    # the calendar is empty, the masters get inserted along with their overrides
+    masters = series_masters(keys, keys)
+    events = [x for x, key in zip(events, keys) if not is_covered(key, masters)]
+    if len(events) < len(keys):
+        logger().info("Overrides of recurring events skipped: %d" % (len(keys) - len(events)))
+    sync_executor = SyncExecutor(gcalendar, {ACTION_ADD: events}, dry_run=dry_run, journal=journal,
+                                 max_identical_errors=max_identical_errors)
+
+    def execute(batch: List):
+        def callback(request_id, response, exception):
+            oevent = batch[int(request_id)]
+            with lock:
+                if exception is not None:
+                    sync_executor.failed(ACTION_ADD, oevent, exception)
+                else:
+                    sync_executor.succeeded(ACTION_ADD, oevent)
+
+        request = service.new_batch_http_request(callback=callback)
+        for i, oevent in enumerate(batch):
+            request.add(service.events().insert(calendarId=gcalendar, body=event_body(oevent, bodies)), request_id=str(i))
+        if (workers > 1) and (credentials is not None):
+            # httplib2 is not thread-safe, use separate connection per batch
+            request.execute(http=get_transport().http(AuthorizedHttp(credentials, http=httplib2.Http(timeout=timeout))))
+        else:
+            request.execute()
+        logger().debug("Batch of %d event(s) sent" % len(batch))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for batch in _batches((x[1] for x in sync_executor.pending()), batch_size):
+            count += len(batch)
+            if dry_run:
+                continue
+            pending.append(executor.submit(execute, batch))
+            if len(pending) >= workers:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+
+    result = sync_executor.result()
+    duration = max(time() - start, 1e-6)
+    logger().info("Bulk import: %d event(s) in %.1f seconds (%.1f events/sec), %d error(s)"
+                  % (count, duration, count / duration, len(result.get(ACTION_ADD, []))))
+    return result
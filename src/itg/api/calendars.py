@@ -0,0 +1,208 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from time import time
+from typing import Dict, List, Optional
+
+from itg.api.core import get_default_config_dir
+from itg.api.google import init_service
+
+
+# the fields to retrieve for the calendars
+CALENDAR_PROJECTION = [
+    "id",
+    "summary",
+    "accessRole",
+    "primary",
+    "timeZone",
+]
+
+# the number of seconds the cached calendar list is considered current
+CACHE_TTL = 3600
+
+# the maximum number of calendars per page allowed by the API
+MAX_RESULTS = 250
+
+# the access roles that allow modifying events
+WRITABLE_ROLES = ["owner", "writer"]
+
+# alias for the primary calendar of the account
+PRIMARY = "primary"
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.calendars")
+    return _logger
+
+
+def calendar_cache_path(credentials: str = None) -> str:
+    """
+    Returns the path of the calendar list cache. Each credentials file (i.e., account) has
+    its own cache.
+
+    :param credentials: the path to the credentials JSON file, uses a shared cache if None
+    :type credentials: str
+    :return: the path
+    :rtype: str
+    """
+    if credentials is None:
+        return os.path.join(get_default_config_dir(), "calendars.json")
+    digest = hashlib.md5(os.path.abspath(credentials).encode("utf-8")).hexdigest()
+    return os.path.join(get_default_config_dir(), "calendars-%s.json" % digest)
+
+
+def fetch_calendars(service) -> List[Dict]:
+    """
+    Retrieves the calendars of the account, page by page, with only the fields in CALENDAR_PROJECTION.
+
+    :param service: the Google Calendar service instance to use
+    :return: the calendars
+    :rtype: list
+    """
+    result = []
+    request = service.calendarList().list(
+        showDeleted=False,
+        showHidden=False,
+        maxResults=MAX_RESULTS,
+        fields="items(%s),nextPageToken" % ",".join(CALENDAR_PROJECTION),
+    )
+    while request is not None:
+        response = request.execute()
+        result.extend(response.get("items", []))
+        request = service.calendarList().list_next(request, response)
+    logger().info("Retrieved %d calendar(s)" % len(result))
+    return result
+
+
+def load_cached_calendars(path: str = None, ttl: float = CACHE_TTL) -> Optional[List[Dict]]:
+    """
+    Loads the cached calendar list if it is current.
+
+    :param path: the cache file, uses calendar_cache_path() if None
+    :type path: str
+    :param ttl: the maximum age in seconds
+    :type ttl: float
+    :return: the calendars, None if not cached or expired
+    :rtype: list
+    """
+    if path is None:
+        path = calendar_cache_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as fp:
+            cache = json.load(fp)
+    except:
+        logger().error("Failed to read calendar cache: %s" % path, exc_info=True)
+        return None
+    if time() - cache.get("timestamp", 0) > ttl:
+        logger().info("Calendar cache expired: %s" % path)
+        return None
+    return cache.get("items", [])
+
+
+def save_cached_calendars(calendars: List[Dict], path: str = None):
+    """
+    Saves the calendar list in the cache.
+
+    :param calendars: the calendars to save
+    :type calendars: list
+    :param path: the cache file, uses calendar_cache_path() if None
+    :type path: str
+    """
+    if path is None:
+        path = calendar_cache_path()
+    # unique temp file, concurrent jobs may save at the same time
+    fd, tmp = tempfile.mkstemp(prefix=".calendars-", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w") as fp:
+        json.dump({"timestamp": time(), "items": calendars}, fp)
+    os.replace(tmp, path)
+
+
+def get_calendars(credentials: str, ttl: float = CACHE_TTL, refresh: bool = False) -> List[Dict]:
+    """
+    Returns the calendars of the account, using the account's cache if it is current.
+
+    :param credentials: the path to the credentials JSON file
+    :type credentials: str
+    :param ttl: the maximum age of the cache in seconds, 0 to disable caching
+    :type ttl: float
+    :param refresh: whether to ignore the cache
+    :type refresh: bool
+    :return: the calendars
+    :rtype: list
+    """
+    path = calendar_cache_path(credentials)
+    if (ttl > 0) and not refresh:
+        result = load_cached_calendars(path=path, ttl=ttl)
+        if result is not None:
+            return result
+    result = fetch_calendars(init_service(credentials))
+    if ttl > 0:
+        save_cached_calendars(result, path=path)
+    return result
+
+
+def find_calendar(calendars: List[Dict], calendar: str) -> Optional[Dict]:
+    """
+    Locates the calendar in the list.
+
+    :param calendars: the calendars to search
+    :type calendars: list
+    :param calendar: the calendar ID to look for
+    :type calendar: str
+    :return: the calendar, None if not found
+    :rtype: dict
+    """
+    for cal in calendars:
+        if (cal["id"] == calendar) or ((calendar == PRIMARY) and cal.get("primary", False)):
+            return cal
+    return None
+
+
+def validate_calendar(credentials: str, calendar: str, writable: bool = True, ttl: float = CACHE_TTL):
+    """
+    Checks whether the calendar exists (and events can be modified), using the cached calendar
+    list of the account. If the calendar is not in the cache, the cache gets refreshed once.
+    If the calendar list cannot be retrieved, only a warning gets logged (the sync fails
+    anyway if the calendar is not accessible).
+
+    :param credentials: the path to the credentials JSON file
+    :type credentials: str
+    :param calendar: the calendar ID to check
+    :type calendar: str
+    :param writable: whether the calendar must allow modifying events
+    :type writable: bool
+    :param ttl: the maximum age of the cache in seconds
+    :type ttl: float
+    """
+    calendars = load_cached_calendars(path=calendar_cache_path(credentials), ttl=ttl)
+    refreshed = False
+    if calendars is None:
+        try:
+            calendars = get_calendars(credentials, ttl=ttl, refresh=True)
+            refreshed = True
+        except Exception:
+            logger().warning("Failed to retrieve calendar list, not validating: %s" % calendar, exc_info=True)
+            return
+    cal = find_calendar(calendars, calendar)
+    if (cal is None) and not refreshed:
+        cal = find_calendar(get_calendars(credentials, ttl=ttl, refresh=True), calendar)
+    if cal is None:
+        raise Exception("Google calendar not found: %s" % calendar)
+    if writable and (cal.get("accessRole") not in WRITABLE_ROLES):
+        raise Exception("Google calendar not writable (access role: %s): %s" % (cal.get("accessRole"), calendar))
@@ -0,0 +1,142 @@
+import logging
+
+from typing import Iterable, List, Optional, Set, Tuple
+
+from itg.api.events import event_field, to_timestamp, EVENT_ID, EVENT_ICALUID, EVENT_RECURRENCE_ID, EVENT_UPDATED
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.dedup")
+    return _logger
+
+
+def ical_key(oevent) -> Tuple[str, Optional[float]]:
+    """
+    Returns the key identifying the Outlook event: UID and RECURRENCE-ID (as timestamp).
+
+    :param oevent: the Outlook event
+    :type oevent: icalendar.Event
+    :return: the key
+    :rtype: tuple
+    """
+    return str(event_field(oevent, EVENT_ID)), to_timestamp(event_field(oevent, EVENT_RECURRENCE_ID))
+
+
+def google_key(gevent) -> Optional[Tuple[str, Optional[float]]]:
+    """
+    Returns the key identifying the Google event: iCalUID and original start time (as timestamp).
+
+    :param gevent: the Google event
+    :return: the key, None if the event has no iCalUID
+    :rtype: tuple
+    """
+    uid = event_field(gevent, EVENT_ICALUID)
+    if uid is None:
+        return None
+    return uid, to_timestamp(event_field(gevent, EVENT_RECURRENCE_ID))
+
+
+def series_masters(ical_keys: Iterable[Tuple[str, Optional[float]]],
+                   google_keys: Iterable[Optional[Tuple[str, Optional[float]]]]) -> Set[str]:
+    """
+    Determines the UIDs of the recurring events whose master event is present on both
+    sides. Their overrides (iCal events with RECURRENCE-ID) cannot be inserted into Google
+    Calendar as separate events (the master's iCalUID is already taken) and their exception
+    instances in Google Calendar must not get deleted (that would cancel the occurrences),
+    so unmatched overrides/instances of these series get left alone.
+
+    :param ical_keys: the keys of the Outlook events (see ical_key)
+    :type ical_keys: list
+    :param google_keys: the keys of the Google events (see google_key), can contain None
+    :type google_keys: list
+    :return: the UIDs
+    :rtype: set
+    """
+    ical_masters = set([x[0] for x in ical_keys if x[1] is None])
+    google_masters = set([x[0] for x in google_keys if (x is not None) and (x[1] is None)])
+    return ical_masters & google_masters
+
+
+def is_covered(key: Optional[Tuple[str, Optional[float]]], masters: Set[str]) -> bool:
+    """
+    Checks whether the key belongs to an override/exception instance of a recurring event
+    whose master is present on both sides (see series_masters).
+
+    :param key: the key of the event (see ical_key/google_key), can be None
+    :type key: tuple
+    :param masters: the UIDs of the masters present on both sides
+    :type masters: set
+    :return: True if covered
+    :rtype: bool
+    """
+    return (key is not None) and (key[1] is not None) and (key[0] in masters)
+
+
+def dedup_ical(events: List) -> List:
+    """
+    Removes duplicate Outlook events (same UID/RECURRENCE-ID). The event with the highest
+    SEQUENCE is kept, then the one with the latest DTSTAMP, then the first one.
+
+    :param events: the Outlook events to deduplicate
+    :type events: list
+    :return: the canonical events, in order of first occurrence
+    :rtype: list
+    """
+    canonical = dict()
+    for event in events:
+        key = ical_key(event)
+        if key not in canonical:
+            canonical[key] = event
+            continue
+        current = canonical[key]
+        if (event.get("SEQUENCE", 0), to_timestamp(event_field(event, EVENT_UPDATED)) or 0) \
+                > (current.get("SEQUENCE", 0), to_timestamp(event_field(current, EVENT_UPDATED)) or 0):
+            canonical[key] = event
+
+    if len(canonical) < len(events):
+        logger().info("Duplicate Outlook events removed: %d" % (len(events) - len(canonical)))
+    return list(canonical.values())
+
+
+def dedup_google(events: List) -> Tuple[List, List]:
+    """
+    Determines the canonical Google events for each iCalUID/original start time and the
+    redundant copies. The most recently updated event is kept, then the one with the
+    smallest ID. Events without iCalUID are always considered canonical.
+
+    :param events: the Google events to deduplicate
+    :type events: list
+    :return: the tuple of canonical events (in order of first occurrence) and redundant ones
+    :rtype: tuple
+    """
+    canonical = dict()
+    redundant = []
+    for event in events:
+        key = google_key(event)
+        if key is None:
+            key = ("", event_field(event, EVENT_ID))
+        if key not in canonical:
+            canonical[key] = event
+            continue
+        current = canonical[key]
+        if (to_timestamp(event_field(event, EVENT_UPDATED)) or 0, current["id"]) \
+                > (to_timestamp(event_field(current, EVENT_UPDATED)) or 0, event["id"]):
+            canonical[key] = event
+            redundant.append(current)
+        else:
+            redundant.append(event)
+
+    if len(redundant) > 0:
+        logger().info("Redundant Google events: %d" % len(redundant))
+    return list(canonical.values()), redundant
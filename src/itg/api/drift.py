@@ -0,0 +1,365 @@
+import logging
+import re
+
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple, Callable
+
+import icalendar
+
+from itg.api.events import to_timestamp, resolve_zone, event_field, EVENT_UPDATED
+from itg.api.events import resolve_timezones, calendar_zone, localize_floating, has_event_changed
+from itg.api.dedup import dedup_google, google_key, series_masters, is_covered
+from itg.api.sync import ACTION_ADD, ACTION_DELETE, ACTION_UPDATE, PROPERTY_SEQUENCE
+
+
+# the iCal properties that get extracted by the line scanner
+STUB_PROPERTIES = [
+    "UID",
+    "RECURRENCE-ID",
+    "DTSTAMP",
+    "LAST-MODIFIED",
+    "SEQUENCE",
+]
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.drift")
+    return _logger
+
+
+def _unfold(data: bytes):
+    """
+    Iterates over the unfolded content lines of the iCal data.
+
+    :param data: the iCal data
+    :type data: bytes
+    :return: the line iterator
+    """
+    current = None
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        if line.startswith(" ") or line.startswith("\t"):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def _utc_timestamp(value: str) -> Optional[float]:
+    """
+    Parses a UTC date-time value (e.g., DTSTAMP, LAST-MODIFIED).
+
+    :param value: the value to parse
+    :type value: str
+    :return: the timestamp, None if not parseable
+    :rtype: float
+    """
+    try:
+        return datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def _recurrence_timestamp(value: str, params: str) -> Optional[float]:
+    """
+    Parses the RECURRENCE-ID value, taking the TZID parameter into account.
+
+    :param value: the value to parse
+    :type value: str
+    :param params: the property parameters (";"-separated)
+    :type params: str
+    :return: the timestamp, None if not parseable
+    :rtype: float
+    """
+    tzid = None
+    for param in params.split(";"):
+        if param.upper().startswith("TZID="):
+            tzid = param[5:].strip('"')
+            zone = resolve_zone(tzid)
+            if zone is not None:
+                tzid = zone
+    try:
+        return to_timestamp(icalendar.vDDDTypes.from_ical(value, timezone=tzid))
+    except:
+        logger().error("Failed to parse RECURRENCE-ID: %s" % value, exc_info=True)
+        return None
+
+
+def scan_events(data: bytes, regexp_id: str = None) -> List[Dict[str, Any]]:
+    """
+    Extracts the identities and change indicators (see STUB_PROPERTIES) of the events
+    from the iCal data by scanning the lines, without parsing the calendar. Events without
+    LAST-MODIFIED keep their content lines (and the calendar's X-WR-TIMEZONE/VTIMEZONE lines),
+    so that they can be parsed for a field comparison if necessary (see parse_stubs).
+
+    :param data: the iCal data
+    :type data: bytes
+    :param regexp_id: the regexp that the event IDs must match, ignored if None
+    :type regexp_id: str
+    :return: the event stubs (dictionaries with uid, recurrence_id, dtstamp, last_modified, sequence, lines and calendar)
+    :rtype: list
+    """
+    result = []
+    # calendar-level lines required for parsing events, shared by all stubs
+    calendar = []
+    stub = None
+    depth = 0
+    timezone = False
+    for line in _unfold(data):
+        name, sep, value = line.partition(":")
+        if not sep:
+            continue
+        name, _, params = name.partition(";")
+        name = name.upper()
+        if stub is None:
+            if (name == "BEGIN") and (value.upper() == "VTIMEZONE"):
+                timezone = True
+            if timezone or (name == "X-WR-TIMEZONE"):
+                calendar.append(line)
+            if (name == "END") and (value.upper() == "VTIMEZONE"):
+                timezone = False
+        else:
+            stub["lines"].append(line)
+        if name == "BEGIN":
+            if stub is not None:
+                depth += 1
+            elif value.upper() == "VEVENT":
+                stub = {"uid": None, "recurrence_id": None, "dtstamp": None, "last_modified": None, "sequence": 0,
+                        "sequence_set": False, "lines": [line], "calendar": calendar}
+                depth = 0
+        elif name == "END":
+            if stub is None:
+                continue
+            if depth > 0:
+                depth -= 1
+            else:
+                if (stub["uid"] is not None) and ((regexp_id is None) or re.match(regexp_id, stub["uid"])):
+                    if stub["last_modified"] is not None:
+                        stub["lines"] = None
+                    result.append(stub)
+                stub = None
+        elif (stub is None) or (depth > 0) or (name not in STUB_PROPERTIES):
+            continue
+        elif name == "UID":
+            stub["uid"] = value
+        elif name == "RECURRENCE-ID":
+            stub["recurrence_id"] = _recurrence_timestamp(value, params)
+        elif name == "DTSTAMP":
+            stub["dtstamp"] = _utc_timestamp(value)
+        elif name == "LAST-MODIFIED":
+            stub["last_modified"] = _utc_timestamp(value)
+        elif name == "SEQUENCE":
+            try:
+                stub["sequence"] = int(value)
+                stub["sequence_set"] = True
+            except ValueError:
+                pass
+    return result
+
+
+def parse_stubs(stubs: List[Dict[str, Any]]) -> List:
+    """
+    Parses the content lines kept by scan_events into events, all in one go.
+
+    :param stubs: the event stubs to parse (must have lines)
+    :type stubs: list
+    :return: the events, in the same order
+    :rtype: list
+    """
+    if len(stubs) == 0:
+        return []
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//itg//drift//EN"] + stubs[0]["calendar"]
+    for stub in stubs:
+        lines.extend(stub["lines"])
+    lines.append("END:VCALENDAR")
+    calendar = icalendar.Calendar.from_ical("\r\n".join(lines))
+    resolve_timezones(calendar)
+    zone = calendar_zone(calendar)
+    result = []
+    for event in calendar.walk("VEVENT"):
+        result.append(localize_floating(event, zone))
+    return result
+
+
+def google_sequence(gevent) -> Optional[int]:
+    """
+    Returns the iCal SEQUENCE stored with the Google event when it was last synced.
+
+    :param gevent: the Google event
+    :return: the sequence, None if not available
+    :rtype: int
+    """
+    try:
+        return int(gevent["extendedProperties"]["private"][PROPERTY_SEQUENCE])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def stub_key(stub: Dict[str, Any]) -> Tuple[str, Optional[float]]:
+    """
+    Returns the key identifying the event stub: UID and RECURRENCE-ID (as timestamp),
+    see itg.api.dedup.ical_key.
+
+    :param stub: the event stub
+    :type stub: dict
+    :return: the key
+    :rtype: tuple
+    """
+    return stub["uid"], stub["recurrence_id"]
+
+
+def stub_modified(stub: Dict[str, Any]) -> Optional[float]:
+    """
+    Returns when the event was last modified: LAST-MODIFIED, DTSTAMP otherwise.
+    Only used for ranking duplicates, see dedup_stubs.
+
+    :param stub: the event stub
+    :type stub: dict
+    :return: the timestamp, None if not available
+    :rtype: float
+    """
+    if stub["last_modified"] is not None:
+        return stub["last_modified"]
+    return stub["dtstamp"]
+
+
+def dedup_stubs(stubs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Removes duplicate event stubs (same UID/RECURRENCE-ID). The one with the highest
+    SEQUENCE is kept, then the one modified last (LAST-MODIFIED, DTSTAMP otherwise), then
+    the first one (see itg.api.dedup.dedup_ical).
+
+    :param stubs: the event stubs to deduplicate
+    :type stubs: list
+    :return: the canonical stubs, in order of first occurrence
+    :rtype: list
+    """
+    canonical = dict()
+    for stub in stubs:
+        key = stub_key(stub)
+        current = canonical.get(key)
+        if (current is None) or ((stub["sequence"], stub_modified(stub) or 0) > (current["sequence"], stub_modified(current) or 0)):
+            canonical[key] = stub
+    return list(canonical.values())
+
+
+def stub_changed(stub: Dict[str, Any], gevent) -> Optional[bool]:
+    """
+    Decides from LAST-MODIFIED/SEQUENCE alone whether the iCal event changed since the
+    Google event got synced. DTSTAMP is not used, as many feeds set it to the time of the
+    export.
+
+    :param stub: the event stub
+    :type stub: dict
+    :param gevent: the Google event
+    :return: True if changed, False if unchanged, None if undecided (fields need comparing)
+    :rtype: bool
+    """
+    if stub["last_modified"] is not None:
+        updated = to_timestamp(event_field(gevent, EVENT_UPDATED))
+        if updated is not None:
+            return stub["last_modified"] > updated
+    sequence = google_sequence(gevent)
+    if stub["sequence_set"] and (sequence is not None):
+        return stub["sequence"] > sequence
+    return None
+
+
+def compare_light(stubs: List[Dict[str, Any]], google_events: List, fetch_events: Callable[[], List] = None) -> Dict[str, List[Any]]:
+    """
+    Compares the iCal event stubs (see scan_events) with the Google events retrieved with
+    itg.api.google.LIGHT_PROJECTION. Matched events are unchanged if the iCal event wasn't
+    modified after the Google one (LAST-MODIFIED vs updated) or if its SEQUENCE isn't higher
+    than the one stored with the Google event, and updated otherwise. Events with neither
+    get parsed and compared field by field with the full Google events (see
+    itg.api.events.has_event_changed), if fetch_events is provided, or reported as updated.
+    Overrides of recurring events get treated like in itg.api.sync.compare.
+
+    :param stubs: the iCal event stubs
+    :type stubs: list
+    :param google_events: the Google events
+    :type google_events: list
+    :param fetch_events: the function retrieving the full Google events, only called if events need comparing
+    :type fetch_events: callable
+    :return: the action dictionary, with stubs instead of iCal events
+    :rtype: dict
+    """
+    result = dict()
+
+    stubs = dedup_stubs(stubs)
+    google_events, redundant = dedup_google(google_events)
+    index = dict()
+    for gevent in google_events:
+        key = google_key(gevent)
+        if key is not None:
+            index[key] = gevent
+    masters = series_masters([stub_key(x) for x in stubs], index.keys())
+
+    matched = set()
+    skipped = 0
+    candidates = []
+    for stub in stubs:
+        gevent = index.get(stub_key(stub))
+        if (gevent is None) and is_covered(stub_key(stub), masters):
+            continue
+        if gevent is None:
+            if ACTION_ADD not in result:
+                result[ACTION_ADD] = []
+            result[ACTION_ADD].append(stub)
+            continue
+        matched.add(id(gevent))
+        changed = stub_changed(stub, gevent)
+        if changed is None:
+            if (fetch_events is not None) and (stub["lines"] is not None):
+                candidates.append((stub, gevent))
+                continue
+            changed = True
+        if changed:
+            if ACTION_UPDATE not in result:
+                result[ACTION_UPDATE] = []
+            result[ACTION_UPDATE].append((stub, gevent))
+        else:
+            skipped += 1
+
+    compared = len(candidates)
+    if compared > 0:
+        full = dict()
+        for gevent in dedup_google(fetch_events())[0]:
+            key = google_key(gevent)
+            if key is not None:
+                full[key] = gevent
+        for (stub, gevent), oevent in zip(candidates, parse_stubs([x[0] for x in candidates])):
+            fevent = full.get(stub_key(stub))
+            if (fevent is None) or has_event_changed(oevent, fevent):
+                if ACTION_UPDATE not in result:
+                    result[ACTION_UPDATE] = []
+                result[ACTION_UPDATE].append((stub, gevent))
+            else:
+                skipped += 1
+
+    for gevent in google_events:
+        if is_covered(google_key(gevent), masters):
+            matched.add(id(gevent))
+    for gevent in google_events + redundant:
+        if id(gevent) not in matched:
+            if ACTION_DELETE not in result:
+                result[ACTION_DELETE] = []
+            result[ACTION_DELETE].append(gevent)
+
+    logger().info("Lightweight comparison: %d iCal event(s), %d Google event(s), %d compared field by field, %d unchanged"
+                  % (len(stubs), len(google_events) + len(redundant), compared, skipped))
+    return result
@@ -1,10 +1,16 @@
+import copy
+import hashlib
 import logging
+import threading
 
-from datetime import datetime, date
-from typing import Optional, Union, Tuple, List, Any
+from datetime import datetime, date, timezone, tzinfo
+from typing import Optional, Union, Tuple, List, Any, Dict
+from zoneinfo import ZoneInfo
 
 import icalendar
 
+from itg.api.logs import log_event
+
 
 EVENT_ID = "id"
 EVENT_SUMMARY = "summary"
@@ -16,6 +22,7 @@ EVENT_START = "start"
 EVENT_END = "end"
 EVENT_UPDATED = "updated"
 EVENT_ICALUID = "icaluid"
+EVENT_RECURRENCE_ID = "recurrence_id"
 
 EVENT_FIELDS = [
     EVENT_ID,
@@ -28,6 +35,7 @@ EVENT_FIELDS = [
     EVENT_END,
     EVENT_UPDATED,
     EVENT_ICALUID,
+    EVENT_RECURRENCE_ID,
 ]
 
 EVENT_COMPARISON_FIELDS = [
@@ -42,6 +50,11 @@ EVENT_COMPARISON_FIELDS = [
 
 _logger = None
 
+# TZID -> IANA zone name (None if it cannot be resolved)
+_zone_cache = dict()
+
+_zone_lock = threading.Lock()
+
 
 def logger() -> logging.Logger:
     """
@@ -92,10 +105,17 @@ def event_field(event, field: str) -> Optional[Union[str, object, datetime, date
             else:
                 return None
         elif field == EVENT_UPDATED:
-            if "DTSTAMP" in event:
+            if "LAST-MODIFIED" in event:
+                return event["LAST-MODIFIED"].dt
+            elif "DTSTAMP" in event:
                 return event["DTSTAMP"].dt
             else:
                 return None
+        elif field == EVENT_RECURRENCE_ID:
+            if "RECURRENCE-ID" in event:
+                return event["RECURRENCE-ID"].dt
+            else:
+                return None
         else:
             raise Exception("Unhandled event field: %s" % field)
     else:
@@ -136,6 +156,15 @@ def event_field(event, field: str) -> Optional[Union[str, object, datetime, date
                 return datetime.fromisoformat(event["updated"].replace("Z", "+00:00"))
             else:
                 return None
+        elif field == EVENT_RECURRENCE_ID:
+            if "originalStartTime" in event:
+                d = event["originalStartTime"]
+                if "dateTime" in d:
+                    return datetime.fromisoformat(d["dateTime"].replace("Z", "+00:00"))
+                else:
+                    return datetime.strptime(d["date"], "%Y-%m-%d").date()
+            else:
+                return None
         else:
             raise Exception("Unhandled event field: %s" % field)
 
@@ -157,6 +186,9 @@ def is_same_event(outlook, google) -> bool:
 def has_event_changed(outlook, google) -> bool:
     """
     Checks whether at least one field differ sbetween the corresponding Outlook/Google events.
+    Start/end get compared as normalized UTC times (see normalize_time). The modification
+    time only gets compared if the Outlook event has LAST-MODIFIED, as many feeds set
+    DTSTAMP to the time of the export, which would flag every event as changed.
 
     :param outlook: the Outlook event
     :param google: the Google Calendar event
@@ -169,42 +201,219 @@ def has_event_changed(outlook, google) -> bool:
         ovalue = event_field(outlook, field)
         gvalue = event_field(google, field)
         if field == EVENT_UPDATED:
+            if isinstance(outlook, icalendar.Event) and ("LAST-MODIFIED" not in outlook):
+                continue
             # only flag as changed if Outlook is newer
-            if gvalue < ovalue:
+            ots = to_timestamp(ovalue)
+            gts = to_timestamp(gvalue)
+            if (ots is None) or (gts is None) or (ots <= gts):
                 continue
+        elif field in (EVENT_START, EVENT_END):
+            ovalue = to_utc(ovalue)
+            gvalue = to_utc(gvalue)
         if ovalue != gvalue:
-            logger().info("event changed: %s" % event_field(outlook, EVENT_ID))
-            logger().info("- field/outlook/google: %s/%s/%s" % (field, ovalue, gvalue))
+            log_event(logger(), logging.INFO, "event changed", uid=event_field(outlook, EVENT_ID), field=field, outlook=ovalue, google=gvalue)
             result = True
             break
 
     return result
 
 
+def ical_fingerprint(oevent) -> str:
+    """
+    Computes the fingerprint of the Outlook event, ignoring DTSTAMP (which changes with every export).
+    Property parameters and the timezones of datetimes are included.
+
+    :param oevent: the Outlook event
+    :type oevent: icalendar.Event
+    :return: the fingerprint
+    :rtype: str
+    """
+    h = hashlib.md5()
+    for k in sorted(oevent.keys()):
+        if k == "DTSTAMP":
+            continue
+        h.update(k.encode())
+        values = oevent[k] if isinstance(oevent[k], list) else [oevent[k]]
+        for v in values:
+            h.update(v.to_ical() if hasattr(v, "to_ical") else str(v).encode())
+            params = getattr(v, "params", None)
+            if params:
+                h.update(str(sorted(params.items())).encode())
+            tz = getattr(getattr(v, "dt", None), "tzinfo", None)
+            if tz is not None:
+                h.update(_tzid(tz).encode())
+    return h.hexdigest()
+
+
+def _tzid(tz: tzinfo) -> str:
+    """
+    Determines the TZID of the timezone object (zoneinfo, pytz, dateutil, VTIMEZONE-based).
+
+    :param tz: the timezone to get the ID for
+    :type tz: tzinfo
+    :return: the ID
+    :rtype: str
+    """
+    for attr in ["key", "zone"]:
+        if isinstance(getattr(tz, attr, None), str):
+            return getattr(tz, attr)
+    try:
+        from icalendar.timezone import tzid_from_tzinfo
+        tzid = tzid_from_tzinfo(tz)
+        if tzid is not None:
+            return tzid
+    except ImportError:
+        pass
+    return str(tz)
+
+
+def resolve_zone(tzid: str) -> Optional[str]:
+    """
+    Resolves the TZID (IANA or Windows name) to an IANA zone name. Results are cached.
+
+    :param tzid: the TZID to resolve
+    :type tzid: str
+    :return: the IANA zone name, None if it cannot be resolved
+    :rtype: str
+    """
+    with _zone_lock:
+        if tzid in _zone_cache:
+            return _zone_cache[tzid]
+
+    result = None
+    try:
+        ZoneInfo(tzid)
+        result = tzid
+    except:
+        try:
+            from icalendar.timezone.windows_to_olson import WINDOWS_TO_OLSON
+            result = WINDOWS_TO_OLSON.get(tzid)
+        except ImportError:
+            pass
+    if result is None:
+        logger().warning("Cannot resolve timezone, using UTC instead: %s" % tzid)
+    with _zone_lock:
+        _zone_cache[tzid] = result
+    return result
+
+
+def resolve_timezones(calendar: icalendar.Calendar) -> Dict[str, Optional[str]]:
+    """
+    Resolves the timezones defined by the VTIMEZONE components of the calendar.
+
+    :param calendar: the calendar to process
+    :type calendar: icalendar.Calendar
+    :return: the mapping from TZID to IANA zone name (None if it cannot be resolved)
+    :rtype: dict
+    """
+    result = dict()
+    for component in calendar.walk("VTIMEZONE"):
+        tzid = str(component["TZID"])
+        result[tzid] = resolve_zone(tzid)
+    return result
+
+
+def calendar_zone(calendar: icalendar.Calendar) -> Optional[str]:
+    """
+    Determines the IANA zone name of the calendar's X-WR-TIMEZONE property.
+
+    :param calendar: the calendar to get the timezone for
+    :type calendar: icalendar.Calendar
+    :return: the IANA zone name, None if not specified or cannot be resolved
+    :rtype: str
+    """
+    if "X-WR-TIMEZONE" not in calendar:
+        return None
+    return resolve_zone(str(calendar["X-WR-TIMEZONE"]))
+
+
+def localize_floating(event: icalendar.Event, zone: Optional[str]) -> icalendar.Event:
+    """
+    Attaches the timezone to the floating datetimes (DTSTART, DTEND, RECURRENCE-ID) of the
+    event, i.e., the ones without TZID and not in UTC. The event itself does not get modified
+    (e.g., when shared between jobs), a copy with the localized values gets returned instead.
+
+    :param event: the event to localize
+    :type event: icalendar.Event
+    :param zone: the IANA zone name (see calendar_zone), nothing gets changed if None
+    :type zone: str
+    :return: the localized copy, the event itself if nothing is floating
+    :rtype: icalendar.Event
+    """
+    if zone is None:
+        return event
+    result = event
+    for prop in ["DTSTART", "DTEND", "RECURRENCE-ID"]:
+        if prop not in event:
+            continue
+        value = event[prop].dt
+        if isinstance(value, datetime) and (value.tzinfo is None):
+            if result is event:
+                result = copy.copy(event)
+            result[prop] = icalendar.vDDDTypes(value.replace(tzinfo=ZoneInfo(zone)))
+    return result
+
+
+def to_utc(value: Optional[Union[datetime, date]]) -> Optional[Union[datetime, date]]:
+    """
+    Converts datetimes to UTC; dates are returned as is. Floating datetimes get interpreted
+    as UTC, calendars with X-WR-TIMEZONE have them localized when iterating the events
+    (see localize_floating).
+
+    :param value: the value to convert, can be None
+    :return: the converted value
+    """
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def normalize_time(value: Optional[Union[datetime, date]]) -> Tuple[Optional[Union[datetime, date]], Optional[str]]:
+    """
+    Normalizes the date/datetime: datetimes get converted to UTC (see to_utc) and their
+    IANA zone name determined; dates are returned as is.
+
+    :param value: the value to normalize, can be None
+    :return: the tuple of normalized value and IANA zone name (None if not available, e.g., fixed offsets)
+    :rtype: tuple
+    """
+    if (not isinstance(value, datetime)) or (value.tzinfo is None):
+        return to_utc(value), None
+    if isinstance(value.tzinfo, timezone):
+        return to_utc(value), "UTC" if value.utcoffset().total_seconds() == 0 else None
+    return to_utc(value), resolve_zone(_tzid(value.tzinfo))
+
+
+def to_timestamp(value: Optional[Union[datetime, date]]) -> Optional[float]:
+    """
+    Turns the date/datetime into a POSIX timestamp. Dates are interpreted as midnight UTC,
+    datetimes without timezone as UTC.
+
+    :param value: the date/datetime to convert, can be None
+    :return: the timestamp, None if no value provided
+    :rtype: float
+    """
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
 def date_range(events: List[Any]) -> Tuple[Optional[date], Optional[date]]:
     """
     Determines the date range of the events and returns the start/end date objects.
+    Builds an itg.api.interval.EventIndex, use that directly if further queries are required.
 
     :param events: the events to process
     :type events: list
     :return: the tuple of start/end date objects; can be None if no start/end dates found
     :rtype: tuple
     """
-    start = None
-    end = None
-
-    for event in events:
-        ds = event_field(event, EVENT_START)
-        if isinstance(ds, datetime):
-            ds = ds.date()
-        de = event_field(event, EVENT_END)
-        if isinstance(de, datetime):
-            de = de.date()
-        if (ds is None) or (de is None):
-            continue
-        if (start is None) or (start > ds):
-            start = ds
-        if (end is None) or (end < de):
-            end = de
-
-    return start, end
+    from itg.api.interval import EventIndex
+    return EventIndex(events).date_range()
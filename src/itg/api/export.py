@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+import logging
+import sys
+
+from datetime import datetime, date
+from typing import List, Iterable, Optional
+
+from itg.api.events import event_field, EVENT_ID, EVENT_SUMMARY, EVENT_START, EVENT_END
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+FORMAT_TEXT = "text"
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+FORMAT_PARQUET = "parquet"
+FORMATS = [
+    FORMAT_TEXT,
+    FORMAT_CSV,
+    FORMAT_JSONL,
+    FORMAT_PARQUET,
+]
+
+DEFAULT_COLUMNS = [
+    EVENT_ID,
+    EVENT_SUMMARY,
+    EVENT_START,
+    EVENT_END,
+]
+
+# the number of events to convert and write at a time (row group size for parquet)
+BATCH_SIZE = 10000
+
+# the size of the output buffer in bytes
+BUFFER_SIZE = 1024 * 1024
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.export")
+    return _logger
+
+
+def to_column_value(value) -> Optional[str]:
+    """
+    Turns the event value into a string for output.
+
+    :param value: the value to convert
+    :return: the string, None if no value
+    :rtype: str
+    """
+    if value is None:
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, "to_ical"):
+        value = value.to_ical()
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, list):
+        return "\n".join([str(x) for x in value])
+    return str(value)
+
+
+def event_row(event, columns: List[str]) -> List[Optional[str]]:
+    """
+    Extracts the column values from the event.
+
+    :param event: the iCal or Google event
+    :param columns: the event fields to extract, see itg.api.events.EVENT_FIELDS
+    :type columns: list
+    :return: the values
+    :rtype: list
+    """
+    result = []
+    for column in columns:
+        try:
+            result.append(to_column_value(event_field(event, column)))
+        except KeyError:
+            result.append(None)
+    return result
+
+
+def _batches(events: Iterable, columns: List[str]) -> Iterable[List[List]]:
+    """
+    Converts the events into rows, batch by batch.
+
+    :param events: the events to convert
+    :type events: iterable
+    :param columns: the event fields to extract
+    :type columns: list
+    :return: the batches of rows
+    """
+    batch = []
+    for event in events:
+        batch.append(event_row(event, columns))
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def write_events(events: Iterable, output_format: str, output_file: str = None, columns: List[str] = None) -> int:
+    """
+    Writes the events in the specified format, converting and writing them in batches.
+
+    :param events: the iCal or Google events to write
+    :type events: iterable
+    :param output_format: the format to use (csv/jsonl/parquet)
+    :type output_format: str
+    :param output_file: the file to write to, uses stdout if None (not supported for parquet)
+    :type output_file: str
+    :param columns: the event fields to output, uses DEFAULT_COLUMNS if None
+    :type columns: list
+    :return: the number of events written
+    :rtype: int
+    """
+    if columns is None:
+        columns = DEFAULT_COLUMNS
+    count = 0
+
+    if output_format == FORMAT_PARQUET:
+        if pyarrow is None:
+            raise Exception("pyarrow is required for writing parquet files!")
+        if output_file is None:
+            raise Exception("Parquet output requires an output file!")
+        schema = pyarrow.schema([(x, pyarrow.string()) for x in columns])
+        with pyarrow.parquet.ParquetWriter(output_file, schema) as writer:
+            for batch in _batches(events, columns):
+                table = pyarrow.Table.from_pydict({c: [row[i] for row in batch] for i, c in enumerate(columns)}, schema=schema)
+                writer.write_table(table)
+                count += len(batch)
+    elif output_format in [FORMAT_CSV, FORMAT_JSONL]:
+        if output_file is None:
+            fp = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", newline="", write_through=False)
+        else:
+            fp = open(output_file, "w", encoding="utf-8", newline="", buffering=BUFFER_SIZE)
+        try:
+            if output_format == FORMAT_CSV:
+                writer = csv.writer(fp)
+                writer.writerow(columns)
+                for batch in _batches(events, columns):
+                    writer.writerows(batch)
+                    count += len(batch)
+            else:
+                for batch in _batches(events, columns):
+                    fp.write("".join([json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in batch]))
+                    count += len(batch)
+        finally:
+            if output_file is None:
+                fp.flush()
+                fp.detach()
+            else:
+                fp.close()
+    else:
+        raise Exception("Unsupported output format: %s" % output_format)
+
+    logger().info("%d event(s) written" % count)
+    return count
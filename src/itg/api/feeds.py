@@ -0,0 +1,213 @@
+import logging
+import threading
+
+from time import time
+from typing import List
+
+import icalendar
+
+from itg.api.outlook import read_calendar, save_calendar_data, iter_events, event_matches, DEFAULT_TIMEOUT
+
+
+# the number of seconds a loaded feed gets reused for if none of its subscribers polls (see FeedCache.subscribe)
+FEED_MAX_AGE = 60
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.feeds")
+    return _logger
+
+
+class Feed:
+    """
+    A loaded iCal/Outlook calendar with its (unfiltered) events and raw data.
+    """
+
+    def __init__(self, data: bytes):
+        """
+        Initializes the feed.
+
+        :param data: the raw calendar data
+        :type data: bytes
+        """
+        self.data = data
+        self.calendar = icalendar.Calendar.from_ical(data)
+        self.events = list(iter_events(self.calendar))
+        self.timestamp = time()
+        self._saved = set()
+        self._lock = threading.Lock()
+
+    def save(self, output_file: str, output_keep: int = 0):
+        """
+        Saves the raw data to the output file (see itg.api.outlook.save_calendar_data),
+        once per output file.
+
+        :param output_file: the file to save the calendar to
+        :type output_file: str
+        :param output_keep: the number of previous versions of the output file to keep
+        :type output_keep: int
+        """
+        with self._lock:
+            if output_file in self._saved:
+                return
+            self._saved.add(output_file)
+        save_calendar_data(self.data, output_file, keep=output_keep)
+
+    def filter(self, regexp_id: str = None, regexp_summary: str = None) -> List:
+        """
+        Returns the events that match the regular expressions.
+
+        :param regexp_id: the regexp that the event IDs must match, ignored if None
+        :type regexp_id: str
+        :param regexp_summary: the regexp that the summaries must match, ignored if None
+        :type regexp_summary: str
+        :return: the list of events
+        :rtype: list
+        """
+        if (regexp_id is None) and (regexp_summary is None):
+            return list(self.events)
+        return [x for x in self.events if event_matches(x, regexp_id=regexp_id, regexp_summary=regexp_summary)]
+
+
+class _Pending:
+    """
+    A load of a feed that is in progress.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.feed = None
+        self.error = None
+
+
+class FeedCache:
+    """
+    Shares loaded iCal/Outlook calendars between sync jobs running in the same process.
+    Concurrent requests for the same path/URL result in a single download and parse, the
+    other callers wait for and receive the same feed. Feeds get reused until they are
+    older than the shortest poll interval of their subscribers (see subscribe), so that
+    every poll sees data no older than its interval. Each caller's output file gets saved.
+    The feeds must be treated as read-only.
+    """
+
+    def __init__(self, max_age: float = FEED_MAX_AGE):
+        """
+        Initializes the cache.
+
+        :param max_age: the number of seconds to reuse a loaded feed for if none of its subscribers polls
+        :type max_age: float
+        """
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._feeds = dict()
+        self._pending = dict()
+        self._intervals = dict()
+
+    def subscribe(self, path_or_url: str, poll_interval: float = None):
+        """
+        Registers a job using the feed, with the interval it polls at.
+
+        :param path_or_url: the path or URL of the calendar
+        :type path_or_url: str
+        :param poll_interval: the poll interval in seconds of the job, ignored if None
+        :type poll_interval: float
+        """
+        if poll_interval is None:
+            return
+        with self._lock:
+            current = self._intervals.get(path_or_url)
+            if (current is None) or (poll_interval < current):
+                self._intervals[path_or_url] = poll_interval
+
+    def feed_max_age(self, path_or_url: str) -> float:
+        """
+        Returns the number of seconds that the feed gets reused for: the shortest poll
+        interval of its subscribers, max_age if none polls.
+
+        :param path_or_url: the path or URL of the calendar
+        :type path_or_url: str
+        :return: the maximum age in seconds
+        :rtype: float
+        """
+        return self._intervals.get(path_or_url, self.max_age)
+
+    def get(self, path_or_url: str, output_file: str = None, output_keep: int = 0, timeout: float = DEFAULT_TIMEOUT) -> Feed:
+        """
+        Returns the feed, loading it if not cached (or expired) and not already being loaded,
+        and saves it to the caller's output file.
+
+        :param path_or_url: the path or URL of the calendar
+        :type path_or_url: str
+        :param output_file: the file to save the calendar to, ignored if None
+        :type output_file: str
+        :param output_keep: the number of previous versions of the output file to keep
+        :type output_keep: int
+        :param timeout: the timeout in seconds for URLs, waits indefinitely if None
+        :type timeout: float
+        :return: the feed
+        :rtype: Feed
+        """
+        feed = self._get(path_or_url, timeout)
+        if output_file is not None:
+            feed.save(output_file, output_keep=output_keep)
+        return feed
+
+    def _get(self, path_or_url: str, timeout: float) -> Feed:
+        """
+        Returns the feed, loading it if not cached (or expired) and not already being loaded.
+
+        :param path_or_url: the path or URL of the calendar
+        :type path_or_url: str
+        :param timeout: the timeout in seconds for URLs, waits indefinitely if None
+        :type timeout: float
+        :return: the feed
+        :rtype: Feed
+        """
+        with self._lock:
+            feed = self._feeds.get(path_or_url)
+            if (feed is not None) and (time() - feed.timestamp <= self.feed_max_age(path_or_url)):
+                logger().debug("Using cached feed: %s" % path_or_url)
+                return feed
+            pending = self._pending.get(path_or_url)
+            leader = pending is None
+            if leader:
+                pending = _Pending()
+                self._pending[path_or_url] = pending
+
+        if not leader:
+            logger().info("Waiting for feed being loaded: %s" % path_or_url)
+            pending.done.wait()
+            if pending.error is not None:
+                raise Exception("Failed to load feed: %s" % path_or_url) from pending.error
+            return pending.feed
+
+        try:
+            pending.feed = Feed(read_calendar(path_or_url, timeout=timeout))
+            with self._lock:
+                self._feeds[path_or_url] = pending.feed
+            return pending.feed
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._pending[path_or_url]
+            pending.done.set()
+
+    def clear(self):
+        """
+        Removes all cached feeds.
+        """
+        with self._lock:
+            self._feeds.clear()
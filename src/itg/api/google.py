@@ -1,23 +1,70 @@
 # based on:
 # https://developers.google.com/calendar/api/quickstart/python
 
+import copy
+import json
 import logging
 import os
 import re
+import sys
+import threading
+import zlib
 
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import Optional, Dict, List
+
+import httplib2
 
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials
+from google.oauth2 import service_account
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from itg.api.core import get_default_config_dir
+from itg.api.spill import SpilledEvents
+from itg.api.transport import get_transport, MODE_LIVE, MODE_REPLAY
 
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
+# the event fields to retrieve
+EVENT_PROJECTION = [
+    "id",
+    "iCalUID",
+    "etag",
+    "status",
+    "summary",
+    "description",
+    "location",
+    "recurrence",
+    "start",
+    "end",
+    "updated",
+    "originalStartTime",
+]
+
+# the event fields to retrieve for lightweight comparisons (identity and change detection only)
+LIGHT_PROJECTION = [
+    "id",
+    "iCalUID",
+    "etag",
+    "status",
+    "updated",
+    "originalStartTime",
+    "extendedProperties",
+]
+
+# the maximum page size when listing events
+MAX_RESULTS = 2500
+
+# the seconds before expiry at which the credential pool refreshes tokens
+REFRESH_MARGIN = 600
+
+# the interval in seconds at which the credential pool checks the tokens
+REFRESH_INTERVAL = 60
+
 
 _logger = None
 
@@ -35,24 +82,73 @@ def logger() -> logging.Logger:
     return _logger
 
 
-def credentials_token_path() -> str:
+def credentials_token_path(credentials: str = None) -> str:
     """
-    Returns the default token path.
+    Returns the token path.
 
+    :param credentials: the credentials JSON file to get the account specific token path for, uses the default token path if None
+    :type credentials: str
     :return: the token path
     :rtype: str
     """
-    return os.path.join(get_default_config_dir(), "token.json")
+    if credentials is None:
+        return os.path.join(get_default_config_dir(), "token.json")
+    path = os.path.abspath(credentials)
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", os.path.splitext(os.path.basename(path))[0])
+    return os.path.join(get_default_config_dir(), "token-%s-%08x.json" % (name, zlib.crc32(path.encode("utf-8"))))
 
 
-def load_credentials_token() -> Optional[Credentials]:
+def _client_id(path: str) -> Optional[str]:
+    """
+    Determines the OAuth client ID from a client secrets or token JSON file.
+
+    :param path: the file to read
+    :type path: str
+    :return: the client ID, None if not available
+    :rtype: str
     """
-    Tries to load the credentials from the token.json file.
+    try:
+        with open(path) as fp:
+            data = json.load(fp)
+        for key in ["installed", "web"]:
+            if key in data:
+                data = data[key]
+        return data.get("client_id")
+    except:
+        return None
 
+
+def is_service_account(credentials: str) -> bool:
+    """
+    Checks whether the credentials JSON file is a service account key.
+
+    :param credentials: the credentials JSON file to check
+    :type credentials: str
+    :return: True if a service account key
+    :rtype: bool
+    """
+    try:
+        with open(credentials) as fp:
+            return json.load(fp).get("type") == "service_account"
+    except:
+        return False
+
+
+def load_credentials_token(credentials: str = None) -> Optional[Credentials]:
+    """
+    Tries to load the credentials from the token file. For account specific tokens, the
+    default token.json file gets used if it was created for the same OAuth client.
+
+    :param credentials: the credentials JSON file to load the account specific token for, uses the default token file if None
+    :type credentials: str
     :return: the credentials, None if token file not available
     :rtype: Credentials
     """
-    path = credentials_token_path()
+    path = credentials_token_path(credentials)
+    if (credentials is not None) and not os.path.exists(path):
+        default = credentials_token_path()
+        if os.path.exists(default) and (_client_id(default) is not None) and (_client_id(default) == _client_id(credentials)):
+            path = default
     if os.path.exists(path):
         return Credentials.from_authorized_user_file(path, SCOPES)
     else:
@@ -60,17 +156,21 @@ def load_credentials_token() -> Optional[Credentials]:
         return None
 
 
-def save_credentials_token(creds: Credentials):
+def save_credentials_token(creds: Credentials, credentials: str = None):
     """
     Saves the credentials token JSON file.
 
     :param creds: the credentials to store
     :type creds: Credentials
+    :param credentials: the credentials JSON file to save the account specific token for, uses the default token file if None
+    :type credentials: str
     """
-    path = credentials_token_path()
+    path = credentials_token_path(credentials)
     logger().info("Saving credentials to: %s" % path)
-    with open(path, "w") as token:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as token:
         token.write(creds.to_json())
+    os.replace(tmp, path)
 
 
 def init_credentials(credentials: str, creds: Credentials = None) -> Credentials:
@@ -87,6 +187,7 @@ def init_credentials(credentials: str, creds: Credentials = None) -> Credentials
         if not creds.valid:
             logger().info("Refreshing token...")
             creds.refresh(Request())
+            save_credentials_token(creds)
     else:
         logger().info("Creating token from credentials...")
         flow = InstalledAppFlow.from_client_secrets_file(credentials, SCOPES)
@@ -95,26 +196,327 @@ def init_credentials(credentials: str, creds: Credentials = None) -> Credentials
     return creds
 
 
-def init_service(credentials: str):
+class CredentialPool:
+    """
+    Thread-safe pool of credentials, keyed by the credentials JSON file (i.e., account).
+    OAuth client secrets use account specific token files in the config dir, service
+    account keys get used directly. Once started, a background thread refreshes the
+    tokens ahead of their expiry, so that users of the credentials never block on a refresh.
+    Credentials handed out never get modified by the pool: refreshing happens on a copy
+    (under the account lock), which then replaces the pool's credentials.
+    """
+
+    def __init__(self, refresh_margin: float = REFRESH_MARGIN, interval: float = REFRESH_INTERVAL, interactive: bool = True):
+        """
+        Initializes the pool.
+
+        :param refresh_margin: the seconds before expiry at which tokens get refreshed
+        :type refresh_margin: float
+        :param interval: the interval in seconds at which the tokens get checked
+        :type interval: float
+        :param interactive: whether the OAuth flow can be run (local server + browser) for accounts without token
+        :type interactive: bool
+        """
+        self.refresh_margin = refresh_margin
+        self.interval = interval
+        self.interactive = interactive
+        self._lock = threading.Lock()
+        self._locks = dict()
+        self._creds = dict()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _load(self, credentials: str, subject: str = None):
+        """
+        Loads the credentials of the account, running the OAuth flow if necessary.
+
+        :param credentials: the credentials JSON file (client secrets or service account key)
+        :type credentials: str
+        :param subject: the user to impersonate with a service account (domain-wide delegation), ignored if None
+        :type subject: str
+        :return: the credentials
+        """
+        if is_service_account(credentials):
+            logger().info("Using service account: %s" % credentials)
+            creds = service_account.Credentials.from_service_account_file(credentials, scopes=SCOPES)
+            if subject is not None:
+                creds = creds.with_subject(subject)
+            return creds
+        creds = load_credentials_token(credentials)
+        if creds is None:
+            if not self.interactive:
+                raise Exception("No token available for account and interactive authorization disabled: %s" % credentials)
+            logger().info("Creating token from credentials...")
+            flow = InstalledAppFlow.from_client_secrets_file(credentials, SCOPES)
+            creds = flow.run_local_server(port=0)
+            save_credentials_token(creds, credentials)
+        return creds
+
+    def _due(self, creds) -> bool:
+        """
+        Checks whether the credentials require refreshing.
+
+        :param creds: the credentials to check
+        :return: True if to refresh
+        :rtype: bool
+        """
+        if creds.token is None:
+            return True
+        if creds.expiry is None:
+            return False
+        return creds.expiry - datetime.utcnow() < timedelta(seconds=self.refresh_margin)
+
+    def _refresh(self, key: str, creds):
+        """
+        Refreshes a copy of the credentials, saves the token and stores the copy in the pool.
+        Must be called with the account lock held.
+
+        :param key: the account key
+        :type key: str
+        :param creds: the credentials to refresh
+        :return: the refreshed credentials
+        """
+        logger().info("Refreshing token: %s" % key[0])
+        creds = copy.copy(creds)
+        creds.refresh(Request())
+        if isinstance(creds, Credentials):
+            save_credentials_token(creds, key[0])
+        self._creds[key] = creds
+        return creds
+
+    def _account_lock(self, key) -> threading.Lock:
+        """
+        Returns the lock for the account.
+
+        :param key: the account key
+        :return: the lock
+        :rtype: threading.Lock
+        """
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def get(self, credentials: str, subject: str = None):
+        """
+        Returns the credentials of the account, loading/refreshing them if necessary.
+
+        :param credentials: the credentials JSON file (client secrets or service account key)
+        :type credentials: str
+        :param subject: the user to impersonate with a service account (domain-wide delegation), ignored if None
+        :type subject: str
+        :return: the credentials
+        """
+        key = (os.path.abspath(credentials), subject)
+        creds = self._creds.get(key)
+        if (creds is not None) and creds.valid:
+            return creds
+        with self._account_lock(key):
+            creds = self._creds.get(key)
+            if creds is None:
+                creds = self._load(credentials, subject=subject)
+                self._creds[key] = creds
+            if not creds.valid:
+                creds = self._refresh(key, creds)
+            return creds
+
+    def token(self, credentials: str, subject: str = None) -> str:
+        """
+        Returns a valid access token of the account. Refreshing happens under the account
+        lock (see get), the pooled credentials never get modified by the caller.
+
+        :param credentials: the credentials JSON file (client secrets or service account key)
+        :type credentials: str
+        :param subject: the user to impersonate with a service account (domain-wide delegation), ignored if None
+        :type subject: str
+        :return: the token
+        :rtype: str
+        """
+        return self.get(credentials, subject=subject).token
+
+    def refresh_due(self):
+        """
+        Refreshes all credentials that expire within the refresh margin.
+        """
+        for key in list(self._creds.keys()):
+            try:
+                with self._account_lock(key):
+                    creds = self._creds[key]
+                    if self._due(creds):
+                        self._refresh(key, creds)
+            except:
+                logger().error("Failed to refresh token: %s" % key[0], exc_info=True)
+
+    def start(self):
+        """
+        Starts the background refresh, if not already running.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="credential-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh_due()
+
+    def stop(self):
+        """
+        Stops the background refresh.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_pool = None
+
+_pool_lock = threading.Lock()
+
+
+def default_pool() -> CredentialPool:
+    """
+    Returns the process-wide credential pool, with the background refresh running.
+
+    :return: the pool
+    :rtype: CredentialPool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CredentialPool()
+            _pool.start()
+        return _pool
+
+
+def service_credentials(credentials: str, pool: CredentialPool = None):
+    """
+    Returns the credentials object for the account, e.g., for creating additional connections.
+
+    :param credentials: the credentials JSON file to use (client secrets or service account key)
+    :type credentials: str
+    :param pool: the credential pool to obtain the credentials from, uses default_pool() if None
+    :type pool: CredentialPool
+    :return: the credentials, None when replaying recorded responses
+    """
+    if get_transport().mode == MODE_REPLAY:
+        return None
+    if pool is None:
+        pool = default_pool()
+    return pool.get(credentials)
+
+
+def init_service(credentials: str, pool: CredentialPool = None, timeout: float = None):
     """
     Initializes the calendar service instance.
 
-    :param credentials: the credentials JSON file to use
+    :param credentials: the credentials JSON file to use (client secrets or service account key)
     :type credentials: str
+    :param pool: the credential pool to obtain the credentials from, uses default_pool() if None
+    :type pool: CredentialPool
+    :param timeout: the timeout in seconds for the API requests, uses the httplib2 default if None
+    :type timeout: float
     :return: the service, None if failed to instantiate
     """
-    creds = load_credentials_token()
-    creds = init_credentials(credentials, creds)
+    transport = get_transport()
+    if transport.mode == MODE_REPLAY:
+        # recorded responses, no credentials required
+        return build("calendar", "v3", http=transport.http())
+    creds = service_credentials(credentials, pool=pool)
     try:
-        return build("calendar", "v3", credentials=creds)
+        if (timeout is None) and (transport.mode == MODE_LIVE):
+            return build("calendar", "v3", credentials=creds)
+        else:
+            return build("calendar", "v3", http=transport.http(AuthorizedHttp(creds, http=httplib2.Http(timeout=timeout))))
     except HttpError as error:
         logger().error(f"An error occurred: {error}")
         return None
 
 
-def filter_events(service, calendar: str, regexp_id: str = None, regexp_summary: str = None):
+def time_window():
     """
-    Filters the events from Google calendar.
+    Returns the time window of events to retrieve from Google Calendar.
+
+    :return: the tuple of timeMin/timeMax strings
+    :rtype: tuple
+    """
+    # at most 1 year's worth
+    # TODO parameters?
+    time_min = datetime.utcnow().isoformat() + "Z"
+    time_max = datetime.utcnow()
+    time_max = time_max.replace(year=time_max.year + 1)
+    time_max = time_max.isoformat() + "Z"
+    return time_min, time_max
+
+
+def time_window_timestamps():
+    """
+    Returns the time window of events to retrieve from Google Calendar as POSIX timestamps.
+
+    :return: the tuple of timeMin/timeMax timestamps
+    :rtype: tuple
+    """
+    return tuple([datetime.fromisoformat(x.replace("Z", "+00:00")).timestamp() for x in time_window()])
+
+
+def event_matches(event, regexp_id: str = None, regexp_summary: str = None) -> bool:
+    """
+    Checks whether the Google event is active and matches the regular expressions.
+
+    :param event: the Google event to check
+    :param regexp_id: the regular expression that the event ID must match, ignored if None
+    :type regexp_id: str
+    :param regexp_summary: the regular expression that the event summary must match, ignored if None
+    :type regexp_summary: str
+    :return: True if the event matches
+    :rtype: bool
+    """
+    if event["status"].lower() == "cancelled":
+        return False
+    if regexp_id is not None:
+        match = re.match(regexp_id, event["id"])
+        if not match:
+            return False
+    if "summary" in event:
+        if regexp_summary is not None:
+            match = re.match(regexp_summary, event["summary"])
+            if not match:
+                return False
+    return True
+
+
+def compact_event(event: Dict, projection: List[str] = None) -> Dict:
+    """
+    Reduces the Google event to the fields required for matching and updating (see
+    EVENT_PROJECTION), interning frequently repeated strings.
+
+    :param event: the event to compact
+    :type event: dict
+    :param projection: the fields to keep, uses EVENT_PROJECTION if None
+    :type projection: list
+    :return: the compact event
+    :rtype: dict
+    """
+    if projection is None:
+        projection = EVENT_PROJECTION
+    result = dict()
+    for field in projection:
+        if field in event:
+            result[field] = event[field]
+    result["status"] = sys.intern(result["status"])
+    for field in ["start", "end", "originalStartTime"]:
+        if (field in result) and ("timeZone" in result[field]):
+            result[field]["timeZone"] = sys.intern(result[field]["timeZone"])
+    return result
+
+
+def filter_events(service, calendar: str, regexp_id: str = None, regexp_summary: str = None, spill: bool = False,
+                  projection: List[str] = None):
+    """
+    Filters the events from Google calendar. Only the fields listed in the projection get retrieved.
 
     :param service: the service instance to use
     :param calendar: the name of the calendar to retrieve
@@ -123,38 +525,39 @@ def filter_events(service, calendar: str, regexp_id: str = None, regexp_summary:
     :type regexp_id: str
     :param regexp_summary: the regular expression that the event summaries must match, ignored if None
     :type regexp_summary: str
-    :return:
+    :param spill: whether to store the events in a temporary database rather than in memory
+    :type spill: bool
+    :param projection: the fields to retrieve (must include status), uses EVENT_PROJECTION if None; the summary regexp gets ignored if summary is not included
+    :type projection: list
+    :return: the list of events (SpilledEvents if spilling)
     """
-    result = []
+    if projection is None:
+        projection = EVENT_PROJECTION
+    if spill:
+        result = SpilledEvents()
+    else:
+        result = []
 
-    # at most 1 year's worth
-    # TODO parameters?
-    time_min = datetime.utcnow().isoformat() + "Z"
-    time_max = datetime.utcnow()
-    time_max = time_max.replace(year=time_max.year + 1)
-    time_max = time_max.isoformat() + "Z"
+    time_min, time_max = time_window()
 
-    events = (
-        service.events().list(
-            calendarId=calendar,
-            showDeleted=True,
-            timeMin=time_min,
-            timeMax=time_max,
-        ).execute()
+    request = service.events().list(
+        calendarId=calendar,
+        showDeleted=True,
+        timeMin=time_min,
+        timeMax=time_max,
+        maxResults=MAX_RESULTS,
+        fields="items(%s),nextPageToken" % ",".join(projection),
     )
-
-    for event in events["items"]:
-        if event["status"].lower() == "cancelled":
-            continue
-        if regexp_id is not None:
-            match = re.match(regexp_id, event["id"])
-            if not match:
-                continue
-        if "summary" in event:
-            if regexp_summary is not None:
-                match = re.match(regexp_summary, event["summary"])
-                if not match:
-                    continue
-        result.append(event)
+    try:
+        while request is not None:
+            events = request.execute()
+            for event in events.get("items", []):
+                if event_matches(event, regexp_id=regexp_id, regexp_summary=regexp_summary):
+                    result.append(compact_event(event, projection=projection))
+            request = service.events().list_next(request, events)
+    except:
+        if spill:
+            result.close()
+        raise
 
     return result
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import threading
+
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from itg.api.core import get_default_config_dir
+from itg.api.sync import ACTION_DELETE
+
+
+# the maximum fraction of the Google events that can get deleted in one go without being held
+DELETE_RATIO = 0.5
+
+# the minimum number of deletes before the ratio gets checked (small calendars)
+DELETE_MIN = 20
+
+
+_logger = None
+
+_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.guard")
+    return _logger
+
+
+def held_deletes_path() -> str:
+    """
+    Returns the path of the file storing the held deletes per Google calendar.
+
+    :return: the path
+    :rtype: str
+    """
+    return os.path.join(get_default_config_dir(), "held_deletes.json")
+
+
+def is_mass_delete(actions: Dict[str, List], num_google: int, max_ratio: float = DELETE_RATIO,
+                   min_deletes: int = DELETE_MIN) -> bool:
+    """
+    Checks whether the actions would delete an abnormal fraction of the Google events,
+    e.g., due to a truncated or empty iCal/Outlook calendar.
+
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param num_google: the number of Google events that the actions were planned against
+    :type num_google: int
+    :param max_ratio: the maximum fraction of Google events to delete, disabled if None or 1 or larger
+    :type max_ratio: float
+    :param min_deletes: the minimum number of deletes before the ratio gets checked
+    :type min_deletes: int
+    :return: True if abnormal
+    :rtype: bool
+    """
+    num_deletes = len(actions.get(ACTION_DELETE, []))
+    if (max_ratio is None) or (max_ratio >= 1) or (num_google == 0) or (num_deletes < min_deletes):
+        return False
+    return num_deletes / num_google > max_ratio
+
+
+def _load(path: str) -> Dict[str, Dict]:
+    """
+    Loads the held deletes of all calendars.
+
+    :param path: the file with the held deletes
+    :type path: str
+    :return: the calendar -> held deletes mapping
+    :rtype: dict
+    """
+    if not os.path.exists(path):
+        return dict()
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except:
+        logger().error("Failed to read held deletes from: %s" % path, exc_info=True)
+        return dict()
+
+
+def load_held(gcalendar: str, path: str = None) -> Optional[List[str]]:
+    """
+    Returns the IDs of the Google events whose deletion got held for the calendar.
+
+    :param gcalendar: the Google calendar ID
+    :type gcalendar: str
+    :param path: the file with the held deletes, uses held_deletes_path() if None
+    :type path: str
+    :return: the event IDs, None if nothing held
+    :rtype: list
+    """
+    if path is None:
+        path = held_deletes_path()
+    with _lock:
+        held = _load(path).get(gcalendar)
+    if held is None:
+        return None
+    return held.get("ids", [])
+
+
+def save_held(gcalendar: str, ids: Optional[List[str]], path: str = None):
+    """
+    Stores the IDs of the Google events whose deletion got held for the calendar.
+
+    :param gcalendar: the Google calendar ID
+    :type gcalendar: str
+    :param ids: the event IDs, None to remove the held deletes
+    :type ids: list
+    :param path: the file with the held deletes, uses held_deletes_path() if None
+    :type path: str
+    """
+    if path is None:
+        path = held_deletes_path()
+    with _lock:
+        held = _load(path)
+        if ids is None:
+            if gcalendar not in held:
+                return
+            del held[gcalendar]
+        else:
+            held[gcalendar] = {"timestamp": time(), "ids": sorted(ids)}
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(held, fp)
+        os.replace(tmp, path)
+
+
+def guard_deletes(actions: Dict[str, List], num_google: int, gcalendar: str, max_ratio: float = DELETE_RATIO,
+                  min_deletes: int = DELETE_MIN, confirm: bool = False, record: bool = True,
+                  path: str = None) -> Tuple[Dict[str, List], Dict[str, List]]:
+    """
+    Holds the deletes if they affect an abnormal fraction of the Google events (see
+    is_mass_delete), letting adds/updates through. Held deletes get executed once a
+    following run plans exactly the same deletes (second consistent observation) or when
+    confirmed explicitly.
+
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param num_google: the number of Google events that the actions were planned against
+    :type num_google: int
+    :param gcalendar: the Google calendar ID
+    :type gcalendar: str
+    :param max_ratio: the maximum fraction of Google events to delete, disabled if None or 1 or larger
+    :type max_ratio: float
+    :param min_deletes: the minimum number of deletes before the ratio gets checked
+    :type min_deletes: int
+    :param confirm: whether to execute abnormal deletes right away
+    :type confirm: bool
+    :param record: whether to store the held deletes for comparison with the next run (e.g., not for dry-runs)
+    :type record: bool
+    :param path: the file with the held deletes, uses held_deletes_path() if None
+    :type path: str
+    :return: the tuple of the actions to execute and the held ones
+    :rtype: tuple
+    """
+    if not is_mass_delete(actions, num_google, max_ratio=max_ratio, min_deletes=min_deletes):
+        if record:
+            save_held(gcalendar, None, path=path)
+        return actions, dict()
+
+    deletes = actions[ACTION_DELETE]
+    ids = [x["id"] for x in deletes]
+    percent = 100.0 * len(deletes) / num_google
+    if confirm:
+        logger().warning("Deleting %d of %d Google event(s) (%.1f%%), confirmed: %s" % (len(deletes), num_google, percent, gcalendar))
+        if record:
+            save_held(gcalendar, None, path=path)
+        return actions, dict()
+
+    held = load_held(gcalendar, path=path)
+    if (held is not None) and (set(held) == set(ids)):
+        logger().warning("Deleting %d of %d Google event(s) (%.1f%%), same as previous run: %s" % (len(deletes), num_google, percent, gcalendar))
+        if record:
+            save_held(gcalendar, None, path=path)
+        return actions, dict()
+
+    if record:
+        save_held(gcalendar, ids, path=path)
+    logger().warning("Holding %d of %d Google event deletion(s) (%.1f%%) until observed again or confirmed: %s"
+                     % (len(deletes), num_google, percent, gcalendar))
+    selected = dict([(x, actions[x]) for x in actions if x != ACTION_DELETE])
+    return selected, {ACTION_DELETE: deletes}
@@ -0,0 +1,351 @@
+import json
+import logging
+import math
+import re
+import threading
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from typing import Dict, List, Any, Optional
+
+from itg.api.breaker import breakers
+
+
+# the number of most recent cycle durations to compute the percentiles from
+DURATION_WINDOW = 100
+
+# the percentiles of the cycle durations to report
+PERCENTILES = [50, 90, 99]
+
+PATH_HEALTH = "/health"
+PATH_READY = "/ready"
+PATH_METRICS = "/metrics"
+
+# the interface to bind to by default (local supervisors only)
+DEFAULT_HOST = "127.0.0.1"
+
+# matches URLs, keeping scheme and host as group 1 (paths/queries can carry secret tokens)
+URL_PATTERN = re.compile(r"([a-zA-Z][a-zA-Z0-9+.-]*://[^/\s'\"]+)[^\s'\"]*")
+
+# matches the URL paths reported by urllib3/requests errors ("... with url: /path?query ...")
+URL_PATH_PATTERN = re.compile(r"(url: )/[^\s'\"()]*")
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.health")
+    return _logger
+
+
+def count_actions(actions: Optional[Dict[str, List]]) -> int:
+    """
+    Returns the number of mutations.
+
+    :param actions: the dictionary with the add/delete/update event lists, can be None
+    :type actions: dict
+    :return: the number of mutations
+    :rtype: int
+    """
+    if actions is None:
+        return 0
+    return sum([len(actions[x]) for x in actions])
+
+
+def redact(text: Optional[str]) -> Optional[str]:
+    """
+    Removes path and query of URLs from the text, e.g., private calendar URLs.
+
+    :param text: the text to redact, can be None
+    :type text: str
+    :return: the redacted text
+    :rtype: str
+    """
+    if text is None:
+        return None
+    return URL_PATH_PATTERN.sub(r"\1/...", URL_PATTERN.sub(r"\1/...", text))
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """
+    Computes the percentile (nearest rank) of the values.
+
+    :param values: the values
+    :type values: list
+    :param p: the percentile (0-100)
+    :type p: float
+    :return: the percentile, None if no values
+    :rtype: float
+    """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, math.ceil(p / 100.0 * len(values)) - 1))
+    return values[index]
+
+
+class CycleStats:
+    """
+    In-memory statistics of the sync cycles of a job. Only gets updated at the start and
+    end of a cycle (and when the mutations are planned), the summary gets computed when
+    requested.
+    """
+
+    def __init__(self, name: str):
+        """
+        Initializes the statistics.
+
+        :param name: the name of the job (Google calendar)
+        :type name: str
+        """
+        self.name = name
+        self.cycles = 0
+        self.failed_cycles = 0
+        self.running_since = None
+        self.last_end = None
+        self.last_success = None
+        self.last_error = None
+        self.pending = 0
+        self.errors = dict()
+        self.durations = deque(maxlen=DURATION_WINDOW)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Records the start of a cycle.
+        """
+        with self._lock:
+            self.running_since = time()
+
+    def planned(self, num: int):
+        """
+        Records the number of mutations about to be executed.
+
+        :param num: the number of mutations
+        :type num: int
+        """
+        self.pending = num
+
+    def finish(self, success: bool, errors: Dict[str, List] = None, outstanding: int = 0, error: str = None):
+        """
+        Records the end of a cycle.
+
+        :param success: whether the cycle succeeded
+        :type success: bool
+        :param errors: the errors per action (as returned by sync), ignored if None
+        :type errors: dict
+        :param outstanding: the number of mutations left for the next cycle (deferred, held)
+        :type outstanding: int
+        :param error: the reason the cycle failed, ignored if None
+        :type error: str
+        """
+        now = time()
+        with self._lock:
+            self.cycles += 1
+            if self.running_since is not None:
+                self.durations.append(now - self.running_since)
+            self.running_since = None
+            self.last_end = now
+            self.pending = outstanding
+            if success:
+                self.last_success = now
+            else:
+                self.failed_cycles += 1
+            if error is not None:
+                self.last_error = error
+            if errors is not None:
+                for action in errors:
+                    self.errors[action] = self.errors.get(action, 0) + len(errors[action])
+
+    def last_activity(self) -> Optional[float]:
+        """
+        Returns the start of the running cycle or the end of the last one.
+
+        :return: the timestamp, None if no cycle yet
+        :rtype: float
+        """
+        with self._lock:
+            if self.running_since is not None:
+                return self.running_since
+            return self.last_end
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns the statistics as dictionary.
+
+        :return: the statistics
+        :rtype: dict
+        """
+        with self._lock:
+            durations = list(self.durations)
+            result = {
+                "cycles": self.cycles,
+                "failed_cycles": self.failed_cycles,
+                "running_since": self.running_since,
+                "last_end": self.last_end,
+                "last_success": self.last_success,
+                "last_error": redact(self.last_error),
+                "pending": self.pending,
+                "errors": dict(self.errors),
+            }
+        result["durations"] = dict([("p%d" % p, percentile(durations, p)) for p in PERCENTILES])
+        return result
+
+
+_stats = dict()
+
+_lock = threading.Lock()
+
+
+def get_stats(name: str) -> CycleStats:
+    """
+    Returns the process-wide statistics of the job, creating them if necessary.
+
+    :param name: the name of the job (Google calendar)
+    :type name: str
+    :return: the statistics
+    :rtype: CycleStats
+    """
+    with _lock:
+        if name not in _stats:
+            _stats[name] = CycleStats(name)
+        return _stats[name]
+
+
+def all_stats() -> Dict[str, CycleStats]:
+    """
+    Returns the statistics of all jobs.
+
+    :return: the name -> statistics mapping
+    :rtype: dict
+    """
+    with _lock:
+        return dict(_stats)
+
+
+def is_alive(stale_after: float = None, now: float = None) -> bool:
+    """
+    Checks whether no job is stuck, i.e., all jobs had activity (cycle started/ended)
+    within the specified number of seconds.
+
+    :param stale_after: the seconds without activity after which a job is considered stuck, always alive if None
+    :type stale_after: float
+    :param now: the current timestamp, uses the current time if None
+    :type now: float
+    :return: True if alive
+    :rtype: bool
+    """
+    if stale_after is None:
+        return True
+    if now is None:
+        now = time()
+    for stats in all_stats().values():
+        activity = stats.last_activity()
+        if (activity is not None) and (now - activity > stale_after):
+            return False
+    return True
+
+
+def is_ready() -> bool:
+    """
+    Checks whether all jobs completed at least one successful cycle. Jobs get registered
+    via get_stats before they start, so that jobs failing before their first cycle keep
+    the process from being ready.
+
+    :return: True if ready
+    :rtype: bool
+    """
+    stats = all_stats()
+    if len(stats) == 0:
+        return False
+    for s in stats.values():
+        if s.last_success is None:
+            return False
+    return True
+
+
+def health_report(stale_after: float = None) -> Dict[str, Any]:
+    """
+    Generates the report with liveness, readiness, the statistics of the jobs and the
+    states of the circuit breakers. URLs get redacted.
+
+    :param stale_after: the seconds without activity after which a job is considered stuck, always alive if None
+    :type stale_after: float
+    :return: the report
+    :rtype: dict
+    """
+    return {
+        "alive": is_alive(stale_after=stale_after),
+        "ready": is_ready(),
+        "time": time(),
+        "jobs": dict([(k, v.summary()) for k, v in all_stats().items()]),
+        "circuits": dict([(redact(k), v.state) for k, v in breakers().items()]),
+    }
+
+
+class HealthServer:
+    """
+    Small HTTP server reporting the health of the sync jobs, using a background thread:
+    /health (200 if alive, 503 if a job is stuck), /ready (200 once all jobs completed a
+    successful cycle, 503 otherwise) and /metrics (always 200), all with the JSON report.
+    """
+
+    def __init__(self, port: int, host: str = DEFAULT_HOST, stale_after: float = None):
+        """
+        Starts the server in a background thread.
+
+        :param port: the port to listen on, 0 for a random one
+        :type port: int
+        :param host: the host/interface to bind to, "" for all
+        :type host: str
+        :param stale_after: the seconds without activity after which a job is considered stuck, always alive if None
+        :type stale_after: float
+        """
+        self.stale_after = stale_after
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path not in [PATH_HEALTH, PATH_READY, PATH_METRICS]:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                report = health_report(stale_after=server.stale_after)
+                status = 200
+                if (path == PATH_HEALTH) and not report["alive"]:
+                    status = 503
+                elif (path == PATH_READY) and not report["ready"]:
+                    status = 503
+                data = json.dumps(report).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger().debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger().info("Serving health on port: %d" % self.port)
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,211 @@
+import bisect
+
+from datetime import datetime, date
+from typing import List, Callable, Optional, Tuple
+
+from itg.api.events import event_field, to_timestamp, EVENT_START, EVENT_END, EVENT_RECURRENCE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class EventIndex:
+    """
+    Interval index over events (or items containing events, see the key function), built
+    once from the start/end timestamps sorted by start. Range and overlap queries use binary
+    search, with the search for overlaps bounded by the longest event. Uses NumPy arrays
+    if available. Events without start are kept separately (in their original order),
+    events without end are treated as ending at their start.
+    """
+
+    def __init__(self, items: List, key: Callable = None):
+        """
+        Builds the index.
+
+        :param items: the events or items to index
+        :type items: list
+        :param key: the function for extracting the event from an item, uses the item itself if None
+        """
+        self.items = list(items)
+        dated = []
+        self._undated = []
+        self._recurring = set()
+        self._ends_missing = set()
+        for i, item in enumerate(self.items):
+            event = item if key is None else key(item)
+            start = to_timestamp(event_field(event, EVENT_START))
+            if start is None:
+                self._undated.append(i)
+                continue
+            end = to_timestamp(event_field(event, EVENT_END))
+            if (end is None) or (end < start):
+                self._ends_missing.add(i)
+                end = start
+            if event_field(event, EVENT_RECURRENCE) is not None:
+                self._recurring.add(i)
+            dated.append((start, end, i))
+        dated.sort()
+        self._key = key
+        self._order = [x[2] for x in dated]
+        self._max_duration = max([x[1] - x[0] for x in dated], default=0.0)
+        self._latest = None
+        if len(dated) > 0:
+            self._latest = max(dated, key=lambda x: (x[1], -x[2]))[2]
+        if numpy is not None:
+            self._starts = numpy.array([x[0] for x in dated], dtype=float)
+            self._ends = numpy.array([x[1] for x in dated], dtype=float)
+        else:
+            self._starts = [x[0] for x in dated]
+            self._ends = [x[1] for x in dated]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _event(self, i: int):
+        """
+        Returns the event of the item.
+
+        :param i: the index of the item
+        :type i: int
+        :return: the event
+        """
+        return self.items[i] if self._key is None else self._key(self.items[i])
+
+    def _search(self, values, value: float, right: bool = False) -> int:
+        """
+        Binary search in the sorted values.
+
+        :param values: the sorted values to search
+        :param value: the value to locate
+        :type value: float
+        :param right: whether to return the position after equal values
+        :type right: bool
+        :return: the insertion position
+        :rtype: int
+        """
+        if numpy is not None:
+            return int(numpy.searchsorted(values, value, side="right" if right else "left"))
+        if right:
+            return bisect.bisect_right(values, value)
+        else:
+            return bisect.bisect_left(values, value)
+
+    def _items(self, positions) -> List:
+        """
+        Returns the items at the positions in the sorted order.
+
+        :param positions: the positions
+        :return: the items
+        :rtype: list
+        """
+        return [self.items[self._order[int(p)]] for p in positions]
+
+    def date_range(self) -> Tuple[Optional[date], Optional[date]]:
+        """
+        Returns the date range of the events.
+
+        :return: the tuple of start/end date objects; None if no dated events
+        :rtype: tuple
+        """
+        if len(self._order) == 0:
+            return None, None
+        start = event_field(self._event(self._order[0]), EVENT_START)
+        if self._latest in self._ends_missing:
+            end = event_field(self._event(self._latest), EVENT_START)
+        else:
+            end = event_field(self._event(self._latest), EVENT_END)
+        if isinstance(start, datetime):
+            start = start.date()
+        if isinstance(end, datetime):
+            end = end.date()
+        return start, end
+
+    def sorted_items(self) -> List:
+        """
+        Returns the items sorted by start, items without start last.
+
+        :return: the sorted items
+        :rtype: list
+        """
+        return self._items(range(len(self._order))) + [self.items[i] for i in self._undated]
+
+    def starting_between(self, start: float, end: float) -> List:
+        """
+        Returns the items whose events start in the interval [start, end).
+
+        :param start: the start timestamp
+        :type start: float
+        :param end: the end timestamp
+        :type end: float
+        :return: the items sorted by start
+        :rtype: list
+        """
+        return self._items(range(self._search(self._starts, start), self._search(self._starts, end)))
+
+    def _overlapping(self, start: float, end: float) -> List[int]:
+        """
+        Determines the positions of the events that overlap the interval.
+
+        :param start: the start timestamp
+        :type start: float
+        :param end: the end timestamp
+        :type end: float
+        :return: the positions in sorted order
+        :rtype: list
+        """
+        lo = self._search(self._starts, start - self._max_duration)
+        hi = self._search(self._starts, end)
+        if numpy is not None:
+            return list(numpy.nonzero(self._ends[lo:hi] > start)[0] + lo)
+        return [p for p in range(lo, hi) if self._ends[p] > start]
+
+    def overlapping(self, start: float, end: float) -> List:
+        """
+        Returns the items whose events overlap the interval (start, end). Zero-length events
+        overlap if they start within the interval.
+
+        :param start: the start timestamp
+        :type start: float
+        :param end: the end timestamp
+        :type end: float
+        :return: the items sorted by start
+        :rtype: list
+        """
+        return self._items(self._overlapping(start, end))
+
+    def in_window(self, start: float, end: float) -> List:
+        """
+        Returns the items that get listed by Google Calendar for the time window: the events
+        overlapping the window, recurring events and events without start.
+
+        :param start: the start timestamp of the window
+        :type start: float
+        :param end: the end timestamp of the window
+        :type end: float
+        :return: the items sorted by start, items without start last
+        :rtype: list
+        """
+        positions = set([int(p) for p in self._overlapping(start, end)])
+        if len(self._recurring) > 0:
+            for p, i in enumerate(self._order):
+                if i in self._recurring:
+                    positions.add(p)
+        return self._items(sorted(positions)) + [self.items[i] for i in self._undated]
+
+    def nearest(self, now: float) -> List:
+        """
+        Returns the items sorted by how close the start of their events is to the reference
+        time, using the original order as tie-breaker. Items without start come last.
+
+        :param now: the reference timestamp
+        :type now: float
+        :return: the sorted items
+        :rtype: list
+        """
+        if numpy is not None:
+            positions = numpy.lexsort((numpy.array(self._order, dtype=int), numpy.abs(self._starts - now)))
+        else:
+            positions = sorted(range(len(self._order)), key=lambda p: (abs(self._starts[p] - now), self._order[p]))
+        return self._items(positions) + [self.items[i] for i in self._undated]
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import re
+
+from typing import Dict, List, Optional
+
+import icalendar
+
+from itg.api.core import get_default_config_dir
+
+
+JOURNAL_PLAN = "plan"
+JOURNAL_DONE = "done"
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.journal")
+    return _logger
+
+
+def default_journal_path(gcalendar: str) -> str:
+    """
+    Returns the default journal path for the Google calendar, located in the config dir.
+
+    :param gcalendar: the Google Calendar ID
+    :type gcalendar: str
+    :return: the journal path
+    :rtype: str
+    """
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", gcalendar)
+    return os.path.join(get_default_config_dir(), "journal-%s.jsonl" % name)
+
+
+def operation_key(action: str, item) -> str:
+    """
+    Generates the key that identifies a single mutation in the journal.
+
+    :param action: the action (add/update/delete)
+    :type action: str
+    :param item: the action item, i.e., Outlook event (add), Outlook/Google event tuple (update) or Google event (delete)
+    :return: the key
+    :rtype: str
+    """
+    if isinstance(item, tuple):
+        return "%s:%s:%s" % (action, item[0]["UID"], item[1]["id"])
+    elif isinstance(item, icalendar.Event):
+        return "%s:%s" % (action, item["UID"])
+    else:
+        return "%s:%s" % (action, item["id"])
+
+
+def _encode_item(item):
+    """
+    Turns the action item into a JSON-serializable representation.
+
+    :param item: the item to encode
+    :return: the encoded item
+    """
+    if isinstance(item, tuple):
+        return [item[0].to_ical().decode(), item[1]]
+    elif isinstance(item, icalendar.Event):
+        return item.to_ical().decode()
+    else:
+        return item
+
+
+def _decode_item(data):
+    """
+    Restores the action item from its JSON representation.
+
+    :param data: the encoded item
+    :return: the action item
+    """
+    if isinstance(data, list):
+        return icalendar.Event.from_ical(data[0]), data[1]
+    elif isinstance(data, str):
+        return icalendar.Event.from_ical(data)
+    else:
+        return data
+
+
+def _append(path: str, entries: List[Dict]):
+    """
+    Appends the entries to the journal and forces them to disk.
+
+    :param path: the journal file
+    :type path: str
+    :param entries: the entries to append
+    :type entries: list
+    """
+    with open(path, "a") as fp:
+        for entry in entries:
+            fp.write(json.dumps(entry))
+            fp.write("\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+def start_journal(path: str, actions: Dict[str, List]):
+    """
+    Starts a new journal, recording all the planned mutations.
+
+    :param path: the journal file
+    :type path: str
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    """
+    logger().info("Starting journal: %s" % path)
+    if os.path.exists(path):
+        os.remove(path)
+    entries = []
+    for action in actions:
+        for item in actions[action]:
+            entries.append({
+                "type": JOURNAL_PLAN,
+                "action": action,
+                "key": operation_key(action, item),
+                "item": _encode_item(item),
+            })
+    _append(path, entries)
+
+
+def record_done(path: str, key: str):
+    """
+    Records the mutation as completed.
+
+    :param path: the journal file
+    :type path: str
+    :param key: the key of the completed operation
+    :type key: str
+    """
+    _append(path, [{"type": JOURNAL_DONE, "key": key}])
+
+
+def load_pending(path: str) -> Optional[Dict[str, List]]:
+    """
+    Loads the planned mutations from the journal that have not been completed yet.
+    A truncated last line (e.g., from a crash while writing) gets ignored.
+
+    :param path: the journal file
+    :type path: str
+    :return: the dictionary with the outstanding add/delete/update event lists, None if no journal or nothing outstanding
+    :rtype: dict
+    """
+    if not os.path.exists(path):
+        return None
+
+    planned = []
+    done = set()
+    with open(path) as fp:
+        for line in fp:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger().warning("Skipping corrupt journal entry in: %s" % path)
+                continue
+            if entry["type"] == JOURNAL_PLAN:
+                planned.append(entry)
+            elif entry["type"] == JOURNAL_DONE:
+                done.add(entry["key"])
+
+    result = dict()
+    for entry in planned:
+        if entry["key"] in done:
+            continue
+        if entry["action"] not in result:
+            result[entry["action"]] = []
+        result[entry["action"]].append(_decode_item(entry["item"]))
+
+    if len(result) == 0:
+        return None
+    logger().info("Journal %s: %d completed, %d outstanding" % (path, len(done), sum([len(result[x]) for x in result])))
+    return result
+
+
+def clear_journal(path: str):
+    """
+    Removes the journal after the plan has been executed completely.
+
+    :param path: the journal file
+    :type path: str
+    """
+    if os.path.exists(path):
+        logger().info("Removing journal: %s" % path)
+        os.remove(path)
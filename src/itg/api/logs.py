@@ -0,0 +1,153 @@
+import json
+import logging
+import threading
+
+from typing import Dict, Optional
+
+
+# the maximum number of log messages per event name and cycle, further ones only get counted
+SAMPLE_LIMIT = 20
+
+# the logger name used for the summary
+SUMMARY_LOGGER = "itg.api.logs"
+
+
+# counters and sample limit are per thread, i.e., per sync job
+_local = threading.local()
+
+
+class LazyJson:
+    """
+    Defers the JSON serialization of an object until the log message actually gets formatted.
+    """
+
+    def __init__(self, obj):
+        """
+        Initializes the wrapper.
+
+        :param obj: the object to serialize
+        """
+        self.obj = obj
+
+    def __str__(self) -> str:
+        return json.dumps(self.obj, indent=2, default=str)
+
+
+class LazyFields:
+    """
+    Defers the formatting of the key=value pairs of a structured log event.
+    """
+
+    def __init__(self, fields: Dict):
+        """
+        Initializes the wrapper.
+
+        :param fields: the fields of the event
+        :type fields: dict
+        """
+        self.fields = fields
+
+    def __str__(self) -> str:
+        return ", ".join(["%s=%s" % (k, self.fields[k]) for k in self.fields])
+
+
+def _counts() -> Dict[str, int]:
+    """
+    Returns the event counters of the current thread.
+
+    :return: the event name -> count mapping
+    :rtype: dict
+    """
+    if not hasattr(_local, "counts"):
+        _local.counts = dict()
+    return _local.counts
+
+
+def _sample_limit() -> Optional[int]:
+    """
+    Returns the sample limit of the current thread.
+
+    :return: the limit, None if no limit
+    :rtype: int
+    """
+    return getattr(_local, "sample_limit", SAMPLE_LIMIT)
+
+
+def set_sample_limit(limit: int):
+    """
+    Sets the maximum number of log messages per event name and cycle for the current thread.
+
+    :param limit: the limit, no limit if None
+    :type limit: int
+    """
+    _local.sample_limit = limit
+
+
+def reset_counters():
+    """
+    Resets the event counters of the current thread, i.e., starts a new cycle.
+    """
+    _counts().clear()
+
+
+def counters() -> Dict[str, int]:
+    """
+    Returns a copy of the event counters of the current thread's cycle.
+
+    :return: the event name -> count mapping
+    :rtype: dict
+    """
+    return dict(_counts())
+
+
+def log_event(lg: logging.Logger, level: int, name: str, sample: bool = True, **fields):
+    """
+    Counts the event and logs it if the logger is enabled for the level. The fields only
+    get formatted when the message gets emitted, they are also available to handlers
+    via the "itg_event" and "itg_fields" attributes of the log record.
+
+    :param lg: the logger to use
+    :type lg: logging.Logger
+    :param level: the logging level
+    :type level: int
+    :param name: the name of the event
+    :type name: str
+    :param sample: whether to limit the number of messages per cycle (see set_sample_limit)
+    :type sample: bool
+    :param fields: the fields of the event
+    """
+    counts = _counts()
+    count = counts.get(name, 0) + 1
+    counts[name] = count
+    if not lg.isEnabledFor(level):
+        return
+    limit = _sample_limit()
+    if sample and (limit is not None) and (count > limit):
+        return
+    lg.log(level, "%s: %s", name, LazyFields(fields), extra={"itg_event": name, "itg_fields": fields})
+
+
+def log_summary(lg: logging.Logger = None, level: int = logging.INFO):
+    """
+    Logs the event counters of the current cycle, including how many messages got suppressed.
+
+    :param lg: the logger to use, uses SUMMARY_LOGGER if None
+    :type lg: logging.Logger
+    :param level: the logging level
+    :type level: int
+    """
+    if lg is None:
+        lg = logging.getLogger(SUMMARY_LOGGER)
+    if not lg.isEnabledFor(level):
+        return
+    counts = counters()
+    if len(counts) == 0:
+        return
+    limit = _sample_limit()
+    parts = []
+    for name in sorted(counts):
+        if (limit is not None) and (counts[name] > limit):
+            parts.append("%s=%d (%d not logged)" % (name, counts[name], counts[name] - limit))
+        else:
+            parts.append("%s=%d" % (name, counts[name]))
+    lg.log(level, "summary: %s", ", ".join(parts), extra={"itg_event": "summary", "itg_fields": counts})
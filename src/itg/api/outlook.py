@@ -1,16 +1,35 @@
+import gzip
+import hashlib
+import importlib.util
 import logging
 import os
 import re
-import shutil
+import tempfile
+import threading
 
-from typing import List
+from typing import List, Optional, Iterator
 
 import icalendar
-import requests
+
+from itg.api.events import resolve_timezones, calendar_zone, localize_floating
+from itg.api.transport import get_transport
+
+
+CHUNK_SIZE = 65536
+
+# the default timeout in seconds for connecting to/reading from a calendar URL
+DEFAULT_TIMEOUT = 60
 
 
 _logger = None
 
+_accept_encoding = None
+
+# output file -> digest of the last saved data
+_saved_digests = dict()
+
+_saved_lock = threading.Lock()
+
 
 def logger() -> logging.Logger:
     """
@@ -25,59 +44,190 @@ def logger() -> logging.Logger:
     return _logger
 
 
-def load_calendar_from_url(url: str, output_file: str = None) -> icalendar.Calendar:
+def accept_encoding() -> str:
+    """
+    Returns the compression methods to advertise when downloading calendars;
+    brotli only gets included if the brotli library is available for decoding.
+
+    :return: the value for the Accept-Encoding header
+    :rtype: str
+    """
+    global _accept_encoding
+    if _accept_encoding is None:
+        _accept_encoding = "gzip, deflate"
+        if importlib.util.find_spec("brotli") is not None:
+            _accept_encoding += ", br"
+    return _accept_encoding
+
+
+def _file_digest(path: str) -> Optional[str]:
+    """
+    Computes the digest of the (decompressed) content of the file.
+
+    :param path: the file to compute the digest for
+    :type path: str
+    :return: the digest, None if the file does not exist or cannot be read
+    :rtype: str
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        opener = gzip.open if path.endswith(".gz") else open
+        h = hashlib.sha256()
+        with opener(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except:
+        return None
+
+
+def save_calendar_data(data: bytes, output_file: str, keep: int = 0) -> bool:
+    """
+    Saves the raw calendar data, but only if it differs from the previously saved data.
+    Files ending in .gz get stored gzip-compressed. Previous versions can be kept by
+    rotating them to output_file.1, output_file.2, etc. The data gets written to a temporary
+    file first, which then replaces the output file. Thread-safe.
+
+    :param data: the raw calendar data
+    :type data: bytes
+    :param output_file: the file to save the calendar to
+    :type output_file: str
+    :param keep: the number of previous versions to keep
+    :type keep: int
+    :return: True if the data was written
+    :rtype: bool
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    with _saved_lock:
+        if output_file not in _saved_digests:
+            _saved_digests[output_file] = _file_digest(output_file)
+        if _saved_digests[output_file] == digest:
+            logger().info("Calendar unchanged, not saving: %s" % output_file)
+            return False
+
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".%s-" % os.path.basename(output_file), suffix=".tmp",
+                                       dir=os.path.dirname(os.path.abspath(output_file)))
+            with os.fdopen(fd, "wb") as fp:
+                if output_file.endswith(".gz"):
+                    with gzip.GzipFile(fileobj=fp, mode="wb") as gz:
+                        gz.write(data)
+                else:
+                    fp.write(data)
+            if os.path.exists(output_file) and (keep > 0):
+                for i in range(keep - 1, 0, -1):
+                    if os.path.exists("%s.%d" % (output_file, i)):
+                        os.replace("%s.%d" % (output_file, i), "%s.%d" % (output_file, i + 1))
+                os.replace(output_file, "%s.1" % output_file)
+            os.replace(tmp, output_file)
+            _saved_digests[output_file] = digest
+            return True
+        except:
+            logger().error("Failed to save Outlook calendar to: %s" % output_file)
+            if (tmp is not None) and os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+
+
+def read_calendar_from_url(url: str, timeout: float = DEFAULT_TIMEOUT) -> bytes:
     """
-    Loads a calendar from a URL.
+    Downloads the raw calendar data from a URL. Compressed transfer gets negotiated with
+    the server; the complete (decompressed) data is returned.
+
+    :param url: the URL to load the calendar from
+    :type url: str
+    :param timeout: the timeout in seconds for connecting and for each read, waits indefinitely if None
+    :type timeout: float
+    :return: the calendar data
+    :rtype: bytes
+    """
+    logger().info("Downloading calendar: %s" % url)
+    status, headers, data = get_transport().get(url, headers={"Accept-Encoding": accept_encoding()}, timeout=timeout)
+    if status != 200:
+        raise Exception("Failed to retrieve Outlook calendar '%s', status code: %d" % (url, status))
+    logger().info("Content-Encoding: %s" % headers.get("content-encoding", "identity"))
+    return data
+
+
+def read_calendar_from_path(path: str) -> bytes:
+    """
+    Reads the raw calendar data from a file. Files ending in .gz get decompressed.
+
+    :param path: the calendar file to read
+    :type path: str
+    :return: the calendar data
+    :rtype: bytes
+    """
+    logger().info("Loading calendar: %s" % path)
+    if os.path.exists(path) and os.path.isfile(path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as fp:
+            return fp.read()
+    else:
+        raise IOError("Calendar file does not exist: %s" % path)
+
+
+def read_calendar(path_or_url: str, timeout: float = DEFAULT_TIMEOUT) -> bytes:
+    """
+    Reads the raw data of the shared Outlook calendar by its public .ics path or URL.
+
+    :param path_or_url: the path or URL of the calendar to read
+    :type path_or_url: str
+    :param timeout: the timeout in seconds for URLs, waits indefinitely if None
+    :type timeout: float
+    :return: the calendar data
+    :rtype: bytes
+    """
+    if path_or_url.startswith("http:") or path_or_url.startswith("https:"):
+        return read_calendar_from_url(path_or_url, timeout=timeout)
+    else:
+        return read_calendar_from_path(path_or_url)
+
+
+def load_calendar_from_url(url: str, output_file: str = None, output_keep: int = 0, timeout: float = DEFAULT_TIMEOUT) -> icalendar.Calendar:
+    """
+    Loads a calendar from a URL. Compressed transfer gets negotiated with the server.
+    The complete (decompressed) data gets downloaded first and then parsed in one go.
 
     :param url: the URL to load the calendar from
     :type url: str
     :param output_file: the file to save the calendar to, ignored if None
     :type output_file: str
+    :param output_keep: the number of previous versions of the output file to keep
+    :type output_keep: int
+    :param timeout: the timeout in seconds for connecting and for each read, waits indefinitely if None
+    :type timeout: float
     :return: the calendar
     :rtype: icalendar.Calendar
     """
-    logger().info("Downloading calendar: %s" % url)
-    r = requests.get(url)
-    if r.status_code == 200:
-        result = icalendar.Calendar.from_ical(r.text)
-        if output_file is not None:
-            try:
-                with open(output_file, "w") as fp:
-                    fp.write(r.text)
-                    fp.write("\n")
-            except:
-                logger().error("Failed to save Outlook calendar to: %s" % output_file)
-        return result
-    else:
-        raise Exception("Failed to retrieve Outlook calendar '%s', status code: %d" % (url, r.status_code))
+    data = read_calendar_from_url(url, timeout=timeout)
+    if output_file is not None:
+        save_calendar_data(data, output_file, keep=output_keep)
+    return icalendar.Calendar.from_ical(data)
 
 
-def load_calendar_from_path(path: str, output_file: str = None) -> icalendar.Calendar:
+def load_calendar_from_path(path: str, output_file: str = None, output_keep: int = 0) -> icalendar.Calendar:
     """
-    Loads a calendar from a file.
+    Loads a calendar from a file. Files ending in .gz get decompressed.
 
     :param path: the calendar file to load
     :type path: str
     :param output_file: the file to save the calendar to, ignored if None
     :type output_file: str
+    :param output_keep: the number of previous versions of the output file to keep
+    :type output_keep: int
     :return: the calendar
     :rtype: icalendar.Calendar
     """
-    logger().info("Loading calendar: %s" % path)
-    if os.path.exists(path) and os.path.isfile(path):
-        with open(path) as fp:
-            result = icalendar.Calendar.from_ical(fp.read())
-            if output_file is not None:
-                try:
-                    shutil.copy(path, output_file)
-                except:
-                    logger().error("Failed to copy Outlook calendar to: %s" % output_file)
-            return result
-    else:
-        raise IOError("Calendar file does not exist: %s" % path)
+    data = read_calendar_from_path(path)
+    if output_file is not None:
+        save_calendar_data(data, output_file, keep=output_keep)
+    return icalendar.Calendar.from_ical(data)
 
 
-def load_calendar(path_or_url: str, output_file: str = None) -> icalendar.Calendar:
+def load_calendar(path_or_url: str, output_file: str = None, output_keep: int = 0, timeout: float = DEFAULT_TIMEOUT) -> icalendar.Calendar:
     """
     Loads the shared Outlook calendar by its public .ics path or URL.
 
@@ -85,13 +235,62 @@ def load_calendar(path_or_url: str, output_file: str = None) -> icalendar.Calend
     :type path_or_url: str
     :param output_file: the file to save the calendar to, ignored if None
     :type output_file: str
+    :param output_keep: the number of previous versions of the output file to keep
+    :type output_keep: int
+    :param timeout: the timeout in seconds for URLs, waits indefinitely if None
+    :type timeout: float
     :return: the calendar
     :rtype: icalendar.Calendar
     """
     if path_or_url.startswith("http:") or path_or_url.startswith("https:"):
-        return load_calendar_from_url(path_or_url, output_file=output_file)
+        return load_calendar_from_url(path_or_url, output_file=output_file, output_keep=output_keep, timeout=timeout)
     else:
-        return load_calendar_from_path(path_or_url, output_file=output_file)
+        return load_calendar_from_path(path_or_url, output_file=output_file, output_keep=output_keep)
+
+
+def event_matches(event: icalendar.Event, regexp_id: str = None, regexp_summary: str = None) -> bool:
+    """
+    Checks whether the Outlook event matches the regular expressions.
+
+    :param event: the event to check
+    :type event: icalendar.Event
+    :param regexp_id: the regexp that the event ID must match, ignored if None
+    :type regexp_id: str
+    :param regexp_summary: the regexp that the summary must match, ignored if None
+    :type regexp_summary: str
+    :return: True if the event matches
+    :rtype: bool
+    """
+    if regexp_id is not None:
+        match = re.match(regexp_id, event["UID"])
+        if not match:
+            return False
+    if regexp_summary is not None:
+        match = re.match(regexp_summary, event["SUMMARY"])
+        if not match:
+            return False
+    return True
+
+
+def iter_events(calendar: icalendar.Calendar, regexp_id: str = None, regexp_summary: str = None) -> Iterator:
+    """
+    Iterates over the events that match the regular expressions. Floating datetimes get
+    the calendar's X-WR-TIMEZONE attached, if specified.
+
+    :param calendar: the Outlook calendar to filter
+    :type calendar: icalendar.Calendar
+    :param regexp_id: the regexp that the event IDs must match, ignored if None
+    :type regexp_id: str
+    :param regexp_summary: the regexp that the summaries must match, ignored if None
+    :type regexp_summary: str
+    :return: the event iterator
+    """
+    resolve_timezones(calendar)
+    zone = calendar_zone(calendar)
+
+    for event in calendar.walk('VEVENT'):
+        if event_matches(event, regexp_id=regexp_id, regexp_summary=regexp_summary):
+            yield localize_floating(event, zone)
 
 
 def filter_events(calendar: icalendar.Calendar, regexp_id: str = None, regexp_summary: str = None) -> List:
@@ -107,17 +306,4 @@ def filter_events(calendar: icalendar.Calendar, regexp_id: str = None, regexp_su
     :return: the list of events
     :rtype: list
     """
-    result = []
-
-    for event in calendar.walk('VEVENT'):
-        if regexp_id is not None:
-            match = re.match(regexp_id, event["UID"])
-            if not match:
-                continue
-        if regexp_summary is not None:
-            match = re.match(regexp_summary, event["SUMMARY"])
-            if not match:
-                continue
-        result.append(event)
-
-    return result
+    return list(iter_events(calendar, regexp_id=regexp_id, regexp_summary=regexp_summary))
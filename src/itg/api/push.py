@@ -0,0 +1,372 @@
+import logging
+import threading
+import uuid
+
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from typing import Dict, List
+
+import requests
+
+from googleapiclient.errors import HttpError
+from itg.api.google import time_window, time_window_timestamps, event_matches, compact_event, EVENT_PROJECTION, MAX_RESULTS
+from itg.api.interval import EventIndex
+
+
+# the requested lifetime of a notification channel in seconds
+CHANNEL_TTL = 7 * 24 * 3600
+
+# the seconds before expiry at which channels get renewed
+CHANNEL_RENEWAL_MARGIN = 3600
+
+# resource state of the initial message sent when a channel gets created
+STATE_SYNC = "sync"
+
+# the interface to bind the receiver to by default (reverse proxy/tunnel on the same host)
+DEFAULT_HOST = "127.0.0.1"
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.push")
+    return _logger
+
+
+class NotificationReceiver:
+    """
+    Small HTTP server receiving the Calendar push notifications, marking the calendar
+    associated with the notifying channel as dirty.
+    """
+
+    def __init__(self, port: int, host: str = DEFAULT_HOST):
+        """
+        Starts the server in a background thread.
+
+        :param port: the port to listen on, 0 for a random one
+        :type port: int
+        :param host: the host/interface to bind to, empty string for all interfaces
+        :type host: str
+        """
+        self._channels = dict()
+        self._dirty = set()
+        self._condition = threading.Condition()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                if length > 0:
+                    self.rfile.read(length)
+                receiver.notify(self.headers.get("X-Goog-Channel-ID"), self.headers.get("X-Goog-Resource-State"),
+                                self.headers.get("X-Goog-Channel-Token"))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger().debug(format % args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger().info("Listening for notifications on: %s:%d" % (host, self.port))
+
+    def register(self, channel_id: str, calendar: str, token: str = None):
+        """
+        Associates the channel with the calendar.
+
+        :param channel_id: the ID of the channel
+        :type channel_id: str
+        :param calendar: the Google Calendar ID
+        :type calendar: str
+        :param token: the token that notifications of the channel must carry, ignored if None
+        :type token: str
+        """
+        with self._condition:
+            self._channels[channel_id] = (calendar, token)
+
+    def unregister(self, channel_id: str):
+        """
+        Removes the channel.
+
+        :param channel_id: the ID of the channel
+        :type channel_id: str
+        """
+        with self._condition:
+            self._channels.pop(channel_id, None)
+
+    def notify(self, channel_id: str, state: str, token: str = None):
+        """
+        Processes a notification.
+
+        :param channel_id: the ID of the notifying channel
+        :type channel_id: str
+        :param state: the resource state
+        :type state: str
+        :param token: the channel token
+        :type token: str
+        """
+        with self._condition:
+            if channel_id not in self._channels:
+                logger().info("Notification for unknown channel: %s" % channel_id)
+                return
+            calendar, expected = self._channels[channel_id]
+            if (expected is not None) and (token != expected):
+                logger().warning("Notification with invalid token for channel: %s" % channel_id)
+                return
+            if state == STATE_SYNC:
+                return
+            logger().info("Calendar changed: %s" % calendar)
+            self._dirty.add(calendar)
+            self._condition.notify_all()
+
+    def is_dirty(self, calendar: str) -> bool:
+        """
+        Returns whether a change notification was received for the calendar.
+
+        :param calendar: the Google Calendar ID
+        :type calendar: str
+        :return: True if dirty
+        :rtype: bool
+        """
+        with self._condition:
+            return calendar in self._dirty
+
+    def clear(self, calendar: str):
+        """
+        Marks the calendar as clean again.
+
+        :param calendar: the Google Calendar ID
+        :type calendar: str
+        """
+        with self._condition:
+            self._dirty.discard(calendar)
+
+    def wait(self, calendar: str, timeout: float = None) -> bool:
+        """
+        Waits for the calendar to become dirty.
+
+        :param calendar: the Google Calendar ID
+        :type calendar: str
+        :param timeout: the maximum number of seconds to wait, waits indefinitely if None
+        :type timeout: float
+        :return: True if dirty
+        :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: calendar in self._dirty, timeout=timeout)
+
+    def close(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ChannelManager:
+    """
+    Manages the events.watch channel of a calendar, renewing it before it expires.
+    """
+
+    def __init__(self, service, calendar: str, address: str, receiver: NotificationReceiver, ttl: int = CHANNEL_TTL):
+        """
+        Initializes the manager.
+
+        :param service: the Google Calendar service instance to use
+        :param calendar: the Google Calendar ID
+        :type calendar: str
+        :param address: the public HTTPS URL that forwards to the receiver
+        :type address: str
+        :param receiver: the receiver for the notifications
+        :type receiver: NotificationReceiver
+        :param ttl: the requested lifetime of the channels in seconds
+        :type ttl: int
+        """
+        self.service = service
+        self.calendar = calendar
+        self.address = address
+        self.receiver = receiver
+        self.ttl = ttl
+        self.channel = None
+        self.expiration = None
+
+    def ensure(self):
+        """
+        Creates the channel if there is none or the current one is about to expire.
+        """
+        if (self.channel is not None) and (self.expiration - time() > CHANNEL_RENEWAL_MARGIN):
+            return
+        old = self.channel
+        channel_id = str(uuid.uuid4())
+        token = uuid.uuid4().hex
+        self.receiver.register(channel_id, self.calendar, token=token)
+        try:
+            self.channel = self.service.events().watch(
+                calendarId=self.calendar,
+                body={
+                    "id": channel_id,
+                    "type": "web_hook",
+                    "address": self.address,
+                    "token": token,
+                    "params": {"ttl": str(self.ttl)},
+                },
+            ).execute()
+        except:
+            self.receiver.unregister(channel_id)
+            raise
+        self.expiration = int(self.channel.get("expiration", (time() + self.ttl) * 1000)) / 1000
+        logger().info("Created channel %s for %s, expires: %s" % (channel_id, self.calendar, datetime.fromtimestamp(self.expiration)))
+        if old is not None:
+            self._stop(old)
+
+    def _stop(self, channel: Dict):
+        """
+        Stops the channel.
+
+        :param channel: the channel as returned by events.watch
+        :type channel: dict
+        """
+        self.receiver.unregister(channel["id"])
+        try:
+            self.service.channels().stop(body={"id": channel["id"], "resourceId": channel["resourceId"]}).execute()
+        except:
+            logger().warning("Failed to stop channel: %s" % channel["id"], exc_info=True)
+
+    def stop(self):
+        """
+        Stops the current channel.
+        """
+        if self.channel is not None:
+            self._stop(self.channel)
+            self.channel = None
+
+
+class IncrementalEvents:
+    """
+    Keeps the Google events of a calendar in memory and updates them incrementally
+    using sync tokens. The initial full fetch is restricted to the start of the time window
+    (see itg.api.google.time_window); as sync tokens cannot be combined with timeMin,
+    events that ended before the time window get discarded after each fetch.
+    """
+
+    def __init__(self, service, calendar: str):
+        """
+        Initializes the cache.
+
+        :param service: the Google Calendar service instance to use
+        :param calendar: the Google Calendar ID
+        :type calendar: str
+        """
+        self.service = service
+        self.calendar = calendar
+        self.sync_token = None
+        self._events = dict()
+
+    def fetch(self):
+        """
+        Retrieves the changes since the last fetch (all events the first time).
+        """
+        params = {
+            "calendarId": self.calendar,
+            "showDeleted": True,
+            "maxResults": MAX_RESULTS,
+            "fields": "items(%s),nextPageToken,nextSyncToken" % ",".join(EVENT_PROJECTION),
+        }
+        if self.sync_token is not None:
+            params["syncToken"] = self.sync_token
+        else:
+            params["timeMin"] = time_window()[0]
+            self._events = dict()
+
+        changes = 0
+        try:
+            request = self.service.events().list(**params)
+            while request is not None:
+                events = request.execute()
+                for event in events.get("items", []):
+                    changes += 1
+                    if event["status"].lower() == "cancelled":
+                        self._events.pop(event["id"], None)
+                    else:
+                        self._events[event["id"]] = compact_event(event)
+                if "nextSyncToken" in events:
+                    self.sync_token = events["nextSyncToken"]
+                request = self.service.events().list_next(request, events)
+        except HttpError as error:
+            if (self.sync_token is not None) and (error.resp.status == 410):
+                logger().info("Sync token expired, performing full fetch: %s" % self.calendar)
+                self.sync_token = None
+                self.fetch()
+                return
+            raise
+        self._prune()
+        logger().info("Fetched %d change(s) for: %s" % (changes, self.calendar))
+
+    def _prune(self):
+        """
+        Removes the events that ended before the start of the time window. Later events get
+        kept, as they move into the window over time without changing.
+        """
+        time_min = time_window_timestamps()[0]
+        events = EventIndex(list(self._events.values())).in_window(time_min, float("inf"))
+        if len(events) < len(self._events):
+            logger().debug("Discarding %d past event(s) of: %s" % (len(self._events) - len(events), self.calendar))
+            self._events = dict([(x["id"], x) for x in events])
+
+    def events(self, regexp_id: str = None, regexp_summary: str = None) -> List:
+        """
+        Returns the cached events within the time window (see itg.api.google.time_window)
+        that match the regular expressions.
+
+        :param regexp_id: the regular expression that the event IDs must match, ignored if None
+        :type regexp_id: str
+        :param regexp_summary: the regular expression that the event summaries must match, ignored if None
+        :type regexp_summary: str
+        :return: the events
+        :rtype: list
+        """
+        events = [x for x in self._events.values() if event_matches(x, regexp_id=regexp_id, regexp_summary=regexp_summary)]
+        return EventIndex(events).in_window(*time_window_timestamps())
+
+
+def post_notification(url: str, channel_id: str, state: str = "exists", token: str = None,
+                      resource_id: str = "resource", timeout: float = 10) -> int:
+    """
+    Posts a notification like Google Calendar does, e.g., for testing a receiver locally.
+
+    :param url: the URL of the receiver
+    :type url: str
+    :param channel_id: the channel ID
+    :type channel_id: str
+    :param state: the resource state (sync/exists/not_exists)
+    :type state: str
+    :param token: the channel token, ignored if None
+    :type token: str
+    :param resource_id: the resource ID
+    :type resource_id: str
+    :param timeout: the timeout in seconds
+    :type timeout: float
+    :return: the HTTP status code
+    :rtype: int
+    """
+    headers = {
+        "X-Goog-Channel-ID": channel_id,
+        "X-Goog-Resource-ID": resource_id,
+        "X-Goog-Resource-State": state,
+        "X-Goog-Message-Number": "1",
+    }
+    if token is not None:
+        headers["X-Goog-Channel-Token"] = token
+    return requests.post(url, headers=headers, timeout=timeout).status_code
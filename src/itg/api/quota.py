@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from datetime import date
+from typing import Dict, List, Tuple
+
+from itg.api.core import get_default_config_dir
+from itg.api.sync import schedule, ACTION_ADD, ACTION_UPDATE, ACTION_DELETE, ABORTED
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# API units per mutation
+QUOTA_COSTS = {
+    ACTION_ADD: 1,
+    ACTION_UPDATE: 1,
+    ACTION_DELETE: 1,
+}
+
+# API units for listing the Google events
+QUOTA_COST_LIST = 1
+
+
+_logger = None
+
+_lock = threading.Lock()
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.quota")
+    return _logger
+
+
+def quota_path() -> str:
+    """
+    Returns the path of the file storing the daily quota usage.
+
+    :return: the path
+    :rtype: str
+    """
+    return os.path.join(get_default_config_dir(), "quota.json")
+
+
+def estimate_cost(actions: Dict[str, List]) -> int:
+    """
+    Estimates the number of API units that executing the actions will cost.
+
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :return: the estimated units
+    :rtype: int
+    """
+    result = 0
+    for action in actions:
+        result += QUOTA_COSTS[action] * len(actions[action])
+    return result
+
+
+def attempted_cost(actions: Dict[str, List], errors: Dict[str, List]) -> int:
+    """
+    Estimates the number of API units that executing the actions cost, excluding the ones
+    skipped after the sync got aborted (errors starting with ABORTED).
+
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param errors: the error dictionary returned by the sync
+    :type errors: dict
+    :return: the estimated units
+    :rtype: int
+    """
+    result = estimate_cost(actions)
+    for action in errors:
+        for item in errors[action]:
+            if item[-1].startswith(ABORTED):
+                result -= QUOTA_COSTS[action]
+    return max(0, result)
+
+
+def load_usage(path: str = None) -> int:
+    """
+    Returns the API units used today.
+
+    :param path: the file with the usage, uses quota_path() if None
+    :type path: str
+    :return: the units used so far today
+    :rtype: int
+    """
+    if path is None:
+        path = quota_path()
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path) as fp:
+            usage = json.load(fp)
+    except:
+        logger().error("Failed to read quota usage from: %s" % path, exc_info=True)
+        return 0
+    if usage.get("date") != date.today().isoformat():
+        return 0
+    return usage.get("used", 0)
+
+
+def record_usage(units: int, path: str = None):
+    """
+    Adds the units to today's usage. Thread-safe (concurrent jobs) and, where fcntl is available,
+    process-safe (separate itg processes) via a lock file next to the usage file. The file gets
+    replaced atomically.
+
+    :param units: the units to add
+    :type units: int
+    :param path: the file with the usage, uses quota_path() if None
+    :type path: str
+    """
+    if path is None:
+        path = quota_path()
+    with _lock, open(path + ".lock", "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            used = load_usage(path=path) + units
+            fd, tmp = tempfile.mkstemp(prefix=".quota-", suffix=".tmp", dir=os.path.dirname(os.path.abspath(path)))
+            with os.fdopen(fd, "w") as fp:
+                json.dump({"date": date.today().isoformat(), "used": used}, fp)
+            os.replace(tmp, path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    logger().info("Quota units used today: %d" % used)
+
+
+def apply_budget(actions: Dict[str, List], run_budget: int = None, day_budget: int = None,
+                 path: str = None) -> Tuple[Dict[str, List], Dict[str, List]]:
+    """
+    Restricts the actions to the ones that fit into the remaining budget. When the budget
+    does not suffice, the actions get selected in the order determined by schedule().
+
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param run_budget: the maximum number of units to use in this run, ignored if None
+    :type run_budget: int
+    :param day_budget: the maximum number of units to use per day, ignored if None
+    :type day_budget: int
+    :param path: the file with the usage, uses quota_path() if None
+    :type path: str
+    :return: the tuple of the selected actions and the deferred ones
+    :rtype: tuple
+    """
+    budget = None
+    if run_budget is not None:
+        budget = run_budget
+    if day_budget is not None:
+        remaining = max(0, day_budget - load_usage(path=path) - QUOTA_COST_LIST)
+        if (budget is None) or (remaining < budget):
+            budget = remaining
+    if (budget is None) or (estimate_cost(actions) <= budget):
+        return actions, dict()
+
+    selected = dict()
+    deferred = dict()
+    for action, item in schedule(actions):
+        target = deferred
+        if QUOTA_COSTS[action] <= budget:
+            budget -= QUOTA_COSTS[action]
+            target = selected
+        if action not in target:
+            target[action] = []
+        target[action].append(item)
+
+    logger().warning("Quota budget exceeded, deferring %d action(s) to next cycle" % sum([len(deferred[x]) for x in deferred]))
+    return selected, deferred
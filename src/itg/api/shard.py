@@ -0,0 +1,160 @@
+import logging
+import multiprocessing
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Any
+
+from itg.api.events import event_field, EVENT_ID, EVENT_ICALUID
+from itg.api.spill import SpilledEvents
+from itg.api.sync import compare
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.shard")
+    return _logger
+
+
+def shard_of(uid: str, num_shards: int) -> int:
+    """
+    Determines the shard for the UID.
+
+    :param uid: the UID to get the shard for
+    :type uid: str
+    :param num_shards: the number of shards
+    :type num_shards: int
+    :return: the shard index
+    :rtype: int
+    """
+    return zlib.crc32(str(uid).encode("utf-8")) % num_shards
+
+
+def partition_ical(events: List, num_shards: int) -> List[List]:
+    """
+    Partitions the Outlook events by UID hash.
+
+    :param events: the Outlook events to partition
+    :type events: list
+    :param num_shards: the number of shards
+    :type num_shards: int
+    :return: the list of shards
+    :rtype: list
+    """
+    result = [[] for _ in range(num_shards)]
+    for event in events:
+        result[shard_of(event_field(event, EVENT_ID), num_shards)].append(event)
+    return result
+
+
+def partition_google(events, num_shards: int) -> List:
+    """
+    Partitions the Google events by iCalUID hash (ID if no iCalUID). Spilled events
+    get partitioned into spilled shards.
+
+    :param events: the Google events to partition (list or SpilledEvents)
+    :param num_shards: the number of shards
+    :type num_shards: int
+    :return: the list of shards
+    :rtype: list
+    """
+    if isinstance(events, SpilledEvents):
+        result = [SpilledEvents() for _ in range(num_shards)]
+    else:
+        result = [[] for _ in range(num_shards)]
+    try:
+        for event in events:
+            uid = event_field(event, EVENT_ICALUID)
+            if uid is None:
+                uid = event_field(event, EVENT_ID)
+            result[shard_of(uid, num_shards)].append(event)
+    except:
+        for shard in result:
+            _close(shard)
+        raise
+    return result
+
+
+def _close(events):
+    """
+    Closes the events if spilled.
+
+    :param events: the events (list or SpilledEvents)
+    """
+    if isinstance(events, SpilledEvents):
+        events.close()
+
+
+def _merge(result: Dict[str, List[Any]], actions: Dict[str, List[Any]]):
+    """
+    Adds the actions to the result.
+
+    :param result: the combined actions
+    :type result: dict
+    :param actions: the actions to add
+    :type actions: dict
+    """
+    for action in actions:
+        if action not in result:
+            result[action] = []
+        result[action].extend(actions[action])
+
+
+def compare_sharded(ical_events: List, google_events, num_shards: int, processes: int = None) -> Dict[str, List[Any]]:
+    """
+    Compares the Outlook and Google events shard by shard, with the events partitioned by
+    UID hash, and merges the action dictionaries. Only the events of a single shard get
+    compared at a time (or one per process).
+
+    :param ical_events: the outlook events to use in the comparison
+    :type ical_events: list
+    :param google_events: the google events to use in the comparsion (list or SpilledEvents)
+    :param num_shards: the number of shards
+    :type num_shards: int
+    :param processes: the number of (spawned) processes to compare shards in parallel, compares sequentially if None
+    :type processes: int
+    :return: the action dictionary
+    :rtype: dict
+    """
+    result = dict()
+    ical_shards = partition_ical(ical_events, num_shards)
+    google_shards = partition_google(google_events, num_shards)
+
+    try:
+        if processes is None:
+            for i in range(num_shards):
+                logger().info("Comparing shard %d/%d" % (i + 1, num_shards))
+                _merge(result, compare(ical_shards[i], google_shards[i]))
+                _close(google_shards[i])
+                google_shards[i] = None
+        else:
+            # at most one shard per process in flight, keeping memory bounded;
+            # spawn rather than fork, as the sync runs multithreaded (jobs, token refresh, health endpoint)
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+                pending = dict()
+                for i in range(num_shards):
+                    pending[i] = executor.submit(compare, ical_shards[i], list(google_shards[i]))
+                    _close(google_shards[i])
+                    google_shards[i] = None
+                    if len(pending) >= processes:
+                        j = min(pending.keys())
+                        _merge(result, pending.pop(j).result())
+                        logger().info("Compared shard %d/%d" % (j + 1, num_shards))
+                for j in sorted(pending.keys()):
+                    _merge(result, pending.pop(j).result())
+                    logger().info("Compared shard %d/%d" % (j + 1, num_shards))
+    finally:
+        for shard in google_shards:
+            _close(shard)
+
+    return result
@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from itg.api.dedup import google_key
+from itg.api.events import event_field, to_timestamp, EVENT_ID, EVENT_UPDATED
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.spill")
+    return _logger
+
+
+class SpilledEvents:
+    """
+    Sequence of Google events that is stored in a temporary SQLite database instead of memory.
+    Events get decoded again on each iteration, i.e., only the events currently being
+    processed reside in memory. The events are indexed by iCalUID/original start time
+    (see itg.api.dedup.google_key), allowing them to get looked up during the comparison.
+    Must be closed once no longer required (see close), e.g., by using it as context manager.
+    """
+
+    def __init__(self, directory: str = None):
+        """
+        Initializes the storage.
+
+        :param directory: the directory for the temporary database, uses the system's temp dir if None
+        :type directory: str
+        """
+        fd, self.path = tempfile.mkstemp(prefix="itg-", suffix=".db", dir=directory)
+        os.close(fd)
+        logger().info("Spilling events to: %s" % self.path)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("CREATE TABLE events (data TEXT, uid TEXT, rid REAL, updated REAL, eid TEXT)")
+        self._conn.execute("CREATE INDEX events_key ON events (uid, rid)")
+        self._len = 0
+
+    def append(self, event: Dict):
+        """
+        Adds the event.
+
+        :param event: the event to add
+        :type event: dict
+        """
+        key = google_key(event)
+        if key is None:
+            key = (None, None)
+        self._conn.execute("INSERT INTO events (data, uid, rid, updated, eid) VALUES (?, ?, ?, ?, ?)",
+                           (json.dumps(event, separators=(",", ":")), key[0], key[1],
+                            to_timestamp(event_field(event, EVENT_UPDATED)), event_field(event, EVENT_ID)))
+        self._len += 1
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in self._conn.execute("SELECT data FROM events ORDER BY rowid"):
+            yield json.loads(row[0])
+
+    def rows(self) -> Iterator[Tuple[int, Dict]]:
+        """
+        Iterates over the events and their row IDs.
+
+        :return: the iterator of row ID/event tuples
+        """
+        for row in self._conn.execute("SELECT rowid, data FROM events ORDER BY rowid"):
+            yield row[0], json.loads(row[1])
+
+    def lookup(self, key: Tuple[str, Optional[float]]) -> Optional[Tuple[int, Dict]]:
+        """
+        Returns the canonical event for the iCalUID/original start time, i.e., the most
+        recently updated one, then the one with the smallest ID (see itg.api.dedup.dedup_google).
+
+        :param key: the key to look up (see itg.api.dedup.google_key)
+        :type key: tuple
+        :return: the tuple of row ID and event, None if not present
+        :rtype: tuple
+        """
+        row = self._conn.execute("SELECT rowid, data FROM events WHERE uid = ? AND rid IS ? "
+                                 "ORDER BY COALESCE(updated, 0) DESC, eid ASC LIMIT 1", key).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def master_uids(self) -> Set[str]:
+        """
+        Returns the iCalUIDs of the events that are not exception instances of recurring events.
+
+        :return: the iCalUIDs
+        :rtype: set
+        """
+        return set([row[0] for row in self._conn.execute("SELECT DISTINCT uid FROM events WHERE uid IS NOT NULL AND rid IS NULL")])
+
+    def close(self):
+        """
+        Closes and removes the database.
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,15 +1,22 @@
-import json
 import logging
+import threading
 import traceback
 
 from datetime import datetime
-from typing import List, Dict, Any
+from time import time
+from typing import List, Dict, Any, Tuple, Iterator
 
 import icalendar
 
 from googleapiclient.errors import HttpError
 from itg.api.events import EVENT_ID, EVENT_SUMMARY, EVENT_DESCRIPTION, EVENT_LOCATION, EVENT_RECURRENCE, EVENT_STATUS, EVENT_START, EVENT_END, EVENT_UPDATED
-from itg.api.events import event_field, is_same_event, has_event_changed
+from itg.api.events import event_field, has_event_changed, normalize_time, ical_fingerprint
+from itg.api.google import EVENT_PROJECTION
+from itg.api.interval import EventIndex
+from itg.api.dedup import dedup_ical, dedup_google, ical_key, google_key, series_masters, is_covered
+from itg.api.journal import start_journal, record_done, clear_journal, operation_key
+from itg.api.logs import log_event, LazyJson
+from itg.api.spill import SpilledEvents
 
 
 ACTION_ADD = "add"
@@ -21,6 +28,19 @@ ACTIONS = [
     ACTION_UPDATE,
 ]
 
+# the private extended property of Google events storing the SEQUENCE of the iCal event
+PROPERTY_SEQUENCE = "icalSequence"
+
+# prefix of the error string of actions skipped after repeated identical errors
+ABORTED = "Aborted after repeated identical errors: "
+
+# tie-breaker when events are equally close to now, lower executes first
+ACTION_PRIORITIES = {
+    ACTION_UPDATE: 0,
+    ACTION_ADD: 1,
+    ACTION_DELETE: 2,
+}
+
 
 _logger = None
 
@@ -38,40 +58,116 @@ def logger() -> logging.Logger:
     return _logger
 
 
+def _append(result: Dict[str, List[Any]], action: str, item):
+    """
+    Adds the item to the list of the action.
+
+    :param result: the action dictionary to update
+    :type result: dict
+    :param action: the action
+    :type action: str
+    :param item: the item to add
+    """
+    if action not in result:
+        result[action] = []
+    result[action].append(item)
+
+
+def compare_spilled(ical_events: List, google_events: SpilledEvents) -> Dict[str, List[Any]]:
+    """
+    Compares the Outlook events with the spilled Google events, like compare, but looking
+    the Google events up in the database rather than building an index in memory. Only the
+    Google events that end up in the action dictionary get held in memory.
+
+    :param ical_events: the outlook events to use in the comparison
+    :type ical_events: list
+    :param google_events: the google events to use in the comparsion
+    :type google_events: SpilledEvents
+    :return: the action dictionary
+    :rtype: dict
+    """
+    result = dict()
+
+    ical_events = dedup_ical(ical_events)
+    masters = series_masters([ical_key(x) for x in ical_events], [(x, None) for x in google_events.master_uids()])
+
+    matched = set()
+    for oevent in ical_events:
+        key = ical_key(oevent)
+        found = google_events.lookup(key)
+        if found is None:
+            if is_covered(key, masters):
+                logger().debug("Override of recurring event without Google instance, skipping: %s" % str(key))
+            else:
+                _append(result, ACTION_ADD, oevent)
+            continue
+        rowid, gevent = found
+        matched.add(rowid)
+        if has_event_changed(oevent, gevent):
+            _append(result, ACTION_UPDATE, (oevent, gevent))
+
+    for rowid, gevent in google_events.rows():
+        if rowid in matched:
+            continue
+        key = google_key(gevent)
+        if is_covered(key, masters) and (google_events.lookup(key)[0] == rowid):
+            continue
+        _append(result, ACTION_DELETE, gevent)
+
+    return result
+
+
 def compare(ical_events: List, google_events: List) -> Dict[str, List[Any]]:
     """
     Compares the Outlook and Google events and returns a dictionary with
-    add/delete/update lists of events.
+    add/delete/update lists of events. Duplicates get removed beforehand (see
+    itg.api.dedup), with redundant Google copies scheduled for deletion. Unmatched
+    overrides/exception instances of recurring events present on both sides get
+    neither added nor deleted (see itg.api.dedup.series_masters).
 
     :param ical_events: the outlook events to use in the comparison
     :type ical_events: list
-    :param google_events: the google events to use in the comparsion
+    :param google_events: the google events to use in the comparsion (list or SpilledEvents, see compare_spilled)
     :type google_events: list
     :return: the action dictionary
     :rtype: dict
     """
+    if isinstance(google_events, SpilledEvents):
+        return compare_spilled(ical_events, google_events)
+
     result = dict()
 
+    ical_events = dedup_ical(ical_events)
+    google_events, redundant = dedup_google(google_events)
+    index = dict()
+    for gevent in google_events:
+        key = google_key(gevent)
+        if key is not None:
+            index[key] = gevent
+    masters = series_masters([ical_key(x) for x in ical_events], index.keys())
+
+    matched = set()
     for oevent in ical_events:
-        found = False
-        for gevent in google_events:
-            if is_same_event(oevent, gevent):
-                found = True
-                if has_event_changed(oevent, gevent):
-                    if ACTION_UPDATE not in result:
-                        result[ACTION_UPDATE] = []
-                    result[ACTION_UPDATE].append((oevent, gevent))
-        if not found:
+        key = ical_key(oevent)
+        gevent = index.get(key)
+        if is_covered(key, masters) and (gevent is None):
+            logger().debug("Override of recurring event without Google instance, skipping: %s" % str(key))
+        elif gevent is not None:
+            matched.add(id(gevent))
+            if has_event_changed(oevent, gevent):
+                if ACTION_UPDATE not in result:
+                    result[ACTION_UPDATE] = []
+                result[ACTION_UPDATE].append((oevent, gevent))
+        else:
             if ACTION_ADD not in result:
                 result[ACTION_ADD] = []
             result[ACTION_ADD].append(oevent)
 
     for gevent in google_events:
-        found = False
-        for oevent in ical_events:
-            if is_same_event(oevent, gevent):
-                found = True
-        if not found:
+        if is_covered(google_key(gevent), masters):
+            matched.add(id(gevent))
+    for gevent in google_events + redundant:
+        if id(gevent) not in matched:
             if ACTION_DELETE not in result:
                 result[ACTION_DELETE] = []
             result[ACTION_DELETE].append(gevent)
@@ -79,47 +175,212 @@ def compare(ical_events: List, google_events: List) -> Dict[str, List[Any]]:
     return result
 
 
-def add_event(service, gcalendar: str, oevent, dry_run: bool = False) -> bool:
+def action_event(action: str, item):
     """
-    Adds the Outlook event in the Google calendar.
+    Returns the event that the action item refers to, i.e., the Outlook event for add/update
+    and the Google event for delete.
 
-    :param service: the Google Calendar service instance to use
-    :param gcalendar: the Google Calendar to use
-    :type gcalendar: str
-    :param oevent: the Outlook event to add
+    :param action: the action
+    :type action: str
+    :param item: the action item
+    :return: the event
+    """
+    if action == ACTION_UPDATE:
+        return item[0]
+    else:
+        return item
+
+
+def schedule(actions: Dict[str, List], now: float = None) -> List[Tuple[str, Any]]:
+    """
+    Orders the action items by how close the start of their events is to now, using the
+    action type as tie-breaker (see ACTION_PRIORITIES). Events without start come last.
+
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param now: the reference timestamp, uses the current time if None
+    :type now: float
+    :return: the list of action/item tuples in the order to execute them
+    :rtype: list
+    """
+    if now is None:
+        now = time()
+    # original order, ordered by priority, serves as tie-breaker
+    items = []
+    for action in sorted(actions, key=lambda x: ACTION_PRIORITIES[x]):
+        for item in actions[action]:
+            items.append((action, item))
+    return EventIndex(items, key=lambda x: action_event(x[0], x[1])).nearest(now)
+
+
+def time_body(value: datetime) -> Dict[str, str]:
+    """
+    Generates the Google Calendar start/end time for the datetime, using the IANA zone
+    name if it can be determined and UTC otherwise.
+
+    :param value: the datetime to convert
+    :type value: datetime
+    :return: the time dictionary
+    :rtype: dict
+    """
+    utc, zone = normalize_time(value)
+    if zone is None:
+        return {"dateTime": utc.isoformat(), "timeZone": "UTC"}
+    else:
+        return {"dateTime": value.isoformat(), "timeZone": zone}
+
+
+def body_diff(body: Dict[str, Any], gevent, projection: List[str] = None) -> Dict[str, Tuple[Any, Any]]:
+    """
+    Determines the fields of the request body that differ from the Google event. Fields
+    that the Google event wasn't retrieved with (e.g., reminders) are not compared.
+
+    :param body: the request body
+    :type body: dict
+    :param gevent: the Google event
+    :param projection: the fields that the Google event was retrieved with, uses EVENT_PROJECTION if None
+    :type projection: list
+    :return: the field -> (google value, body value) mapping
+    :rtype: dict
+    """
+    if projection is None:
+        projection = EVENT_PROJECTION
+    result = dict()
+    for k in body:
+        if k not in projection:
+            continue
+        if gevent.get(k) != body[k]:
+            result[k] = (gevent.get(k), body[k])
+    return result
+
+
+class BodyCache:
+    """
+    Cache for the Google request bodies of one sync cycle, keyed by the fingerprint of the
+    Outlook event (see ical_fingerprint), so that dry-run output, diffing, adding, updating
+    and bulk/async imports use the same body. Thread-safe.
+    """
+
+    def __init__(self):
+        """
+        Initializes the empty cache.
+        """
+        self._bodies = dict()
+        self._lock = threading.Lock()
+
+    def get(self, oevent) -> Dict[str, Any]:
+        """
+        Returns the request body for the Outlook event, building it if not cached yet.
+        The body must be treated as read-only.
+
+        :param oevent: the Outlook event to convert
+        :type oevent: icalendar.Event
+        :return: the request body
+        :rtype: dict
+        """
+        key = ical_fingerprint(oevent)
+        with self._lock:
+            body = self._bodies.get(key)
+        if body is None:
+            body = build_event_body(oevent)
+            with self._lock:
+                body = self._bodies.setdefault(key, body)
+        return body
+
+    def __len__(self) -> int:
+        """
+        Returns the number of cached bodies.
+
+        :return: the number of bodies
+        :rtype: int
+        """
+        return len(self._bodies)
+
+
+def event_body(oevent, bodies: BodyCache = None) -> Dict[str, Any]:
+    """
+    Returns the Google Calendar request body for the Outlook event.
+
+    :param oevent: the Outlook event to convert
     :type oevent: icalendar.Event
-    :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
-    :type dry_run: bool
-    :return: True if successfully added
-    :rtype: bool
+    :param bodies: the cache to use, builds the body directly if None
+    :type bodies: BodyCache
+    :return: the request body
+    :rtype: dict
+    """
+    if bodies is None:
+        return build_event_body(oevent)
+    return bodies.get(oevent)
+
+
+def build_event_body(oevent) -> Dict[str, Any]:
+    """
+    Generates the Google Calendar request body for the Outlook event.
+
+    :param oevent: the Outlook event to convert
+    :type oevent: icalendar.Event
+    :return: the request body
+    :rtype: dict
     """
-    logger().info("adding: %s" % str(oevent))
+    summary = event_field(oevent, EVENT_SUMMARY)
     body = {
-        "summary": event_field(oevent, EVENT_SUMMARY),
+        "summary": summary,
         "iCalUID": event_field(oevent, EVENT_ID),
         "reminders": {"useDefaults": True},
     }
-    if event_field(oevent, EVENT_LOCATION) is not None:
-        body["location"] = event_field(oevent, EVENT_LOCATION)
-    if event_field(oevent, EVENT_STATUS) is not None:
-        body["status"] = event_field(oevent, EVENT_STATUS).lower()
-    if event_field(oevent, EVENT_DESCRIPTION) is not None:
-        body["description"] = event_field(oevent, EVENT_DESCRIPTION)
+    location = event_field(oevent, EVENT_LOCATION)
+    if location is not None:
+        body["location"] = location
+    status = event_field(oevent, EVENT_STATUS)
+    if status is not None:
+        body["status"] = status.lower()
+    description = event_field(oevent, EVENT_DESCRIPTION)
+    if description is not None:
+        body["description"] = description
     start = event_field(oevent, EVENT_START)
     end = event_field(oevent, EVENT_END)
     if (start is not None) and (end is not None):
         if isinstance(start, datetime):
-            body["start"] = {"dateTime": start.isoformat(), "timeZone": str(start.tzinfo)}
-            body["end"] = {"dateTime": end.isoformat(), "timeZone": str(end.tzinfo)}
+            body["start"] = time_body(start)
+            body["end"] = time_body(end)
         else:
             body["start"] = {"date": start.strftime("%Y-%m-%d")}
             body["end"] = {"date": end.strftime("%Y-%m-%d")}
-        logger().info("event: %s-%s: %s" % (str(start), str(end), event_field(oevent, EVENT_SUMMARY)))
-    if event_field(oevent, EVENT_RECURRENCE) is not None:
-        body["recurrence"] = ["RRULE:" + event_field(oevent, EVENT_RECURRENCE).to_ical().decode()]
+        log_event(logger(), logging.DEBUG, "event", start=start, end=end, summary=summary)
+    recurrence = event_field(oevent, EVENT_RECURRENCE)
+    if recurrence is not None:
+        body["recurrence"] = ["RRULE:" + recurrence.to_ical().decode()]
+    sequence = oevent.get("SEQUENCE")
+    if sequence is not None:
+        # Google's own sequence can't be set lower than its current value, store the iCal one separately
+        body["extendedProperties"] = {"private": {PROPERTY_SEQUENCE: str(int(sequence))}}
+    return body
+
+
+def add_event(service, gcalendar: str, oevent, dry_run: bool = False, raise_errors: bool = False,
+              bodies: BodyCache = None) -> bool:
+    """
+    Adds the Outlook event in the Google calendar.
+
+    :param service: the Google Calendar service instance to use
+    :param gcalendar: the Google Calendar to use
+    :type gcalendar: str
+    :param oevent: the Outlook event to add
+    :type oevent: icalendar.Event
+    :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
+    :type dry_run: bool
+    :param raise_errors: whether to raise errors rather than logging them and returning False
+    :type raise_errors: bool
+    :param bodies: the request body cache of the sync cycle, ignored if None
+    :type bodies: BodyCache
+    :return: True if successfully added
+    :rtype: bool
+    """
+    log_event(logger(), logging.INFO, "adding", uid=event_field(oevent, EVENT_ID), summary=event_field(oevent, EVENT_SUMMARY))
+    body = event_body(oevent, bodies)
 
     if dry_run:
-        logger().info("add body:\n%s" % (json.dumps(body, indent=2)))
+        log_event(logger(), logging.INFO, "add body", sample=False, uid=event_field(oevent, EVENT_ID), body=LazyJson(body))
     else:
         try:
             event = (
@@ -128,14 +389,16 @@ def add_event(service, gcalendar: str, oevent, dry_run: bool = False) -> bool:
                     body=body,
                 ).execute()
             )
-            logger().info("event added: %s" % str(event))
+            log_event(logger(), logging.DEBUG, "event added", id=event.get("id"), uid=event.get("iCalUID"))
             return True
         except HttpError as error:
-            logger().error("Failed to add (cal=%s): %s" % (gcalendar, str(oevent)), exc_info=True)
+            if raise_errors:
+                raise
+            logger().error("Failed to add (cal=%s): %s", gcalendar, event_field(oevent, EVENT_ID), exc_info=True)
             return False
 
 
-def delete_event(service, gcalendar: str, gevent, dry_run: bool = False) -> bool:
+def delete_event(service, gcalendar: str, gevent, dry_run: bool = False, raise_errors: bool = False) -> bool:
     """
     Removes the Google event in the Google calendar.
 
@@ -145,10 +408,12 @@ def delete_event(service, gcalendar: str, gevent, dry_run: bool = False) -> bool
     :param gevent: the Google event to delete
     :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
     :type dry_run: bool
+    :param raise_errors: whether to raise errors rather than logging them and returning False
+    :type raise_errors: bool
     :return: True if successfully deleted
     :rtype: bool
     """
-    logger().info("deleting: %s" % str(gevent))
+    log_event(logger(), logging.INFO, "deleting", id=event_field(gevent, EVENT_ID), summary=event_field(gevent, EVENT_SUMMARY))
     if dry_run:
         return True
     else:
@@ -161,11 +426,14 @@ def delete_event(service, gcalendar: str, gevent, dry_run: bool = False) -> bool
             )
             return True
         except:
-            logger().error("Failed to delete (cal=%s): %s" % (gcalendar, str(gevent)))
+            if raise_errors:
+                raise
+            logger().error("Failed to delete (cal=%s): %s", gcalendar, event_field(gevent, EVENT_ID))
             return False
 
 
-def update_event(service, gcalendar: str, oevent, gevent, dry_run: bool = False) -> bool:
+def update_event(service, gcalendar: str, oevent, gevent, dry_run: bool = False, raise_errors: bool = False,
+                 bodies: BodyCache = None) -> bool:
     """
     Updates the Outlook event in the Google calendar.
 
@@ -177,39 +445,20 @@ def update_event(service, gcalendar: str, oevent, gevent, dry_run: bool = False)
     :param gevent: the corresponding Google calendar event
     :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
     :type dry_run: bool
+    :param raise_errors: whether to raise errors rather than logging them and returning False
+    :type raise_errors: bool
+    :param bodies: the request body cache of the sync cycle, ignored if None
+    :type bodies: BodyCache
     :return: True if successfully updated
     :rtype: bool
     """
-    if gevent is None:
-        logger().info("updating %s" % str(oevent))
-    else:
-        logger().info("updating %s with %s" % (str(gevent), str(oevent)))
-    body = {
-        "summary": event_field(oevent, EVENT_SUMMARY),
-        "iCalUID": event_field(oevent, EVENT_ID),
-        "reminders": {"useDefaults": True},
-    }
-    if event_field(oevent, EVENT_LOCATION) is not None:
-        body["location"] = event_field(oevent, EVENT_LOCATION)
-    if event_field(oevent, EVENT_STATUS) is not None:
-        body["status"] = event_field(oevent, EVENT_STATUS).lower()
-    if event_field(oevent, EVENT_DESCRIPTION) is not None:
-        body["description"] = event_field(oevent, EVENT_DESCRIPTION)
-    start = event_field(oevent, EVENT_START)
-    end = event_field(oevent, EVENT_END)
-    if (start is not None) and (end is not None):
-        if isinstance(start, datetime):
-            body["start"] = {"dateTime": start.isoformat(), "timeZone": str(start.tzinfo)}
-            body["end"] = {"dateTime": end.isoformat(), "timeZone": str(end.tzinfo)}
-        else:
-            body["start"] = {"date": start.strftime("%Y-%m-%d")}
-            body["end"] = {"date": end.strftime("%Y-%m-%d")}
-        logger().info("event: %s-%s: %s" % (str(start), str(end), event_field(oevent, EVENT_SUMMARY)))
-    if event_field(oevent, EVENT_RECURRENCE) is not None:
-        body["recurrence"] = ["RRULE:" + event_field(oevent, EVENT_RECURRENCE).to_ical().decode()]
+    log_event(logger(), logging.INFO, "updating", uid=event_field(oevent, EVENT_ID),
+              id=None if gevent is None else event_field(gevent, EVENT_ID), summary=event_field(oevent, EVENT_SUMMARY))
+    body = event_body(oevent, bodies)
 
     if dry_run:
-        logger().info("update body:\n%s" % (json.dumps(body, indent=2)))
+        log_event(logger(), logging.INFO, "update body", sample=False, uid=event_field(oevent, EVENT_ID),
+                  changes=LazyJson(body if gevent is None else body_diff(body, gevent)))
     else:
         try:
             event = (
@@ -219,16 +468,181 @@ def update_event(service, gcalendar: str, oevent, gevent, dry_run: bool = False)
                     body=body,
                 ).execute()
             )
-            logger().info("event updated: %s" % str(event))
+            log_event(logger(), logging.DEBUG, "event updated", id=event.get("id"), uid=event.get("iCalUID"))
             return True
         except:
-            logger().error("Failed to update (cal=%s): %s" % (gcalendar, str(oevent)), exc_info=True)
+            if raise_errors:
+                raise
+            logger().error("Failed to update (cal=%s): %s", gcalendar, event_field(oevent, EVENT_ID), exc_info=True)
             return False
 
 
-def sync(service, gcalendar: str, actions: Dict[str, List], dry_run: bool = False) -> Dict[str, List[Any]]:
+def error_signature(error: BaseException) -> str:
+    """
+    Generates a signature of the error that is independent of the event, for detecting
+    repeated identical errors.
+
+    :param error: the error to generate the signature for
+    :type error: BaseException
+    :return: the signature
+    :rtype: str
+    """
+    if isinstance(error, HttpError):
+        return "HttpError %s: %s" % (error.resp.status, error._get_reason())
+    lines = str(error).strip().split("\n")
+    return "%s: %s" % (type(error).__name__, lines[0])
+
+
+def _error_item(action: str, item, error: str) -> Tuple:
     """
-    Performs the sync.
+    Generates the tuple for the error dictionary.
+
+    :param action: the action
+    :type action: str
+    :param item: the action item
+    :param error: the error string
+    :type error: str
+    :return: the tuple
+    :rtype: tuple
+    """
+    if action == ACTION_UPDATE:
+        return item[0], item[1], error
+    else:
+        return item, error
+
+
+def aborted(errors: Dict[str, List[Any]]) -> bool:
+    """
+    Checks whether the sync was aborted due to repeated identical errors.
+
+    :param errors: the error dictionary returned by sync
+    :type errors: dict
+    :return: True if aborted
+    :rtype: bool
+    """
+    for action in errors:
+        for item in errors[action]:
+            if item[-1].startswith(ABORTED):
+                return True
+    return False
+
+
+class SyncExecutor:
+    """
+    Bookkeeping of a sync, shared by the sequential (see sync) and the async backend (see
+    itg.api.aio.sync_async), which only differ in how the requests get issued: schedules
+    the actions (see schedule), skips duplicate adds, records completed mutations in the
+    journal and collects the errors. After the specified number of consecutive identical
+    errors (see error_signature), the remaining actions get skipped and reported with an
+    error starting with ABORTED.
+    """
+
+    def __init__(self, gcalendar: str, actions: Dict[str, List], dry_run: bool = False, journal: str = None,
+                 max_identical_errors: int = None):
+        """
+        Initializes the execution, starting the journal.
+
+        :param gcalendar: the Google Calendar to use
+        :type gcalendar: str
+        :param actions: the dictionary with the add/delete/update event lists
+        :type actions: dict
+        :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
+        :type dry_run: bool
+        :param journal: the journal file to record planned/completed mutations in, ignored if None or dry-run; removed once all mutations succeeded
+        :type journal: str
+        :param max_identical_errors: the number of consecutive identical errors after which to abort, never aborts if None
+        :type max_identical_errors: int
+        """
+        self.gcalendar = gcalendar
+        self.actions = actions
+        self.journal = None if dry_run else journal
+        self.max_identical_errors = max_identical_errors
+        self.errors = dict()
+        for action in ACTIONS:
+            self.errors[action] = []
+        self.signature = None
+        self.identical = 0
+        self.aborted = None
+        if self.journal is not None:
+            start_journal(self.journal, actions)
+
+    def pending(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterates over the actions to execute, in the order determined by schedule().
+        Duplicate adds (same UID/RECURRENCE-ID) get skipped, as do all actions once aborted.
+
+        :return: the iterator over the action/item tuples
+        """
+        added = set()
+        for action, item in schedule(self.actions):
+            if self.aborted is not None:
+                self.errors[action].append(_error_item(action, item, ABORTED + self.aborted))
+                continue
+            if action == ACTION_ADD:
+                key = ical_key(item)
+                if key in added:
+                    log_event(logger(), logging.INFO, "already added", uid=key[0])
+                    continue
+                added.add(key)
+            yield action, item
+
+    def succeeded(self, action: str, item):
+        """
+        Records the successful execution of the action.
+
+        :param action: the action
+        :type action: str
+        :param item: the action item
+        """
+        if self.journal is not None:
+            record_done(self.journal, operation_key(action, item))
+        self.identical = 0
+
+    def failed(self, action: str, item, error: BaseException):
+        """
+        Records the failed execution of the action, aborting after too many identical errors.
+
+        :param action: the action
+        :type action: str
+        :param item: the action item
+        :param error: the error that occurred
+        :type error: BaseException
+        """
+        error_str = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+        self.errors[action].append(_error_item(action, item, error_str))
+        current = error_signature(error)
+        if current == self.signature:
+            self.identical += 1
+        else:
+            self.signature = current
+            self.identical = 1
+        if (self.max_identical_errors is not None) and (self.identical >= self.max_identical_errors) and (self.aborted is None):
+            logger().error("Aborting sync of %s after %d identical errors: %s" % (self.gcalendar, self.identical, current))
+            self.aborted = current
+
+    def result(self) -> Dict[str, List[Any]]:
+        """
+        Finishes the execution, removing the journal if all mutations succeeded.
+
+        :return: the dictionary with events per action that failed: action -> list of tuples; with last element in tuple the exception string
+        :rtype: dict
+        """
+        result = dict()
+        for action in ACTIONS:
+            if len(self.errors[action]) > 0:
+                result[action] = self.errors[action]
+        if (self.journal is not None) and (len(result) == 0):
+            clear_journal(self.journal)
+        return result
+
+
+def sync(service, gcalendar: str, actions: Dict[str, List], dry_run: bool = False, journal: str = None,
+         max_identical_errors: int = None, bodies: BodyCache = None) -> Dict[str, List[Any]]:
+    """
+    Performs the sync, executing the actions one by one in the order determined by schedule().
+    After the specified number of consecutive identical errors (see error_signature),
+    the remaining actions get skipped and reported with an error starting with ABORTED
+    (see SyncExecutor).
 
     :param service: the Google Calendar service instance to use
     :param gcalendar: the Google Calendar to use
@@ -237,41 +651,31 @@ def sync(service, gcalendar: str, actions: Dict[str, List], dry_run: bool = Fals
     :type actions: dict
     :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
     :type dry_run: bool
+    :param journal: the journal file to record planned/completed mutations in, ignored if None or dry-run; removed once all mutations succeeded
+    :type journal: str
+    :param max_identical_errors: the number of consecutive identical errors after which to abort, never aborts if None
+    :type max_identical_errors: int
+    :param bodies: the request body cache of the sync cycle, uses a new one if None
+    :type bodies: BodyCache
     :return: the dictionary with events per action that failed: action -> list of tuples; with last element in tuple the exception string
     :rtype: dict
     """
-    result = dict()
-    for action in ACTIONS:
-        result[action] = []
-    added = set()
-
-    for action in actions:
-        if action == ACTION_ADD:
-            for oevent in actions[action]:
-                uid = event_field(oevent, EVENT_ID)
-                if uid in added:
-                    logger().info("already added, skipping: %s" % uid)
-                else:
-                    try:
-                        add_event(service, gcalendar, oevent, dry_run=dry_run)
-                        added.add(uid)
-                    except:
-                        result[action].append((oevent, traceback.format_exc()))
-        elif action == ACTION_UPDATE:
-            for oevent, gevent in actions[action]:
-                try:
-                    update_event(service, gcalendar, oevent, gevent, dry_run=dry_run)
-                except:
-                    result[action].append((oevent, gevent, traceback.format_exc()))
-        elif action == ACTION_DELETE:
-            for gevent in actions[action]:
-                try:
-                    delete_event(service, gcalendar, gevent, dry_run=dry_run)
-                except:
-                    result[action].append((gevent, traceback.format_exc()))
-
-    for action in ACTIONS:
-        if len(result[action]) == 0:
-            del result[action]
+    if bodies is None:
+        bodies = BodyCache()
+    executor = SyncExecutor(gcalendar, actions, dry_run=dry_run, journal=journal, max_identical_errors=max_identical_errors)
 
-    return result
+    for action, item in executor.pending():
+        try:
+            if action == ACTION_ADD:
+                success = add_event(service, gcalendar, item, dry_run=dry_run, raise_errors=True, bodies=bodies)
+            elif action == ACTION_UPDATE:
+                success = update_event(service, gcalendar, item[0], item[1], dry_run=dry_run, raise_errors=True, bodies=bodies)
+            else:
+                success = delete_event(service, gcalendar, item, dry_run=dry_run, raise_errors=True)
+            if success is False:
+                raise Exception("Failed to %s event" % action)
+            executor.succeeded(action, item)
+        except Exception as e:
+            executor.failed(action, item, e)
+
+    return executor.result()
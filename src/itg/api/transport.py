@@ -0,0 +1,341 @@
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import threading
+
+from time import time, sleep
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httplib2
+import requests
+
+
+MODE_LIVE = "live"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+MODES = [
+    MODE_LIVE,
+    MODE_RECORD,
+    MODE_REPLAY,
+]
+
+CHUNK_SIZE = 65536
+
+# the response headers that do not apply to the recorded (decoded) content
+SKIPPED_HEADERS = [
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+]
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.transport")
+    return _logger
+
+
+def _body_digest(body) -> Optional[str]:
+    """
+    Computes the digest of the request body.
+
+    :param body: the body (str or bytes), can be None
+    :return: the digest, None if no body
+    :rtype: str
+    """
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return hashlib.md5(body).hexdigest()
+
+
+def _fallback_key(method: str, uri: str) -> str:
+    """
+    Generates the key for matching requests whose query parameters or body differ from the
+    recorded ones (e.g., time windows, batch boundaries): method and URL without query.
+
+    :param method: the HTTP method
+    :type method: str
+    :param uri: the URL
+    :type uri: str
+    :return: the key
+    :rtype: str
+    """
+    parts = urlsplit(uri)
+    return "%s %s://%s%s" % (method, parts.scheme, parts.netloc, parts.path)
+
+
+def _exact_key(method: str, uri: str, body) -> str:
+    """
+    Generates the key for matching identical requests.
+
+    :param method: the HTTP method
+    :type method: str
+    :param uri: the URL
+    :type uri: str
+    :param body: the request body, can be None
+    :return: the key
+    :rtype: str
+    """
+    return "%s %s %s" % (method, uri, _body_digest(body))
+
+
+class Transport:
+    """
+    Performs the HTTP requests for downloading calendars and for the Google API. In record
+    mode, the exchanges get appended to a JSON Lines file (without request headers, i.e.,
+    no credentials). In replay mode, the responses get served from such a file without any
+    network access, in recorded order per request, with the recorded latencies scaled by
+    the latency factor (0 for no delays). Requests get matched exactly first (method, URL,
+    body) and then by method and URL without query.
+    """
+
+    def __init__(self, mode: str = MODE_LIVE, path: str = None, latency_scale: float = 1.0):
+        """
+        Initializes the transport.
+
+        :param mode: the mode (live/record/replay)
+        :type mode: str
+        :param path: the file with the recorded exchanges, required for record/replay
+        :type path: str
+        :param latency_scale: the factor for the recorded latencies in replay mode
+        :type latency_scale: float
+        """
+        if mode not in MODES:
+            raise Exception("Unsupported transport mode: %s" % mode)
+        if (mode != MODE_LIVE) and (path is None):
+            raise Exception("Transport mode '%s' requires a file!" % mode)
+        self.mode = mode
+        self.path = path
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._exact = dict()
+        self._fallback = dict()
+        if mode == MODE_RECORD:
+            open(path, "w").close()
+        elif mode == MODE_REPLAY:
+            self._load()
+
+    def _load(self):
+        """
+        Loads the recorded exchanges.
+        """
+        count = 0
+        with open(self.path) as fp:
+            for line in fp:
+                if len(line.strip()) == 0:
+                    continue
+                exchange = json.loads(line)
+                self._exact.setdefault(exchange["key"], []).append(exchange)
+                self._fallback.setdefault(_fallback_key(exchange["method"], exchange["uri"]), []).append(exchange)
+                count += 1
+        logger().info("Loaded %d recorded exchange(s): %s" % (count, self.path))
+
+    def _record(self, method: str, uri: str, body, status: int, headers: Dict[str, str], content: bytes, elapsed: float):
+        """
+        Appends the exchange to the recording.
+
+        :param method: the HTTP method
+        :type method: str
+        :param uri: the URL
+        :type uri: str
+        :param body: the request body, can be None
+        :param status: the status code
+        :type status: int
+        :param headers: the response headers
+        :type headers: dict
+        :param content: the (decoded) response content
+        :type content: bytes
+        :param elapsed: the seconds it took
+        :type elapsed: float
+        """
+        exchange = {
+            "key": _exact_key(method, uri, body),
+            "method": method,
+            "uri": uri,
+            "status": status,
+            "headers": dict([(k.lower(), v) for k, v in headers.items() if k.lower() not in SKIPPED_HEADERS]),
+            "content": base64.b64encode(content).decode("ascii"),
+            "elapsed": elapsed,
+        }
+        line = json.dumps(exchange) + "\n"
+        with self._lock:
+            with open(self.path, "a") as fp:
+                fp.write(line)
+
+    def _replay(self, method: str, uri: str, body) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Serves the next recorded response for the request, waiting for the scaled latency.
+
+        :param method: the HTTP method
+        :type method: str
+        :param uri: the URL
+        :type uri: str
+        :param body: the request body, can be None
+        :return: the tuple of status code, response headers and content
+        :rtype: tuple
+        """
+        with self._lock:
+            exchange = None
+            for queues, key in [(self._exact, _exact_key(method, uri, body)), (self._fallback, _fallback_key(method, uri))]:
+                queue = queues.get(key, [])
+                # skip the ones already served via the other key
+                while (len(queue) > 0) and queue[0].get("served", False):
+                    queue.pop(0)
+                if len(queue) > 0:
+                    exchange = queue.pop(0)
+                    exchange["served"] = True
+                    break
+        if exchange is None:
+            raise Exception("No recorded response for: %s %s" % (method, uri))
+        if self.latency_scale > 0:
+            sleep(exchange["elapsed"] * self.latency_scale)
+        return exchange["status"], exchange["headers"], base64.b64decode(exchange["content"])
+
+    def get(self, url: str, headers: Dict[str, str] = None, timeout: float = None) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Downloads the URL, returning the complete (decompressed) content.
+
+        :param url: the URL to download
+        :type url: str
+        :param headers: the request headers
+        :type headers: dict
+        :param timeout: the timeout in seconds for connecting and for each read, waits indefinitely if None
+        :type timeout: float
+        :return: the tuple of status code, response headers (lower-case names) and content
+        :rtype: tuple
+        """
+        if self.mode == MODE_REPLAY:
+            return self._replay("GET", url, None)
+        start = time()
+        with requests.get(url, headers=headers, stream=True, timeout=timeout) as r:
+            content = b"".join(r.iter_content(chunk_size=CHUNK_SIZE))
+            status = r.status_code
+            response_headers = dict([(k.lower(), v) for k, v in r.headers.items()])
+        if self.mode == MODE_RECORD:
+            self._record("GET", url, None, status, response_headers, content, time() - start)
+        return status, response_headers, content
+
+    def http(self, http=None):
+        """
+        Returns the httplib2-compatible object to use for the Google API.
+
+        :param http: the (authorized) http object to use for live requests, not used for replay
+        :return: the http object
+        """
+        if self.mode == MODE_LIVE:
+            return http
+        return TransportHttp(self, http)
+
+
+class TransportHttp:
+    """
+    httplib2-compatible http object that records/replays the exchanges via the transport.
+    Other attributes (e.g., the credentials) get taken from the wrapped http object.
+    """
+
+    def __init__(self, transport: Transport, http=None):
+        """
+        Initializes the object.
+
+        :param transport: the transport to use
+        :type transport: Transport
+        :param http: the http object to perform live requests with, None for replay
+        """
+        self.transport = transport
+        self.http = http
+
+    def __getattr__(self, item):
+        if self.http is None:
+            raise AttributeError(item)
+        return getattr(self.http, item)
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+                connection_type=None):
+        """
+        Performs the request, see httplib2.Http.request.
+
+        :return: the tuple of httplib2.Response and content
+        :rtype: tuple
+        """
+        if self.transport.mode == MODE_REPLAY:
+            status, headers, content = self.transport._replay(method, uri, body)
+            info = dict(headers)
+            info["status"] = str(status)
+            return httplib2.Response(info), content
+        start = time()
+        response, content = self.http.request(uri, method=method, body=body, headers=headers,
+                                              redirections=redirections, connection_type=connection_type)
+        self.transport._record(method, uri, body, response.status, dict([(k, v) for k, v in response.items() if k != "status"]),
+                               content, time() - start)
+        return response, content
+
+
+_transport = Transport()
+
+
+def get_transport() -> Transport:
+    """
+    Returns the process-wide transport.
+
+    :return: the transport
+    :rtype: Transport
+    """
+    return _transport
+
+
+def set_transport(transport: Transport):
+    """
+    Sets the process-wide transport.
+
+    :param transport: the transport to use
+    :type transport: Transport
+    """
+    global _transport
+    _transport = transport
+    if transport.mode != MODE_LIVE:
+        logger().info("Transport mode: %s (%s)" % (transport.mode, transport.path))
+
+
+def add_transport_options(parser: argparse.ArgumentParser):
+    """
+    Adds the options for recording/replaying the HTTP exchanges to the parser.
+
+    :param parser: the parser to add the options to
+    :type parser: argparse.ArgumentParser
+    """
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', metavar="FILE", type=str, help='The JSON Lines file to record the HTTP exchanges (calendar download, Google API) in, for replaying them offline.', required=False, default=None)
+    group.add_argument('--replay', metavar="FILE", type=str, help='The JSON Lines file with recorded HTTP exchanges to serve instead of accessing the network.', required=False, default=None)
+    parser.add_argument('--latency_scale', metavar="FACTOR", type=float, help='The factor for the recorded latencies when replaying, 0 for no delays.', required=False, default=1.0)
+
+
+def init_transport(record: str = None, replay: str = None, latency_scale: float = 1.0):
+    """
+    Sets the process-wide transport according to the options.
+
+    :param record: the file to record the exchanges in, ignored if None
+    :type record: str
+    :param replay: the file with the exchanges to replay, ignored if None
+    :type replay: str
+    :param latency_scale: the factor for the recorded latencies when replaying
+    :type latency_scale: float
+    """
+    if record is not None:
+        set_transport(Transport(mode=MODE_RECORD, path=record))
+    elif replay is not None:
+        set_transport(Transport(mode=MODE_REPLAY, path=replay, latency_scale=latency_scale))
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+import os
+
+from time import time, sleep
+from typing import Optional, Tuple
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+# the interval in seconds for checking the file when inotify is not available
+POLL_INTERVAL = 1.0
+
+
+_logger = None
+
+
+def logger() -> logging.Logger:
+    """
+    Return the logger to use.
+
+    :return: the logger
+    :rtype: logging.Logger
+    """
+    global _logger
+    if _logger is None:
+        _logger = logging.getLogger("itg.api.watch")
+    return _logger
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the modification time and size of the file.
+
+    :param path: the file to get the signature for
+    :type path: str
+    :return: the tuple of mtime (ns) and size, None if the file does not exist
+    :rtype: tuple
+    """
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def file_digest(path: str) -> Optional[str]:
+    """
+    Computes the digest of the file content.
+
+    :param path: the file to compute the digest for
+    :type path: str
+    :return: the digest, None if the file does not exist
+    :rtype: str
+    """
+    try:
+        h = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(65536), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except OSError:
+        return None
+
+
+class FileWatcher:
+    """
+    Watches a local file for changes, using inotify (inotify_simple library) if available
+    and polling of the file's mtime/size otherwise. Changes are only reported once the
+    file content (digest) differs and the file has been quiet for the debounce period.
+    """
+
+    def __init__(self, path: str, debounce: float = 1.0):
+        """
+        Initializes the watcher with the current state of the file.
+
+        :param path: the file to watch
+        :type path: str
+        :param debounce: the seconds without further modifications before a change gets reported
+        :type debounce: float
+        """
+        self.path = os.path.abspath(path)
+        self.debounce = debounce
+        self._signature = file_signature(self.path)
+        self._digest = file_digest(self.path)
+        self._inotify = None
+        if inotify_simple is not None:
+            flags = inotify_simple.flags
+            self._inotify = inotify_simple.INotify()
+            # watch the directory, as editors often replace the file
+            self._inotify.add_watch(os.path.dirname(self.path), flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.DELETE | flags.MODIFY)
+        else:
+            logger().info("inotify_simple not available, polling: %s" % self.path)
+
+    def _touched(self, timeout: Optional[float]) -> bool:
+        """
+        Waits for the file to get modified.
+
+        :param timeout: the maximum number of seconds to wait, waits indefinitely if None
+        :type timeout: float
+        :return: True if modified, False if timed out
+        :rtype: bool
+        """
+        name = os.path.basename(self.path)
+        end = None if timeout is None else time() + timeout
+        while True:
+            remaining = None if end is None else max(0.0, end - time())
+            if self._inotify is not None:
+                events = self._inotify.read(timeout=None if remaining is None else int(remaining * 1000))
+                if any([e.name == name for e in events]):
+                    return True
+            else:
+                sleep(POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining))
+                signature = file_signature(self.path)
+                if signature != self._signature:
+                    self._signature = signature
+                    return True
+            if (end is not None) and (time() >= end):
+                return False
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Waits for the file content to change.
+
+        :param timeout: the maximum number of seconds to wait, waits indefinitely if None
+        :type timeout: float
+        :return: True if changed, False if timed out
+        :rtype: bool
+        """
+        end = None if timeout is None else time() + timeout
+        while True:
+            remaining = None if end is None else max(0.0, end - time())
+            if not self._touched(remaining):
+                return False
+            # debounce editors that write in several steps
+            while self._touched(self.debounce):
+                pass
+            digest = file_digest(self.path)
+            if digest != self._digest:
+                self._digest = digest
+                logger().info("File changed: %s" % self.path)
+                return True
+            logger().debug("File touched, but content unchanged: %s" % self.path)
+
+    def close(self):
+        """
+        Stops watching the file.
+        """
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -2,11 +2,14 @@ import argparse
 import traceback
 
 from wai.logging import init_logging, add_logging_level
-from itg.api.outlook import load_calendar
+from itg.api.transport import add_transport_options, init_transport
+from itg.api.outlook import load_calendar, read_calendar
 from itg.api.outlook import filter_events as ofilter_events
-from itg.api.google import init_service
+from itg.api.google import init_service, LIGHT_PROJECTION
 from itg.api.google import filter_events as gfilter_events
 from itg.api.sync import compare, ACTIONS
+from itg.api.drift import scan_events, compare_light
+from itg.api.logs import log_summary
 
 
 PROG = "itg-compare-cals"
@@ -14,7 +17,7 @@ PROG = "itg-compare-cals"
 
 def compare_events(ical_calendar: str, google_credentials: str, google_calendar: str,
                    ical_id: str = None, ical_summary: str = None,
-                   google_id: str = None, google_summary: str = None):
+                   google_id: str = None, google_summary: str = None, light: bool = False):
     """
     Lists the events from the iCal/Outlook calendar.
 
@@ -32,16 +35,28 @@ def compare_events(ical_calendar: str, google_credentials: str, google_calendar:
     :type google_id: str
     :param google_summary: the regular expression that the event summaries must match, ignored if None
     :type google_summary: str
+    :param light: whether to decide changes from identities, LAST-MODIFIED and SEQUENCE where possible (no summary regexps)
+    :type light: bool
     """
-    # outlook
-    ical_cal = load_calendar(ical_calendar)
-    ical_events = ofilter_events(ical_cal, regexp_id=ical_id, regexp_summary=ical_summary)
-
-    # google
-    google_service = init_service(google_credentials)
-    google_events = gfilter_events(google_service, google_calendar, regexp_id=google_id, regexp_summary=google_summary)
-
-    comparison = compare(ical_events, google_events)
+    if light:
+        if (ical_summary is not None) or (google_summary is not None):
+            raise Exception("Summary regexps are not supported in lightweight mode!")
+        ical_events = scan_events(read_calendar(ical_calendar), regexp_id=ical_id)
+        google_service = init_service(google_credentials)
+        google_events = gfilter_events(google_service, google_calendar, regexp_id=google_id, projection=LIGHT_PROJECTION)
+        comparison = compare_light(ical_events, google_events,
+                                   fetch_events=lambda: gfilter_events(google_service, google_calendar, regexp_id=google_id))
+    else:
+        # outlook
+        ical_cal = load_calendar(ical_calendar)
+        ical_events = ofilter_events(ical_cal, regexp_id=ical_id, regexp_summary=ical_summary)
+
+        # google
+        google_service = init_service(google_credentials)
+        google_events = gfilter_events(google_service, google_calendar, regexp_id=google_id, regexp_summary=google_summary)
+
+        comparison = compare(ical_events, google_events)
+    log_summary()
     for action in ACTIONS:
         if action in comparison:
             events = comparison[action]
@@ -64,13 +79,16 @@ def main():
     parser.add_argument('-C', '--google_calendar', metavar="ID", type=str, help='The ID of the Google calendar', required=True)
     parser.add_argument('-I', '--google_id', metavar="REGEXP", type=str, help='The regular expression that the event IDs must match.', required=False, default=None)
     parser.add_argument('-S', '--google_summary', metavar="REGEXP", type=str, help='The regular expression that the event summary must match.', required=False, default=None)
+    parser.add_argument('--light', action="store_true", help='Whether to perform a lightweight comparison: only IDs, LAST-MODIFIED and SEQUENCE get retrieved/scanned to decide whether matched events changed, events with neither get compared field by field; does not support the summary regexps.')
+    add_transport_options(parser)
     add_logging_level(parser)
     parsed = parser.parse_args()
 
     init_logging(default_level=parsed.logging_level)
+    init_transport(record=parsed.record, replay=parsed.replay, latency_scale=parsed.latency_scale)
     compare_events(parsed.ical_calendar, parsed.google_credentials, parsed.google_calendar,
                    ical_id=parsed.ical_id, ical_summary=parsed.ical_summary,
-                   google_id=parsed.google_id, google_summary=parsed.google_summary)
+                   google_id=parsed.google_id, google_summary=parsed.google_summary, light=parsed.light)
 
 
 def sys_main() -> int:
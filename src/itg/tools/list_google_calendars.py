@@ -2,29 +2,24 @@ import argparse
 import traceback
 
 from wai.logging import init_logging, add_logging_level
-from itg.api.google import init_service
+from itg.api.calendars import get_calendars, CACHE_TTL
 
 
 PROG = "itg-list-gcals"
 
 
-def list_calendars(credentials: str):
+def list_calendars(credentials: str, cache_ttl: float = CACHE_TTL, refresh: bool = False):
     """
     Lists the calendars.
 
     :param credentials: the path to the credentials JSON file
     :type credentials: str
+    :param cache_ttl: the number of seconds to use the cached calendar list for, 0 to disable the cache
+    :type cache_ttl: float
+    :param refresh: whether to retrieve the calendars even if the cache is current
+    :type refresh: bool
     """
-    service = init_service(credentials)
-    list_result = (
-        service.calendarList()
-        .list(
-            showDeleted=False,
-            showHidden=False,
-        )
-        .execute()
-    )
-    cals = list_result.get("items", [])
+    cals = get_calendars(credentials, ttl=cache_ttl, refresh=refresh)
 
     if not cals:
         print("No calendars found.")
@@ -43,11 +38,13 @@ def main():
         prog=PROG,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-L', '--google_credentials', metavar="FILE", type=str, help='Path to the Google OAuth credentials JSON file', required=True)
+    parser.add_argument('--cache_ttl', metavar="SECONDS", type=float, help='The number of seconds to use the cached calendar list (in the config dir) for, 0 to disable the cache.', required=False, default=CACHE_TTL)
+    parser.add_argument('-r', '--refresh', action="store_true", help='Whether to retrieve the calendars even if the cached list is current.')
     add_logging_level(parser)
     parsed = parser.parse_args()
 
     init_logging(default_level=parsed.logging_level)
-    list_calendars(parsed.google_credentials)
+    list_calendars(parsed.google_credentials, cache_ttl=parsed.cache_ttl, refresh=parsed.refresh)
 
 
 def sys_main() -> int:
@@ -1,15 +1,20 @@
 import argparse
 import traceback
 
+from typing import List
+
 from wai.logging import init_logging, add_logging_level
 from itg.api.google import init_service, filter_events
-from itg.api.events import event_field, date_range, EVENT_ID, EVENT_SUMMARY, EVENT_START, EVENT_END, EVENT_RECURRENCE, EVENT_ICALUID
+from itg.api.interval import EventIndex
+from itg.api.export import write_events, FORMATS, FORMAT_TEXT, DEFAULT_COLUMNS
+from itg.api.events import EVENT_FIELDS, event_field, EVENT_ID, EVENT_SUMMARY, EVENT_START, EVENT_END, EVENT_RECURRENCE, EVENT_ICALUID
 
 
 PROG = "itg-list-gevents"
 
 
-def list_events(credentials: str, calendar: str, regexp_id: str = None, regexp_summary: str = None):
+def list_events(credentials: str, calendar: str, regexp_id: str = None, regexp_summary: str = None,
+                output_format: str = FORMAT_TEXT, output: str = None, columns: List[str] = None):
     """
     Lists the events from the Google calendar.
 
@@ -21,13 +26,23 @@ def list_events(credentials: str, calendar: str, regexp_id: str = None, regexp_s
     :type regexp_id: str
     :param regexp_summary: the regular expression that the event summaries must match, ignored if None
     :type regexp_summary: str
+    :param output_format: the output format, see itg.api.export.FORMATS
+    :type output_format: str
+    :param output: the file to write the events to (not for text format), uses stdout if None
+    :type output: str
+    :param columns: the event fields to output (not for text format), uses itg.api.export.DEFAULT_COLUMNS if None
+    :type columns: list
     """
     service = init_service(credentials)
     events = filter_events(service, calendar, regexp_id=regexp_id, regexp_summary=regexp_summary)
-    start, end = date_range(events)
+    index = EventIndex(events)
+    if output_format != FORMAT_TEXT:
+        write_events(index.sorted_items(), output_format, output_file=output, columns=columns)
+        return
+    start, end = index.date_range()
     print("Date range:", start, "-", end)
     print()
-    for event in events:
+    for event in index.sorted_items():
         print(event_field(event, EVENT_ID))
         print("   summary:", event_field(event, EVENT_SUMMARY))
         if event_field(event, EVENT_START) is not None:
@@ -52,11 +67,15 @@ def main():
     parser.add_argument('-C', '--google_calendar', metavar="ID", type=str, help='The path or URL of the Outlook calendar', required=True)
     parser.add_argument('-I', '--google_id', metavar="REGEXP", type=str, help='The regular expression that the event IDs must match.', required=False, default=None)
     parser.add_argument('-S', '--google_summary', metavar="REGEXP", type=str, help='The regular expression that the event summary must match.', required=False, default=None)
+    parser.add_argument('-f', '--output_format', choices=FORMATS, help='The format to output the events in.', required=False, default=FORMAT_TEXT)
+    parser.add_argument('-o', '--output', metavar="FILE", type=str, help='The file to write the events to (csv/jsonl/parquet), uses stdout if not specified (not for parquet).', required=False, default=None)
+    parser.add_argument('--columns', choices=EVENT_FIELDS, nargs="+", help='The event fields to output (csv/jsonl/parquet).', required=False, default=DEFAULT_COLUMNS)
     add_logging_level(parser)
     parsed = parser.parse_args()
 
     init_logging(default_level=parsed.logging_level)
-    list_events(parsed.google_credentials, parsed.google_calendar, regexp_id=parsed.google_id, regexp_summary=parsed.google_summary)
+    list_events(parsed.google_credentials, parsed.google_calendar, regexp_id=parsed.google_id, regexp_summary=parsed.google_summary,
+                output_format=parsed.output_format, output=parsed.output, columns=parsed.columns)
 
 
 def sys_main() -> int:
@@ -1,15 +1,20 @@
 import argparse
 import traceback
 
+from typing import List
+
 from wai.logging import init_logging, add_logging_level
 from itg.api.outlook import load_calendar, filter_events
-from itg.api.events import event_field, date_range, EVENT_ID, EVENT_SUMMARY, EVENT_START, EVENT_END, EVENT_RECURRENCE, EVENT_STATUS
+from itg.api.interval import EventIndex
+from itg.api.export import write_events, FORMATS, FORMAT_TEXT, DEFAULT_COLUMNS
+from itg.api.events import EVENT_FIELDS, event_field, EVENT_ID, EVENT_SUMMARY, EVENT_START, EVENT_END, EVENT_RECURRENCE, EVENT_STATUS
 
 
 PROG = "itg-list-oevents"
 
 
-def list_events(calendar: str, regexp_id: str = None, regexp_summary: str = None, output_file: str = None):
+def list_events(calendar: str, regexp_id: str = None, regexp_summary: str = None, output_file: str = None,
+                output_keep: int = 0, output_format: str = FORMAT_TEXT, output: str = None, columns: List[str] = None):
     """
     Lists the events from the iCal/Outlook calendar.
 
@@ -21,13 +26,25 @@ def list_events(calendar: str, regexp_id: str = None, regexp_summary: str = None
     :type regexp_summary: str
     :param output_file: the file to save the iCal/Outlook calendar to, ignored if None
     :type output_file: str
+    :param output_keep: the number of previous versions of the output file to keep
+    :type output_keep: int
+    :param output_format: the output format, see itg.api.export.FORMATS
+    :type output_format: str
+    :param output: the file to write the events to (not for text format), uses stdout if None
+    :type output: str
+    :param columns: the event fields to output (not for text format), uses itg.api.export.DEFAULT_COLUMNS if None
+    :type columns: list
     """
-    cal = load_calendar(calendar, output_file=output_file)
+    cal = load_calendar(calendar, output_file=output_file, output_keep=output_keep)
     events = filter_events(cal, regexp_id=regexp_id, regexp_summary=regexp_summary)
-    start, end = date_range(events)
+    index = EventIndex(events)
+    if output_format != FORMAT_TEXT:
+        write_events(index.sorted_items(), output_format, output_file=output, columns=columns)
+        return
+    start, end = index.date_range()
     print("Date range:", start, "-", end)
     print()
-    for event in events:
+    for event in index.sorted_items():
         print(event_field(event, EVENT_ID))
         if event_field(event, EVENT_SUMMARY) is not None:
             print("   summary:", event_field(event, EVENT_SUMMARY))
@@ -51,12 +68,17 @@ def main():
     parser.add_argument('-i', '--ical_id', metavar="REGEXP", type=str, help='The regular expression that the event IDs must match.', required=False, default=None)
     parser.add_argument('-s', '--ical_summary', metavar="REGEXP", type=str, help='The regular expression that the event summary must match.', required=False, default=None)
     parser.add_argument('--ical_output', metavar="FILE", type=str, help='The file to save the iCal/Outlook calendar data to.', required=False, default=None)
+    parser.add_argument('--ical_output_keep', metavar="NUM", type=int, help='The number of previous versions of the iCal/Outlook calendar data file to keep; the file only gets written when the data changed, use .gz extension for compression.', required=False, default=0)
+    parser.add_argument('-f', '--output_format', choices=FORMATS, help='The format to output the events in.', required=False, default=FORMAT_TEXT)
+    parser.add_argument('-o', '--output', metavar="FILE", type=str, help='The file to write the events to (csv/jsonl/parquet), uses stdout if not specified (not for parquet).', required=False, default=None)
+    parser.add_argument('--columns', choices=EVENT_FIELDS, nargs="+", help='The event fields to output (csv/jsonl/parquet).', required=False, default=DEFAULT_COLUMNS)
     add_logging_level(parser)
     parsed = parser.parse_args()
 
     init_logging(default_level=parsed.logging_level)
     list_events(parsed.ical_calendar, regexp_id=parsed.ical_id, regexp_summary=parsed.ical_summary,
-                output_file=parsed.ical_output)
+                output_file=parsed.ical_output, output_keep=parsed.ical_output_keep,
+                output_format=parsed.output_format, output=parsed.output, columns=parsed.columns)
 
 
 def sys_main() -> int:
@@ -1,15 +1,36 @@
 import argparse
+import json
 import logging
+import threading
 import traceback
 
 from time import sleep
+from typing import List, Dict
 
 from wai.logging import init_logging, add_logging_level
-from itg.api.outlook import load_calendar
+from itg.api.transport import add_transport_options, init_transport
+from itg.api.outlook import load_calendar, DEFAULT_TIMEOUT
 from itg.api.outlook import filter_events as ofilter_events
-from itg.api.google import init_service
+from itg.api.google import init_service, service_credentials
 from itg.api.google import filter_events as gfilter_events
-from itg.api.sync import compare, sync
+from itg.api.sync import compare, sync, aborted, BodyCache, ACTION_ADD
+from itg.api.shard import compare_sharded
+from itg.api.watch import FileWatcher
+from itg.api.push import NotificationReceiver, ChannelManager, IncrementalEvents
+from itg.api.push import DEFAULT_HOST as PUSH_HOST
+from itg.api.bulk import bulk_import
+from itg.api.aio import sync_concurrent
+from itg.api.spill import SpilledEvents
+from itg.api.calendars import validate_calendar
+from itg.api.feeds import FeedCache
+from itg.api.breaker import get_breaker, CircuitBreaker, CircuitOpenError, COOLDOWN
+from itg.api.logs import reset_counters, log_summary, set_sample_limit, SAMPLE_LIMIT
+from itg.api.journal import default_journal_path, load_pending
+from itg.api.guard import guard_deletes, DELETE_RATIO, DELETE_MIN
+from itg.api.health import HealthServer, get_stats, count_actions, DEFAULT_HOST
+from itg.api.quota import apply_budget, attempted_cost, record_usage, QUOTA_COST_LIST
+from itg.api.bidi import plan_bidirectional, load_state, save_state, forget_actions, forget_errors, write_google_changes
+from itg.api.bidi import default_state_path, default_google_output, POLICIES, POLICY_ICAL
 
 
 PROG = "itg-sync-cals"
@@ -31,10 +52,68 @@ def logger() -> logging.Logger:
     return _logger
 
 
+def allow_google(breaker: CircuitBreaker) -> bool:
+    """
+    Checks whether the Google calendar can be accessed in this cycle.
+
+    :param breaker: the circuit breaker of the Google calendar
+    :type breaker: CircuitBreaker
+    :return: always True
+    :rtype: bool
+    """
+    if not breaker.allow():
+        raise CircuitOpenError("Circuit open, skipping: %s" % breaker.name)
+    return True
+
+
+def execute(google_service, google_credentials: str, google_calendar: str, actions: Dict, dry_run: bool = False,
+            journal: str = None, max_errors: int = None, async_concurrency: int = None, bodies: BodyCache = None,
+            timeout: float = DEFAULT_TIMEOUT) -> Dict:
+    """
+    Executes the actions, either sequentially or with concurrent requests (async backend).
+
+    :param google_service: the Google Calendar service instance to use (sequential execution)
+    :param google_credentials: the credentials JSON file to use (async backend)
+    :type google_credentials: str
+    :param google_calendar: the calendar ID
+    :type google_calendar: str
+    :param actions: the dictionary with the add/delete/update event lists
+    :type actions: dict
+    :param dry_run: whether to perform a dry-run only and not change the Google Calendar at all
+    :type dry_run: bool
+    :param journal: the journal file to record planned/completed mutations in, ignored if None
+    :type journal: str
+    :param max_errors: the number of consecutive identical errors after which to abort, never aborts if None
+    :type max_errors: int
+    :param async_concurrency: the number of concurrent requests of the async backend, sequential execution if None
+    :type async_concurrency: int
+    :param bodies: the request body cache of the sync cycle, ignored if None
+    :type bodies: BodyCache
+    :param timeout: the timeout in seconds for the requests of the async backend
+    :type timeout: float
+    :return: the dictionary with events per action that failed
+    :rtype: dict
+    """
+    if async_concurrency is None:
+        return sync(google_service, google_calendar, actions, dry_run=dry_run, journal=journal, max_identical_errors=max_errors,
+                    bodies=bodies)
+    else:
+        return sync_concurrent(google_credentials, google_calendar, actions, dry_run=dry_run, concurrency=async_concurrency,
+                               journal=journal, max_identical_errors=max_errors, bodies=bodies, timeout=timeout)
+
+
 def sync_events(ical_calendar: str, google_credentials: str, google_calendar: str,
-                ical_id: str = None, ical_summary: str = None, ical_output: str = None,
+                ical_id: str = None, ical_summary: str = None, ical_output: str = None, ical_output_keep: int = 0,
                 google_id: str = None, google_summary: str = None,
-                dry_run: bool = False, poll_interval: int = None):
+                dry_run: bool = False, poll_interval: int = None, journal: bool = False,
+                quota_run: int = None, quota_day: int = None,
+                bidirectional: bool = False, conflict_policy: str = POLICY_ICAL, google_output: str = None,
+                google_spill: bool = False, shards: int = None, shard_processes: int = None,
+                watch: bool = False, push_address: str = None, push_port: int = 8080, push_host: str = PUSH_HOST,
+                bulk: bool = False, bulk_workers: int = 1, log_sample: int = SAMPLE_LIMIT,
+                feed_cache: FeedCache = None, timeout: float = DEFAULT_TIMEOUT, max_errors: int = None,
+                breaker_cooldown: float = COOLDOWN, max_delete_ratio: float = DELETE_RATIO, min_deletes: int = DELETE_MIN,
+                confirm_deletes: bool = False, async_concurrency: int = None):
     """
     Syncs the events from the iCal/Outlook calendar with the Google one.
 
@@ -46,6 +125,8 @@ def sync_events(ical_calendar: str, google_credentials: str, google_calendar: st
     :type ical_summary: str
     :param ical_output: the file to save the iCal/Outlook calendar to, ignored if None
     :type ical_output: str
+    :param ical_output_keep: the number of previous versions of the output file to keep
+    :type ical_output_keep: int
     :param google_credentials: the credentials JSON file to use
     :type google_credentials: str
     :param google_calendar: the calendar ID
@@ -58,27 +139,280 @@ def sync_events(ical_calendar: str, google_credentials: str, google_calendar: st
     :type dry_run: bool
     :param poll_interval: the interval in seconds to poll the Outlook calendar, only once if None
     :type poll_interval: int
+    :param journal: whether to keep a write-ahead journal of the mutations in the config dir, allowing interrupted syncs to get resumed
+    :type journal: bool
+    :param quota_run: the maximum number of API units to use per sync cycle, ignored if None
+    :type quota_run: int
+    :param quota_day: the maximum number of API units to use per day, ignored if None
+    :type quota_day: int
+    :param bidirectional: whether to detect changes on both sides, exporting Google-side changes instead of overwriting them
+    :type bidirectional: bool
+    :param conflict_policy: how to resolve events changed on both sides in bidirectional mode, see POLICIES
+    :type conflict_policy: str
+    :param google_output: the .ics file to write the Google-side changes to in bidirectional mode, uses the config dir if None
+    :type google_output: str
+    :param google_spill: whether to store the Google events in a temporary database rather than in memory (not in bidirectional mode)
+    :type google_spill: bool
+    :param shards: the number of shards (by UID hash) to compare the events in, compares all at once if None
+    :type shards: int
+    :param shard_processes: the number of processes for comparing the shards in parallel, sequentially if None
+    :type shard_processes: int
+    :param watch: whether to sync whenever the local iCal/Outlook calendar file changes (poll_interval becomes the maximum wait)
+    :type watch: bool
+    :param push_address: the public HTTPS URL for Google Calendar push notifications (forwarding to push_port), polls Google if None
+    :type push_address: str
+    :param push_port: the local port to receive the push notifications on
+    :type push_port: int
+    :param push_host: the host/interface to receive the push notifications on, empty string for all interfaces
+    :type push_host: str
+    :param bulk: whether the Google calendar is known to be empty and the events can be imported without comparison (first cycle only)
+    :type bulk: bool
+    :param bulk_workers: the number of concurrent batch requests when importing into an empty Google calendar
+    :type bulk_workers: int
+    :param log_sample: the maximum number of log messages per event type (adding, updating, ...) and cycle, no limit if negative
+    :type log_sample: int
+    :param feed_cache: the cache for sharing the iCal/Outlook calendar with other jobs in this process, ignored if None
+    :type feed_cache: FeedCache
+    :param timeout: the timeout in seconds for downloading the iCal/Outlook calendar and for Google API requests
+    :type timeout: float
+    :param max_errors: the number of consecutive identical errors after which to abort the sync of a cycle, never aborts if None
+    :type max_errors: int
+    :param breaker_cooldown: the initial number of seconds to skip a calendar after repeated failures (doubles while failures persist)
+    :type breaker_cooldown: float
+    :param max_delete_ratio: the maximum fraction of Google events to delete before holding the deletes until observed again or confirmed, disabled if None or 1 or larger
+    :type max_delete_ratio: float
+    :param min_deletes: the minimum number of deletes before the delete ratio gets checked
+    :type min_deletes: int
+    :param confirm_deletes: whether to execute deletes right away even if the delete ratio is exceeded
+    :type confirm_deletes: bool
+    :param async_concurrency: the number of concurrent requests for executing the mutations with the async backend (requires aiohttp), sequentially if None
+    :type async_concurrency: int
+    """
+    stats = get_stats(google_calendar)
+    if google_spill and bidirectional:
+        raise Exception("Spilling the Google events is not supported in bidirectional mode!")
+    validate_calendar(google_credentials, google_calendar, writable=not dry_run)
+
+    journal_path = None
+    if journal and not dry_run:
+        journal_path = default_journal_path(google_calendar)
+    state_path = None
+    if bidirectional:
+        state_path = default_state_path(google_calendar)
+        if google_output is None:
+            google_output = default_google_output(google_calendar)
+
+    watcher = None
+    if watch:
+        if ical_calendar.startswith("http:") or ical_calendar.startswith("https:"):
+            raise Exception("Watch mode requires a local iCal/Outlook calendar file: %s" % ical_calendar)
+        watcher = FileWatcher(ical_calendar)
+
+    receiver = None
+    channels = None
+    incremental = None
+    refetch = True
+    if push_address is not None:
+        receiver = NotificationReceiver(push_port, host=push_host)
+
+    set_sample_limit(None if log_sample < 0 else log_sample)
+
+    ibreaker = get_breaker("ical:" + ical_calendar, cooldown=breaker_cooldown)
+    gbreaker = get_breaker("google:" + google_calendar, cooldown=breaker_cooldown)
+
+    try:
+        while True:
+            reset_counters()
+            stats.start()
+            outstanding = 0
+            # request bodies get built once per event and cycle
+            bodies = BodyCache()
+
+            # interrupted sync? resume outstanding mutations, skipping the listing/comparison of this cycle
+            pending = None
+            if journal_path is not None:
+                pending = load_pending(journal_path)
+
+            google_started = False
+            google_events = None
+            try:
+                if pending is not None:
+                    logger().info("Resuming interrupted sync from journal: %s" % journal_path)
+                    google_started = allow_google(gbreaker)
+                    google_service = init_service(google_credentials, timeout=timeout)
+                    # deferred ones get planned again by the next comparison
+                    pending, deferred = apply_budget(pending, run_budget=quota_run, day_budget=quota_day)
+                    outstanding = count_actions(deferred)
+                    stats.planned(count_actions(pending))
+                    errors = execute(google_service, google_credentials, google_calendar, pending, dry_run=dry_run,
+                                     journal=journal_path, max_errors=max_errors, async_concurrency=async_concurrency, bodies=bodies,
+                                     timeout=timeout)
+                    record_usage(attempted_cost(pending, errors))
+                else:
+                    # outlook
+                    feed = None
+                    if feed_cache is None:
+                        ical_cal = ibreaker.call(load_calendar, ical_calendar, output_file=ical_output, output_keep=ical_output_keep, timeout=timeout)
+                    else:
+                        feed = ibreaker.call(feed_cache.get, ical_calendar, output_file=ical_output, output_keep=ical_output_keep, timeout=timeout)
+                        ical_cal = feed.calendar
+                    google_started = allow_google(gbreaker)
+                    google_service = init_service(google_credentials, timeout=timeout)
+
+                    if bulk:
+                        # target known to be empty: insert the events in batches, without listing/comparing
+                        if feed is None:
+                            ical_events = ofilter_events(ical_cal, regexp_id=ical_id, regexp_summary=ical_summary)
+                        else:
+                            ical_events = feed.filter(regexp_id=ical_id, regexp_summary=ical_summary)
+                        budget = (quota_run is not None) or (quota_day is not None)
+                        comparison, deferred = apply_budget({ACTION_ADD: ical_events}, run_budget=quota_run, day_budget=quota_day)
+                        outstanding = count_actions(deferred)
+                        ical_events = comparison.get(ACTION_ADD, [])
+                        stats.planned(len(ical_events))
+                        errors = bulk_import(google_service, google_calendar, ical_events, workers=bulk_workers, dry_run=dry_run,
+                                             credentials=service_credentials(google_credentials), journal=journal_path, bodies=bodies,
+                                             timeout=timeout, max_identical_errors=max_errors)
+                        if budget and not dry_run:
+                            record_usage(attempted_cost({ACTION_ADD: ical_events}, errors))
+                        bulk = False
+                        refetch = True
+                    else:
+                        if feed is None:
+                            ical_events = ofilter_events(ical_cal, regexp_id=ical_id, regexp_summary=ical_summary)
+                        else:
+                            ical_events = feed.filter(regexp_id=ical_id, regexp_summary=ical_summary)
+
+                        # google
+                        if receiver is not None:
+                            if channels is None:
+                                channels = ChannelManager(google_service, google_calendar, push_address, receiver)
+                                incremental = IncrementalEvents(google_service, google_calendar)
+                            channels.service = google_service
+                            incremental.service = google_service
+                            channels.ensure()
+                            if refetch or receiver.is_dirty(google_calendar):
+                                receiver.clear(google_calendar)
+                                incremental.fetch()
+                            google_events = incremental.events(regexp_id=google_id, regexp_summary=google_summary)
+                        else:
+                            google_events = gfilter_events(google_service, google_calendar, regexp_id=google_id, regexp_summary=google_summary, spill=google_spill)
+
+                        # only empty if not restricted to some of the Google events
+                        empty = (len(google_events) == 0) and (google_id is None) and (google_summary is None)
+                        if empty and (len(ical_events) > 0) and not bidirectional:
+                            logger().info("Google calendar empty, performing bulk import: %s" % google_calendar)
+                            comparison, deferred = apply_budget({ACTION_ADD: ical_events}, run_budget=quota_run, day_budget=quota_day)
+                            outstanding = count_actions(deferred)
+                            stats.planned(count_actions(comparison))
+                            errors = bulk_import(google_service, google_calendar, comparison.get(ACTION_ADD, []), workers=bulk_workers,
+                                                 dry_run=dry_run, credentials=service_credentials(google_credentials), journal=journal_path,
+                                                 bodies=bodies, timeout=timeout, max_identical_errors=max_errors)
+                            if not dry_run:
+                                record_usage(QUOTA_COST_LIST + attempted_cost(comparison, errors))
+                            refetch = True
+                        else:
+                            if bidirectional:
+                                comparison, changes, state = plan_bidirectional(ical_events, google_events, load_state(state_path), policy=conflict_policy)
+                            elif shards is not None:
+                                comparison = compare_sharded(ical_events, google_events, shards, processes=shard_processes)
+                            else:
+                                comparison = compare(ical_events, google_events)
+                            comparison, held = guard_deletes(comparison, len(google_events), google_calendar, max_ratio=max_delete_ratio,
+                                                             min_deletes=min_deletes, confirm=confirm_deletes, record=not dry_run)
+                            comparison, deferred = apply_budget(comparison, run_budget=quota_run, day_budget=quota_day)
+                            outstanding = count_actions(deferred) + count_actions(held)
+                            stats.planned(count_actions(comparison))
+                            errors = execute(google_service, google_credentials, google_calendar, comparison, dry_run=dry_run,
+                                             journal=journal_path, max_errors=max_errors, async_concurrency=async_concurrency, bodies=bodies,
+                                             timeout=timeout)
+                            if not dry_run:
+                                record_usage(QUOTA_COST_LIST + attempted_cost(comparison, errors))
+                                if bidirectional:
+                                    write_google_changes(changes, google_output)
+                                    save_state(state_path, forget_errors(forget_actions(forget_actions(state, deferred), held), errors))
+                            # own changes need fetching as well
+                            refetch = len(comparison) > 0
+            except CircuitOpenError as e:
+                logger().warning(str(e))
+                errors = dict()
+                stats.finish(False, error=str(e))
+            except Exception:
+                stats.finish(False, error=traceback.format_exc().strip().splitlines()[-1])
+                if poll_interval is None:
+                    raise
+                logger().error("Sync cycle failed: %s" % google_calendar, exc_info=True)
+                errors = dict()
+                if google_started:
+                    gbreaker.failure()
+            else:
+                if aborted(errors):
+                    gbreaker.failure()
+                elif google_started:
+                    gbreaker.success()
+                stats.finish(not aborted(errors), errors=errors, outstanding=outstanding)
+            finally:
+                if isinstance(google_events, SpilledEvents):
+                    google_events.close()
+            num_errors = sum([len(errors[x]) for x in errors])
+            if num_errors > 0:
+                logger().warning("%d errors occurred!" % num_errors)
+            log_summary()
+
+            if watcher is not None:
+                logger().info("Waiting for changes to: %s" % ical_calendar)
+                watcher.wait(timeout=poll_interval)
+            elif poll_interval is None:
+                break
+            elif receiver is not None:
+                logger().info("Waiting up to %d seconds for next poll or Google notification..." % poll_interval)
+                receiver.wait(google_calendar, timeout=poll_interval)
+            else:
+                logger().info("Waiting %d seconds before next poll..." % poll_interval)
+                sleep(poll_interval)
+    finally:
+        if channels is not None:
+            channels.stop()
+        if receiver is not None:
+            receiver.close()
+        if watcher is not None:
+            watcher.close()
+
+
+def sync_jobs(jobs: List[Dict], **kwargs):
     """
-    while True:
-        # outlook
-        ical_cal = load_calendar(ical_calendar, output_file=ical_output)
-        ical_events = ofilter_events(ical_cal, regexp_id=ical_id, regexp_summary=ical_summary)
+    Runs several sync jobs concurrently (one thread each), sharing the downloaded and parsed
+    iCal/Outlook calendars between jobs that use the same feed.
 
-        # google
-        google_service = init_service(google_credentials)
-        google_events = gfilter_events(google_service, google_calendar, regexp_id=google_id, regexp_summary=google_summary)
+    :param jobs: the jobs, each a dictionary with the parameters of sync_events that differ from the common ones (e.g., google_calendar, ical_id)
+    :type jobs: list
+    :param kwargs: the common parameters of sync_events
+    """
+    if kwargs.get("push_address") is not None:
+        raise Exception("Push notifications are not supported with multiple jobs!")
+    feed_cache = FeedCache()
 
-        comparison = compare(ical_events, google_events)
-        errors = sync(google_service, google_calendar, comparison, dry_run=dry_run)
-        num_errors = sum([len(errors[x]) for x in errors])
-        if num_errors > 0:
-            logger().warning("%d errors occurred!")
+    def run(params):
+        try:
+            sync_events(**params)
+        except:
+            logger().error("Job failed: %s" % params.get("google_calendar"), exc_info=True)
 
-        if poll_interval is None:
-            break
-        else:
-            logger().info("Waiting %d seconds before next poll..." % poll_interval)
-            sleep(poll_interval)
+    threads = []
+    for job in jobs:
+        params = dict(kwargs)
+        params.update(job)
+        params["feed_cache"] = feed_cache
+        feed_cache.subscribe(params.get("ical_calendar"), params.get("poll_interval"))
+        if params.get("google_calendar") is None:
+            raise Exception("No Google calendar specified for job: %s" % str(job))
+        # register before starting, jobs failing early must not go unnoticed by the readiness check
+        get_stats(params["google_calendar"])
+        threads.append(threading.Thread(target=run, args=(params,), name=params["google_calendar"]))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
 
 def main():
@@ -90,21 +424,72 @@ def main():
     parser.add_argument('-i', '--ical_id', metavar="REGEXP", type=str, help='The regular expression that the event IDs must match.', required=False, default=None)
     parser.add_argument('-s', '--ical_summary', metavar="REGEXP", type=str, help='The regular expression that the event summary must match.', required=False, default=None)
     parser.add_argument('--ical_output', metavar="FILE", type=str, help='The file to save the iCal/Outlook calendar data to.', required=False, default=None)
+    parser.add_argument('--ical_output_keep', metavar="NUM", type=int, help='The number of previous versions of the iCal/Outlook calendar data file to keep; the file only gets written when the data changed, use .gz extension for compression.', required=False, default=0)
     parser.add_argument('-L', '--google_credentials', metavar="FILE", type=str, help='Path to the Google OAuth credentials JSON file', required=True)
-    parser.add_argument('-C', '--google_calendar', metavar="ID", type=str, help='The path or URL of the Outlook calendar', required=True)
+    parser.add_argument('-C', '--google_calendar', metavar="ID", type=str, help='The path or URL of the Outlook calendar', required=False, default=None)
     parser.add_argument('-I', '--google_id', metavar="REGEXP", type=str, help='The regular expression that the event IDs must match.', required=False, default=None)
     parser.add_argument('-S', '--google_summary', metavar="REGEXP", type=str, help='The regular expression that the event summary must match.', required=False, default=None)
+    parser.add_argument('--google_spill', action="store_true", help='Whether to store the Google events in a temporary database rather than in memory, for very large calendars (not in bidirectional mode).')
+    parser.add_argument('--shards', metavar="NUM", type=int, help='The number of shards (by UID hash) to compare the events in, limiting the memory for very large calendars.', required=False, default=None)
+    parser.add_argument('--shard_processes', metavar="NUM", type=int, help='The number of processes to compare the shards in parallel.', required=False, default=None)
     parser.add_argument('-n', '--dry_run', action="store_true", help='Whether to perform a dry-run instead, not changing Google calendar at all.')
     parser.add_argument('-p', '--poll_interval', metavar="SEC", type=int, help='The interval to poll the Outlook calendar in seconds.', required=False, default=None)
+    parser.add_argument('--quota_run', metavar="UNITS", type=int, help='The maximum number of Google API units to use per sync cycle; actions for events closest to now take precedence, the rest gets deferred.', required=False, default=None)
+    parser.add_argument('--quota_day', metavar="UNITS", type=int, help='The maximum number of Google API units to use per day (usage is stored in the config dir).', required=False, default=None)
+    parser.add_argument('-b', '--bidirectional', action="store_true", help='Whether to detect changes on both sides (using the last-synced state in the config dir) and export Google-side changes rather than overwriting them.')
+    parser.add_argument('--conflict_policy', choices=POLICIES, help='How to resolve events that changed on both sides in bidirectional mode.', required=False, default=POLICY_ICAL)
+    parser.add_argument('--google_output', metavar="FILE", type=str, help='The .ics file to write the Google-side changes to in bidirectional mode; uses the config dir if not specified.', required=False, default=None)
+    parser.add_argument('-w', '--watch', action="store_true", help='Whether to sync whenever the local iCal/Outlook calendar file changes; the poll interval becomes the maximum time between syncs.')
+    parser.add_argument('--push_address', metavar="URL", type=str, help='The public HTTPS URL for receiving Google Calendar push notifications (forwarding to the push port); Google events get fetched incrementally when notified instead of every poll.', required=False, default=None)
+    parser.add_argument('--push_port', metavar="PORT", type=int, help='The local port to receive the Google Calendar push notifications on.', required=False, default=8080)
+    parser.add_argument('--push_host', metavar="HOST", type=str, help='The host/interface to receive the Google Calendar push notifications on; use an empty string for all interfaces.', required=False, default=PUSH_HOST)
+    parser.add_argument('--bulk_import', action="store_true", help='Whether the Google calendar is known to be empty, importing the events without listing/comparing in the first cycle (empty calendars get detected automatically otherwise).')
+    parser.add_argument('--bulk_workers', metavar="NUM", type=int, help='The number of concurrent batch requests when importing into an empty Google calendar.', required=False, default=1)
+    parser.add_argument('--log_sample', metavar="NUM", type=int, help='The maximum number of log messages per event type (adding, updating, ...) and sync cycle, with a summary of the counts at the end of each cycle; no limit if negative.', required=False, default=SAMPLE_LIMIT)
+    parser.add_argument('--timeout', metavar="SEC", type=float, help='The timeout in seconds for downloading the iCal/Outlook calendar and for Google API requests.', required=False, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--max_errors', metavar="NUM", type=int, help='The number of consecutive identical errors after which to abort the sync of a cycle.', required=False, default=5)
+    parser.add_argument('--breaker_cooldown', metavar="SEC", type=float, help='The initial number of seconds to skip a calendar after repeated failures when polling (doubles while failures persist).', required=False, default=COOLDOWN)
+    parser.add_argument('--max_delete_ratio', metavar="RATIO", type=float, help='The maximum fraction of Google events to delete in one sync (e.g., due to a truncated iCal/Outlook calendar); more deletes get held until the next sync plans the same deletes or they get confirmed; use 1 to disable.', required=False, default=DELETE_RATIO)
+    parser.add_argument('--min_deletes', metavar="NUM", type=int, help='The minimum number of deletes before the delete ratio gets checked.', required=False, default=DELETE_MIN)
+    parser.add_argument('--confirm_deletes', action="store_true", help='Whether to execute held/abnormal numbers of deletes right away.')
+    parser.add_argument('--async_concurrency', metavar="NUM", type=int, help='The number of concurrent requests for executing the mutations with the async backend (requires aiohttp); executes them one by one if not specified.', required=False, default=None)
+    parser.add_argument('--health_port', metavar="PORT", type=int, help='The port to serve the health of the sync jobs on (/health, /ready, /metrics), e.g., for supervisors when polling.', required=False, default=None)
+    parser.add_argument('--health_host', metavar="HOST", type=str, help='The host/interface to serve the health of the sync jobs on; use an empty string for all interfaces (no authentication!).', required=False, default=DEFAULT_HOST)
+    parser.add_argument('--health_stale', metavar="SEC", type=float, help='The seconds without a sync cycle starting/ending after which /health reports a job as stuck; uses three times the poll interval plus the timeout if not specified.', required=False, default=None)
+    parser.add_argument('--jobs', metavar="FILE", type=str, help='The JSON file with a list of sync jobs to run concurrently, sharing the download of iCal/Outlook calendars; each job is an object with the options that differ from the command-line ones, e.g., google_calendar, ical_id, ical_summary.', required=False, default=None)
+    parser.add_argument('-j', '--journal', action="store_true", help='Whether to keep a journal of the mutations in the config dir to resume interrupted syncs.')
+    add_transport_options(parser)
     add_logging_level(parser)
     parsed = parser.parse_args()
 
     init_logging(default_level=parsed.logging_level)
-    sync_events(parsed.ical_calendar, parsed.google_credentials, parsed.google_calendar,
-                ical_id=parsed.ical_id, ical_summary=parsed.ical_summary,
-                ical_output=parsed.ical_output,
-                google_id=parsed.google_id, google_summary=parsed.google_summary,
-                dry_run=parsed.dry_run, poll_interval=parsed.poll_interval)
+    init_transport(record=parsed.record, replay=parsed.replay, latency_scale=parsed.latency_scale)
+    if parsed.health_port is not None:
+        stale_after = parsed.health_stale
+        if (stale_after is None) and (parsed.poll_interval is not None):
+            stale_after = 3 * parsed.poll_interval + parsed.timeout
+        HealthServer(parsed.health_port, host=parsed.health_host, stale_after=stale_after)
+    params = dict(ical_calendar=parsed.ical_calendar, google_credentials=parsed.google_credentials, google_calendar=parsed.google_calendar,
+                  ical_id=parsed.ical_id, ical_summary=parsed.ical_summary,
+                  ical_output=parsed.ical_output, ical_output_keep=parsed.ical_output_keep,
+                  google_id=parsed.google_id, google_summary=parsed.google_summary,
+                  dry_run=parsed.dry_run, poll_interval=parsed.poll_interval, journal=parsed.journal,
+                  quota_run=parsed.quota_run, quota_day=parsed.quota_day,
+                  bidirectional=parsed.bidirectional, conflict_policy=parsed.conflict_policy, google_output=parsed.google_output,
+                  google_spill=parsed.google_spill, shards=parsed.shards, shard_processes=parsed.shard_processes,
+                  watch=parsed.watch, push_address=parsed.push_address, push_port=parsed.push_port, push_host=parsed.push_host,
+                  bulk=parsed.bulk_import, bulk_workers=parsed.bulk_workers, log_sample=parsed.log_sample,
+                  timeout=parsed.timeout, max_errors=parsed.max_errors, breaker_cooldown=parsed.breaker_cooldown,
+                  max_delete_ratio=parsed.max_delete_ratio, min_deletes=parsed.min_deletes, confirm_deletes=parsed.confirm_deletes,
+                  async_concurrency=parsed.async_concurrency)
+    if parsed.jobs is not None:
+        with open(parsed.jobs) as fp:
+            jobs = json.load(fp)
+        sync_jobs(jobs, **params)
+    elif parsed.google_calendar is not None:
+        sync_events(**params)
+    else:
+        raise Exception("Either Google calendar or jobs file must be specified!")
 
 
 def sys_main() -> int: